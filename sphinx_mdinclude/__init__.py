@@ -8,11 +8,29 @@ Markdown extension for Sphinx
 __author__ = "Hiroyuki Takagi <miyako.dev@gmail.com>"
 from .__version__ import __version__
 
-from .render import convert, RestMarkdown
+from .metadata import ConversionResult, DocumentMetadata
+from .render import (
+    convert,
+    convert_many,
+    convert_with_metadata,
+    dump_tokens,
+    load_tokens,
+    parse_tokens,
+    render_tokens,
+    RestMarkdown,
+)
 from .sphinx import setup
 
 __all__ = [
+    "ConversionResult",
     "convert",
+    "convert_many",
+    "convert_with_metadata",
+    "DocumentMetadata",
+    "dump_tokens",
+    "load_tokens",
+    "parse_tokens",
+    "render_tokens",
     "RestMarkdown",
     "setup",
 ]
@@ -0,0 +1,138 @@
+"""
+Command line interface
+"""
+
+import argparse
+import json
+import sys
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+from typing import List, Optional
+
+from . import bench
+from .check import check_files, ERROR
+from .render import convert
+from .server import Client, DEFAULT_CACHE_SIZE, serve
+from .watch import Watcher
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m sphinx_mdinclude")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    server = commands.add_parser("serve", help="run a local conversion server")
+    server.add_argument("--socket", help="listen on a Unix socket at this path")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=8787)
+    server.add_argument("--workers", type=int, default=None)
+    server.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+
+    converter = commands.add_parser("convert", help="convert markdown files to rst")
+    converter.add_argument("files", nargs="*", help="files to convert (default stdin)")
+    converter.add_argument("--socket", help="convert using the server at this path")
+    converter.add_argument("--port", type=int, help="convert using a local TCP server")
+
+    checker = commands.add_parser("check", help="check markdown files for problems")
+    checker.add_argument("files", nargs="+", help="files to check")
+    checker.add_argument(
+        "--docutils", action="store_true", help="run docutils on suspicious blocks"
+    )
+    checker.add_argument("-j", "--jobs", type=int, default=None)
+    checker.add_argument("--json", action="store_true", help="report as json")
+
+    watcher = commands.add_parser("watch", help="convert markdown files on change")
+    watcher.add_argument("root", help="directory of markdown files to watch")
+    watcher.add_argument(
+        "-o", "--output", help="directory for rst files (default next to sources)"
+    )
+    watcher.add_argument(
+        "--interval", type=float, default=0.1, help="seconds between scans"
+    )
+
+    bencher = commands.add_parser("bench", help="benchmark complete sphinx builds")
+    bencher.add_argument("--pages", type=int, default=50, help="markdown pages")
+    bencher.add_argument(
+        "--includes", type=int, default=10, help="rst pages using mdinclude"
+    )
+    bencher.add_argument("--shared", type=int, default=5, help="shared includes")
+    bencher.add_argument(
+        "--fan-in", type=int, default=3, help="shared includes per rst page"
+    )
+    bencher.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="numbers of parallel jobs to build with",
+    )
+    bencher.add_argument(
+        "--modes", nargs="+", choices=bench.MODES, default=list(bench.MODES)
+    )
+    bencher.add_argument(
+        "--no-docs", action="store_true", help="skip building the repo's own docs"
+    )
+    bencher.add_argument("--json", action="store_true", help="report as json")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "watch":
+        try:
+            Watcher(args.root, args.output).watch(args.interval)
+        except KeyboardInterrupt:
+            pass
+        return 0
+
+    if args.command == "bench":
+        with tempfile.TemporaryDirectory(prefix="sphinx-mdinclude-bench-") as tmp:
+            projects = [
+                bench.generate_project(
+                    Path(tmp), args.pages, args.includes, args.shared, args.fan_in
+                )
+            ]
+            if not args.no_docs and bench.DOCS_DIR.is_dir():
+                projects.append(bench.docs_project())
+            timings = bench.bench(projects, args.jobs, args.modes)
+        if args.json:
+            print(json.dumps([asdict(t) for t in timings], indent=2))
+        else:
+            print(bench.format_results(timings))
+        return 0
+
+    if args.command == "serve":
+        serve(args.socket, args.host, args.port, args.workers, args.cache_size)
+        return 0
+
+    if args.command == "check":
+        results = check_files(args.files, args.docutils, args.jobs)
+        diagnostics = [d for path in args.files for d in results[path]]
+        if args.json:
+            print(json.dumps([d._asdict() for d in diagnostics], indent=2))
+        else:
+            for diagnostic in diagnostics:
+                print(diagnostic)
+        return 1 if any(d.level == ERROR for d in diagnostics) else 0
+
+    texts = []
+    for name in args.files or ["-"]:
+        if name == "-":
+            texts.append(sys.stdin.read())
+        else:
+            with open(name, encoding="utf-8") as f:
+                texts.append(f.read())
+
+    if args.socket or args.port:
+        client = Client(args.socket, port=args.port or 8787)
+        try:
+            outputs = client.convert_many(texts)
+        finally:
+            client.close()
+    else:
+        outputs = [convert(text) for text in texts]
+    sys.stdout.write("\n".join(outputs))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Asyncio conversion API
+"""
+
+import asyncio
+import codecs
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, AsyncIterable, Iterable, List, Optional, Union
+
+from .parse import Budget, ConversionLimits
+from .render import get_converter, RestMarkdown
+
+Source = Union[str, bytes, AsyncIterable[bytes]]
+
+DEFAULT_CONCURRENCY = 8
+
+_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor() -> Executor:
+    """Return the shared thread pool used for conversions by default."""
+    global _EXECUTOR
+
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(thread_name_prefix="sphinx-mdinclude")
+        return _EXECUTOR
+
+
+async def _read(source: Source, encoding: str) -> str:
+    if isinstance(source, str):
+        return source
+    if isinstance(source, bytes):
+        return source.decode(encoding)
+
+    decoder = codecs.getincrementaldecoder(encoding)()
+    chunks = [decoder.decode(chunk) async for chunk in source]
+    chunks.append(decoder.decode(b"", final=True))
+    return "".join(chunks)
+
+
+def _convert(converter: RestMarkdown, text: str, budget: Optional[Budget]) -> str:
+    state = converter.block.state_cls()
+    if budget is not None:
+        state.env["budget"] = budget
+    output, _ = converter.parse(text, state)
+    return output
+
+
+async def aconvert(
+    source: Source,
+    *,
+    timeout: Optional[float] = None,
+    executor: Optional[Executor] = None,
+    encoding: str = "utf-8",
+    **kwargs: Any,
+) -> str:
+    """Convert Markdown to RST without blocking the event loop.
+
+    The source may be text, bytes, or an async iterable of byte chunks. Conversion
+    runs on ``executor``, or a shared thread pool, using a warm converter for the
+    given options. If the call times out, :class:`asyncio.TimeoutError` is raised;
+    on timeout or cancellation, the conversion in the worker thread is stopped at
+    its next budget check.
+    """
+    text = await _read(source, encoding)
+    converter = get_converter(**kwargs)
+
+    # a budget even without limits, so the worker can be cancelled
+    budget = (converter.limits or ConversionLimits()).start(text)
+
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        executor or get_executor(), _convert, converter, text, budget
+    )
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except BaseException:
+        budget.cancel()
+        raise
+
+
+async def aconvert_many(
+    sources: Iterable[Source],
+    *,
+    limit: int = DEFAULT_CONCURRENCY,
+    timeout: Optional[float] = None,
+    executor: Optional[Executor] = None,
+    encoding: str = "utf-8",
+    return_exceptions: bool = False,
+    **kwargs: Any,
+) -> List[Any]:
+    """Convert many documents, with at most ``limit`` conversions in flight.
+
+    Results are returned in the order of ``sources``. With ``return_exceptions``,
+    failed or timed out conversions return their exception instead of raising.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(source: Source) -> str:
+        async with semaphore:
+            return await aconvert(
+                source,
+                timeout=timeout,
+                executor=executor,
+                encoding=encoding,
+                **kwargs,
+            )
+
+    return await asyncio.gather(
+        *(bounded(source) for source in sources),
+        return_exceptions=return_exceptions,
+    )
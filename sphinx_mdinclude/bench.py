@@ -0,0 +1,257 @@
+"""
+Benchmarks of complete Sphinx builds of Markdown projects
+"""
+
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass, field, replace
+from io import StringIO
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+from sphinx.application import Sphinx
+from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+COLD = "cold"
+NOOP = "noop"
+INCREMENTAL = "incremental"
+MODES = (COLD, NOOP, INCREMENTAL)
+PHASES = ("init", "read", "pickle", "write")
+
+DOCS_DIR = Path(__file__).resolve().parent.parent / "docs"
+# files outside the docs that they include
+DOCS_CONTEXT = ("README.md", "CHANGELOG.md")
+# options that keep the repo's docs from reaching the network
+DOCS_OVERRIDES: Dict[str, Any] = {"intersphinx_mapping": {}}
+
+PAGE = """\
+# Page {n}
+
+Paragraph with *emphasis*, **strong**, `code`, and a [link](https://example.com/{n}).
+
+## Section {n}
+
+* item one
+  * nested item with :code:`role` markup
+* item two
+
+| column | value |
+| ------ | ----- |
+| a      | {n}   |
+
+```python
+def page_{n}():
+    return {n}
+```
+
+.. note::
+
+   A directive in Markdown.
+
+"""
+
+SHARED = """\
+## Shared {n}
+
+Shared content, with *emphasis* and a footnote[^s{n}].
+
+1. first
+2. second
+
+[^s{n}]: The footnote.
+"""
+
+
+@dataclass
+class Project:
+    """A Sphinx project to benchmark, and how to change it for incremental builds."""
+
+    name: str
+    srcdir: Path
+    confoverrides: Dict[str, Any] = field(default_factory=dict)
+    touch: Optional[Path] = None
+    #: files next to ``srcdir`` that it includes
+    context: Sequence[Path] = ()
+
+
+@dataclass
+class BuildTiming:
+    project: str
+    mode: str
+    jobs: int
+    docs: int = 0
+    init: float = 0.0
+    read: float = 0.0
+    pickle: float = 0.0
+    write: float = 0.0
+    total: float = 0.0
+
+
+def generate_project(
+    root: Path,
+    pages: int = 50,
+    includes: int = 10,
+    shared: int = 5,
+    fan_in: int = 3,
+    repeat: int = 4,
+) -> Project:
+    """Write a synthetic project to ``root``.
+
+    The project has ``pages`` Markdown documents, and ``includes`` rst documents
+    that each ``mdinclude`` ``fan_in`` of the ``shared`` Markdown files. Every
+    Markdown page repeats its content ``repeat`` times.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "conf.py").write_text(
+        "extensions = ['sphinx_mdinclude']\nexclude_patterns = ['_shared']\n"
+    )
+    docnames = []
+    for n in range(pages):
+        docnames.append("page{}".format(n))
+        (root / "page{}.md".format(n)).write_text(PAGE.format(n=n) * repeat)
+
+    (root / "_shared").mkdir(exist_ok=True)
+    for n in range(shared):
+        (root / "_shared" / "shared{}.md".format(n)).write_text(SHARED.format(n=n))
+
+    for n in range(includes):
+        lines = ["Include {}".format(n), "============", ""]
+        for i in range(fan_in):
+            target = "_shared/shared{}.md".format((n + i) % max(shared, 1))
+            lines += [".. mdinclude:: {}".format(target), ""]
+        docnames.append("include{}".format(n))
+        (root / "include{}.rst".format(n)).write_text("\n".join(lines))
+
+    toctree = "\n".join("   {}".format(name) for name in docnames)
+    (root / "index.rst").write_text(
+        "Index\n=====\n\n.. toctree::\n\n{}\n".format(toctree)
+    )
+
+    touch = root / "_shared" / "shared0.md" if shared and includes else None
+    return Project("synthetic", root, touch=touch)
+
+
+def docs_project() -> Project:
+    """The repo's own documentation, as a real-world project."""
+    context = [DOCS_DIR.parent / name for name in DOCS_CONTEXT]
+    return Project(
+        "docs",
+        DOCS_DIR,
+        DOCS_OVERRIDES,
+        DOCS_DIR / "included.md",
+        [path for path in context if path.exists()],
+    )
+
+
+def copy_project(project: Project, root: Path) -> Project:
+    """Copy a project into ``root``, so that incremental builds change the copy."""
+    srcdir = root / project.srcdir.name
+    shutil.copytree(project.srcdir, srcdir, ignore=shutil.ignore_patterns("_build"))
+    for path in project.context:
+        shutil.copy2(path, root / path.relative_to(project.srcdir.parent))
+    touch = None
+    if project.touch is not None:
+        touch = srcdir / project.touch.relative_to(project.srcdir)
+    return replace(project, srcdir=srcdir, touch=touch, context=())
+
+
+class PhaseTimer:
+    """Record when each phase of a build starts, from Sphinx events."""
+
+    def __init__(self, app: Sphinx, started: float) -> None:
+        self.marks = {"init": started}
+        self.docs = 0
+        app.connect("env-before-read-docs", self.before_read)
+        app.connect("env-updated", self.mark("pickle"))
+        app.connect("env-check-consistency", self.mark("write"))
+        app.connect("build-finished", self.mark("end"))
+
+    def before_read(self, app: Sphinx, env: Any, docnames: List[str]) -> None:
+        self.marks["read"] = time.perf_counter()
+        self.docs = len(docnames)
+
+    def mark(self, phase: str) -> Any:
+        def record(*args: Any) -> None:
+            self.marks[phase] = time.perf_counter()
+
+        return record
+
+    def timing(self, result: BuildTiming) -> BuildTiming:
+        result.docs = self.docs
+        marks = self.marks
+        for phase, following in zip(PHASES, PHASES[1:] + ("end",)):
+            if phase in marks and following in marks:
+                setattr(result, phase, marks[following] - marks[phase])
+        result.total = marks["end"] - marks["init"]
+        return result
+
+
+def run_build(
+    project: Project,
+    outdir: Path,
+    mode: str = COLD,
+    jobs: int = 1,
+    builder: str = "html",
+) -> BuildTiming:
+    """Build a project in-process, and time each phase of the build.
+
+    Cold builds start from an empty output directory; incremental builds reuse
+    the previous build, after changing ``project.touch`` in ``incremental`` mode.
+    """
+    if mode == COLD and outdir.exists():
+        shutil.rmtree(outdir)
+    elif mode == INCREMENTAL and project.touch is not None:
+        project.touch.touch()
+
+    started = time.perf_counter()
+    with patch_docutils(str(project.srcdir)), docutils_namespace():
+        app = Sphinx(
+            str(project.srcdir),
+            str(project.srcdir),
+            str(outdir),
+            str(outdir / ".doctrees"),
+            builder,
+            confoverrides=dict(project.confoverrides),
+            status=StringIO(),
+            warning=StringIO(),
+            freshenv=False,
+            parallel=jobs if jobs > 1 else 0,
+        )
+        timer = PhaseTimer(app, started)
+        app.build()
+    return timer.timing(BuildTiming(project.name, mode, jobs))
+
+
+def bench(
+    projects: Iterable[Project],
+    jobs: Sequence[int] = (1,),
+    modes: Sequence[str] = MODES,
+    builder: str = "html",
+) -> List[BuildTiming]:
+    """Build each project with each number of jobs, in each mode in order.
+
+    Projects are copied before incremental builds change them.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix="sphinx-mdinclude-bench-") as tmp:
+        for project in projects:
+            if INCREMENTAL in modes and project.touch is not None:
+                project = copy_project(project, Path(tmp) / project.name)
+            for j in jobs:
+                outdir = Path(tmp) / "{}-j{}".format(project.name, j)
+                for mode in modes:
+                    results.append(run_build(project, outdir, mode, j, builder))
+    return results
+
+
+def format_results(results: Iterable[BuildTiming]) -> str:
+    header = "{:<12} {:<12} {:>4} {:>5}".format("project", "mode", "jobs", "docs")
+    header += "".join(" {:>9}".format(phase) for phase in PHASES + ("total",))
+    lines = [header]
+    for r in results:
+        line = "{:<12} {:<12} {:>4} {:>5}".format(r.project, r.mode, r.jobs, r.docs)
+        for phase in PHASES + ("total",):
+            line += " {:>7.0f}ms".format(getattr(r, phase) * 1000)
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,132 @@
+"""
+Rendered top-level blocks, shared by every document converted in a process
+"""
+
+import hashlib
+import marshal
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Pattern
+
+from .metadata import DocumentMetadata
+from .parse import Token
+
+DEFAULT_BLOCK_CACHE_SIZE = 4 * 1024 * 1024
+
+# inline text that renders differently depending on the rest of the document:
+# footnote references, and brackets that may be reference links
+DOCUMENT_STATE_RE = re.compile(r"\[\^|\](?!\()")
+# with a link resolver, also any link, which may be relative to the document
+LINK_STATE_RE = re.compile(r"\[\^|\]|<")
+# extracted data URIs are written to disk as a side effect of rendering
+DATA_URI_RE = re.compile(r"\bdata:")
+
+
+class CachedBlock(NamedTuple):
+    output: str
+    raw_html: bool
+    metadata: DocumentMetadata
+
+
+def document_state(links: bool = False, data_uris: bool = False) -> Pattern[str]:
+    """Return a pattern for inline text whose rendering cannot be reused."""
+    pattern = (LINK_STATE_RE if links else DOCUMENT_STATE_RE).pattern
+    if data_uris:
+        pattern += "|" + DATA_URI_RE.pattern
+    return re.compile(pattern)
+
+
+def block_key(
+    token: Token, namespace: bytes, state: Pattern[str] = DOCUMENT_STATE_RE
+) -> Optional[bytes]:
+    """Hash a top-level block before its inline text is parsed.
+
+    ``namespace`` is a digest of the options it is rendered with. Returns
+    ``None`` if the rendered block could depend on anything outside of it,
+    matched in its inline text by ``state``.
+    """
+    stack = [token]
+    while stack:
+        item = stack.pop()
+        text = item.get("text")
+        if isinstance(text, str) and state.search(text):
+            return None
+        children = item.get("children")
+        if isinstance(children, list):
+            stack.extend(children)
+    try:
+        data = marshal.dumps(token)
+    except ValueError:
+        # tokens of plugins may hold arbitrary objects
+        return None
+    return hashlib.blake2b(data, digest_size=16, key=namespace).digest()
+
+
+class BlockCache:
+    """Thread-safe LRU cache of rendered blocks, bounded by total output size.
+
+    Blocks are keyed by their content and the options of the converter that
+    rendered them, so converters with different options can share one cache.
+    """
+
+    def __init__(self, size: int = DEFAULT_BLOCK_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+        self.chars = 0
+        self._entries: "OrderedDict[bytes, CachedBlock]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[CachedBlock]:
+        with self._lock:
+            block = self._entries.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return block
+
+    def put(self, key: bytes, block: CachedBlock) -> None:
+        if len(block.output) > self.size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.chars -= len(previous.output)
+            self._entries[key] = block
+            self.chars += len(block.output)
+            while self.chars > self.size:
+                _, evicted = self._entries.popitem(last=False)
+                self.chars -= len(evicted.output)
+                self.evictions += 1
+
+    def skip(self) -> None:
+        """Count a block that could not be cached."""
+        with self._lock:
+            self.skipped += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self.size,
+                "entries": len(self._entries),
+                "chars": self.chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.chars = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
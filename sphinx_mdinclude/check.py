@@ -0,0 +1,209 @@
+"""
+Parse-only validation of Markdown documents
+"""
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+from itertools import groupby
+from typing import Any, Dict, Iterator, List, Match, NamedTuple, Optional, Sequence
+
+from docutils import nodes
+from docutils.frontend import get_default_settings
+from docutils.parsers.rst import Parser
+from docutils.utils import new_document
+from mistune import Markdown
+from mistune.core import BlockState
+from mistune.plugins import _plugins
+
+from .parse import RestBlockParser, RestInlineParser, Token
+from .render import _resolve_plugin, DEFAULT_PLUGINS, RestRenderer
+
+ERROR = "error"
+WARNING = "warning"
+
+# explicit markup that docutils would treat as a comment, or as plain text
+_BROKEN_DIRECTIVE_RE = re.compile(
+    r"^ *\.\.(?: +(?P<colon>[A-Za-z][\w.+-]*:)(?=\s|$)|(?P<space>[A-Za-z][\w.+-]*::))"
+)
+_UNTERMINATED_ROLE_RE = re.compile(r":[A-Za-z][\w.+:-]*:`|`[^`]*`:[A-Za-z]")
+# text that markdown left alone, but is inline markup to docutils
+_SUSPICIOUS_TEXT_RE = re.compile(r"[`*|]")
+# directives and roles only known to sphinx or its extensions
+_UNKNOWN_NAME_RE = re.compile(r'^Unknown (?:directive type|interpreted text role) "')
+
+
+class Diagnostic(NamedTuple):
+    """A problem found in a document, at the first line of its top-level block."""
+
+    path: str
+    line: int
+    level: str
+    message: str
+
+    def __str__(self) -> str:
+        return "{}:{}: {}: {}".format(self.path, self.line, self.level, self.message)
+
+
+class CheckState(BlockState):
+    def add_paragraph(self, text: str) -> None:
+        last_token = self.last_token()
+        super().add_paragraph(text)
+        if self.parent is None and self.last_token() is not last_token:
+            self.tokens[-1]["pos"] = self.cursor
+
+
+class CheckBlockParser(RestBlockParser):
+    """Records the source position of each top-level token."""
+
+    state_cls = CheckState
+
+    def parse_method(self, m: Match[str], state: BlockState) -> Optional[int]:
+        count = len(state.tokens)
+        end_pos = super().parse_method(m, state)
+        if state.parent is None:
+            for token in state.tokens[count:]:
+                token.setdefault("pos", m.start())
+        return end_pos
+
+
+class Checker:
+    """Find Markdown that will not convert to valid reStructuredText.
+
+    Documents are parsed but not rendered. With ``docutils=True``, only blocks
+    that look suspicious are rendered and parsed by docutils, and its warnings
+    reported, except for unknown directive or role names, which may be defined
+    by Sphinx or its extensions.
+    """
+
+    def __init__(self, docutils: bool = False) -> None:
+        self.docutils = docutils
+        self.markdown = Markdown(
+            None,
+            block=CheckBlockParser(),
+            inline=RestInlineParser(),
+            plugins=[_resolve_plugin(_plugins[p]) for p in DEFAULT_PLUGINS],
+        )
+        self.renderer = RestRenderer()
+        self.settings: Any = None
+
+    def check(self, text: str, path: str = "<string>") -> List[Diagnostic]:
+        tokens, state = self.markdown.parse(text)
+        diagnostics: List[Diagnostic] = []
+        styles: List[int] = []
+        section_depth = 0
+        line, pos = 1, 0
+
+        for token in tokens:
+            if "pos" in token:
+                line += text.count("\n", pos, token["pos"])
+                pos = token["pos"]
+
+            messages = list(self._check_token(token))
+            if token["type"] == "heading":
+                level = token["attrs"]["level"]
+                # docutils assigns section levels in order of first appearance
+                if level not in styles and len(styles) == section_depth:
+                    styles.append(level)
+                if level in styles and styles.index(level) <= section_depth:
+                    section_depth = styles.index(level) + 1
+                else:
+                    messages.append((ERROR, "title level inconsistent"))
+
+            flagged = (
+                messages
+                or token["type"] in ("directive", "table")
+                or self._suspicious(token)
+            )
+            if self.docutils and flagged:
+                messages.extend(self._run_docutils(token, state))
+
+            diagnostics.extend(
+                Diagnostic(path, line, level, message) for level, message in messages
+            )
+
+        return diagnostics
+
+    def _check_token(self, token: Token, nested: bool = False) -> Iterator[Any]:
+        kind = token["type"]
+        if kind == "directive":
+            m = _BROKEN_DIRECTIVE_RE.match(token["raw"])
+            if m and m.group("colon"):
+                yield WARNING, "'.. {}' is a comment, not a directive".format(
+                    m.group("colon")
+                )
+            elif m:
+                yield WARNING, "missing space after '..' in '.. {}'".format(
+                    m.group("space")
+                )
+        elif kind == "heading" and nested:
+            yield ERROR, "heading inside a nested block is not allowed"
+
+        children = token.get("children", ())
+        # the inline parser splits text at every special character
+        for is_text, run in groupby(children, lambda child: child["type"] == "text"):
+            if is_text:
+                text = "".join(child["raw"] for child in run)
+                if _UNTERMINATED_ROLE_RE.search(text):
+                    yield ERROR, "unterminated role: {!r}".format(text[:80])
+                elif "`" in text:
+                    yield WARNING, "unmatched backtick: {!r}".format(text[:80])
+        for child in children:
+            yield from self._check_token(child, nested=True)
+
+    def _suspicious(self, token: Token) -> bool:
+        if token["type"] == "text":
+            return bool(_SUSPICIOUS_TEXT_RE.search(token["raw"]))
+        return any(self._suspicious(child) for child in token.get("children", ()))
+
+    def _run_docutils(self, token: Token, state: BlockState) -> Iterator[Any]:
+        if self.settings is None:
+            self.settings = get_default_settings(Parser)
+            self.settings.report_level = 5
+            self.settings.halt_level = 5
+            self.settings.warning_stream = False
+
+        rst = self.renderer.render_tokens([token], state)
+        document = new_document("<check>", self.settings)
+        Parser().parse(rst, document)
+        for message in document.findall(nodes.system_message):
+            text = message.children[0].astext() if message.children else ""
+            if message["level"] >= 2 and not _UNKNOWN_NAME_RE.match(text):
+                yield ERROR if message["level"] >= 3 else WARNING, text
+
+    def __call__(self, path: str) -> List[Diagnostic]:
+        with open(path, encoding="utf-8") as f:
+            return self.check(f.read(), path)
+
+
+def check(
+    text: str, path: str = "<string>", docutils: bool = False
+) -> List[Diagnostic]:
+    """Check a single Markdown document for problems converting to rst."""
+    return Checker(docutils).check(text, path)
+
+
+_WORKER: Optional[Checker] = None
+
+
+def _check_file(path: str, docutils: bool) -> List[Diagnostic]:
+    global _WORKER
+
+    if _WORKER is None or _WORKER.docutils != docutils:
+        _WORKER = Checker(docutils)
+    return _WORKER(path)
+
+
+def check_files(
+    paths: Sequence[str], docutils: bool = False, max_workers: Optional[int] = None
+) -> Dict[str, List[Diagnostic]]:
+    """Check many Markdown files on a pool of processes, one per core by default."""
+    if max_workers == 1 or len(paths) < 2:
+        checker = Checker(docutils)
+        return {path: checker(path) for path in paths}
+
+    chunksize = max(1, len(paths) // ((max_workers or 4) * 8))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        results = pool.map(
+            _check_file, paths, [docutils] * len(paths), chunksize=chunksize
+        )
+        return dict(zip(paths, results))
@@ -0,0 +1,78 @@
+"""
+Profiles of slow conversions, to find out what makes a document slow
+"""
+
+import cProfile
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, NamedTuple, Optional
+
+from .parse import ConversionLimitExceeded
+
+# one profiler at a time; on Python 3.12+ profilers are global to the interpreter
+PROFILE_LOCK = threading.Lock()
+
+
+class SlowConversion(NamedTuple):
+    """A conversion that took longer than the threshold, and where its profile is."""
+
+    source: str
+    elapsed: float
+    sha256: str
+    size: int
+    profile: Optional[str] = None  # path of the pstats dump
+    error: str = ""  # why there is no profile
+
+
+def capture(
+    directory: str,
+    source: str,
+    text: str,
+    elapsed: float,
+    convert: Callable[[str], Any],
+) -> SlowConversion:
+    """Convert ``text`` again under cProfile, and save the stats to ``directory``.
+
+    Profiles are named by the hash of the input, next to a JSON file describing
+    it, so an input is only profiled once however many documents include it.
+    """
+    data = text.encode("utf-8", "surrogatepass")
+    digest = hashlib.sha256(data).hexdigest()
+    base = os.path.join(directory, digest[:16])
+    path = base + ".prof"
+    slow = SlowConversion(source, elapsed, digest, len(data), path)
+    if os.path.exists(path):
+        return slow
+
+    profiler = cProfile.Profile()
+    with PROFILE_LOCK:
+        try:
+            profiler.enable()
+        except ValueError as error:
+            # another profiler is already running
+            return slow._replace(profile=None, error=str(error))
+        started = time.perf_counter()
+        try:
+            convert(text)
+        except ConversionLimitExceeded:
+            # still shows where the time went
+            pass
+        finally:
+            profiler.disable()
+        profiled = time.perf_counter() - started
+
+    os.makedirs(directory, exist_ok=True)
+    info = {
+        "source": source,
+        "sha256": digest,
+        "size": len(data),
+        "elapsed": elapsed,
+        "profiled": profiled,
+    }
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    profiler.dump_stats(path)
+    return slow
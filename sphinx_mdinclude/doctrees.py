@@ -0,0 +1,170 @@
+"""
+Parsed docutils subtrees of mdinclude targets, shared by every document
+"""
+
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+from docutils import nodes
+from docutils.nodes import document as Document
+
+DEFAULT_NODE_CACHE_SIZE = 256
+
+# directives that only build nodes, without side effects on the environment or
+# on later parts of the document, and without paths relative to the document
+SAFE_DIRECTIVES = frozenset(
+    (
+        "admonition",
+        "attention",
+        "caution",
+        "code",
+        "code-block",
+        "danger",
+        "error",
+        "hint",
+        "image",
+        "important",
+        "list-table",
+        "math",
+        "note",
+        "raw",
+        "sourcecode",
+        "tip",
+        "warning",
+    )
+)
+# explicit markup: directives, targets, footnotes, citations, and substitutions
+EXPLICIT_MARKUP_RE = re.compile(r"^\s*\.\.\s+(?:(\[|_|\|)|([\w:+.-]+)\s?::)")
+# anonymous targets, options that read files or register equations, and index
+# entries, whose targets are numbered by the environment
+SIDE_EFFECT_RE = re.compile(r"^\s*__ |^\s+:(?:file|url|label):|:index:`")
+# underlines of section titles, as recognized by docutils
+UNDERLINE_RE = re.compile(r"([!-/:-@[-`{-~])\1* *$")
+
+
+def has_titles(lines: Sequence[str]) -> bool:
+    """Whether rst lines have section titles, underlined or overlined."""
+    previous = ""
+    for line in lines:
+        if previous.strip() and not previous[0].isspace() and UNDERLINE_RE.match(line):
+            return True
+        previous = line
+    return False
+
+
+def cacheable(lines: Sequence[str]) -> bool:
+    """Whether parsing rst lines has no effect beyond the nodes it returns."""
+    for line in lines:
+        m = EXPLICIT_MARKUP_RE.match(line)
+        if m is not None and (m.group(1) or m.group(2) not in SAFE_DIRECTIVES):
+            return False
+        if SIDE_EFFECT_RE.search(line):
+            return False
+    return True
+
+
+def node_key(lines: Sequence[str], source: str, context: Any) -> bytes:
+    """Hash rst lines, the file they are attributed to, and the parser context."""
+    digest = hashlib.sha256()
+    for part in (source, repr(context)):
+        digest.update(part.encode("utf-8", "surrogatepass") + b"\0")
+    for line in lines:
+        digest.update(line.encode("utf-8", "surrogatepass") + b"\n")
+    return digest.digest()
+
+
+def adopt(
+    cached: Sequence[nodes.Node], document: Document, docname: str
+) -> List[nodes.Node]:
+    """Return copies of cached nodes, as if they were parsed in ``document``.
+
+    Ids and names are registered again, with ids unique to the document, so
+    are references that transforms of the document resolve, and cross
+    references are attributed to ``docname``.
+    """
+    copies = [node.deepcopy() for node in cached]
+    for copy in copies:
+        for node in copy.findall(nodes.Element):
+            if "refdoc" in node:
+                node["refdoc"] = docname
+            if node["ids"] or node["names"]:
+                node["ids"] = []
+                if isinstance(node, nodes.section):
+                    document.note_implicit_target(node, node)
+                else:
+                    document.note_explicit_target(node, node)
+            if isinstance(node, nodes.footnote_reference):
+                if node.get("auto") == 1:
+                    document.note_autofootnote_ref(node)
+                elif node.get("auto") == "*":
+                    document.note_symbol_footnote_ref(node)
+                if node.get("refname"):
+                    document.note_footnote_ref(node)
+            elif isinstance(node, nodes.citation_reference):
+                document.note_citation_ref(node)
+            elif node.get("refname"):
+                document.note_refname(node)
+    return copies
+
+
+class NodeCache:
+    """Thread-safe LRU cache of parsed subtrees, bounded by number of entries.
+
+    Entries are pristine copies taken right after parsing, before any transform
+    of the document that first parsed them.
+    """
+
+    def __init__(self, size: int = DEFAULT_NODE_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._entries: "OrderedDict[bytes, List[nodes.Node]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes) -> Optional[List[nodes.Node]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: bytes, parsed: Sequence[nodes.Node]) -> None:
+        if self.size <= 0:
+            return
+        entry = [node.deepcopy() for node in parsed]
+        for copy in entry:
+            # copies refer to the document they were parsed in, don't keep it
+            for node in copy.findall():
+                node.document = None
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def skip(self) -> None:
+        """Count a subtree that could not be cached."""
+        with self._lock:
+            self.skipped += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self.size,
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
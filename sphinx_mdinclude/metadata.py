@@ -0,0 +1,93 @@
+"""
+Metadata of Markdown documents, collected while they are rendered
+"""
+
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from .parse import slugify
+
+# token types that metadata is collected from
+METADATA_TOKENS = frozenset(("heading", "link", "image", "footnote_ref"))
+
+
+class HeadingInfo(NamedTuple):
+    level: int
+    title: str  # plain text, without markup
+    slug: str
+
+
+class LinkInfo(NamedTuple):
+    url: str
+    text: str
+    title: Optional[str] = None
+
+
+class ImageInfo(NamedTuple):
+    url: str
+    alt: str
+    title: Optional[str] = None
+
+
+def plain_text(tokens: Iterable[Dict[str, Any]]) -> str:
+    """Concatenate the text of inline tokens, without their markup."""
+    parts = []
+    stack = list(reversed(list(tokens)))
+    while stack:
+        token = stack.pop()
+        children = token.get("children")
+        if isinstance(children, list):
+            stack.extend(reversed(children))
+        elif token["type"] in ("linebreak", "softbreak"):
+            parts.append(" ")
+        elif token["type"] != "footnote_ref" and isinstance(token.get("raw"), str):
+            parts.append(token["raw"])
+    return "".join(parts)
+
+
+@dataclass
+class DocumentMetadata:
+    """The outline, links, images, and footnote references of a document.
+
+    Headings are recorded at their level in the output, after any
+    ``heading-offset``, and everything else in the order it appears.
+    """
+
+    headings: List[HeadingInfo] = field(default_factory=list)
+    links: List[LinkInfo] = field(default_factory=list)
+    images: List[ImageInfo] = field(default_factory=list)
+    footnote_refs: List[str] = field(default_factory=list)  # normalized keys
+
+    @property
+    def title(self) -> Optional[str]:
+        """The first heading of the document, if any."""
+        return self.headings[0].title if self.headings else None
+
+    def extend(self, other: "DocumentMetadata") -> None:
+        self.headings.extend(other.headings)
+        self.links.extend(other.links)
+        self.images.extend(other.images)
+        self.footnote_refs.extend(other.footnote_refs)
+
+    def collect(self, token: Dict[str, Any]) -> None:
+        """Record a token from :data:`METADATA_TOKENS`, as it is rendered."""
+        kind = token["type"]
+        attrs = token.get("attrs") or {}
+        if kind == "heading":
+            title = plain_text(token.get("children", ())).strip()
+            self.headings.append(HeadingInfo(attrs["level"], title, slugify(title)))
+        elif kind == "link":
+            text = plain_text(token.get("children", ()))
+            self.links.append(LinkInfo(attrs["url"], text, attrs.get("title")))
+        elif kind == "image":
+            alt = plain_text(token.get("children", ()))
+            self.images.append(ImageInfo(attrs["url"], alt, attrs.get("title")))
+        elif kind == "footnote_ref":
+            self.footnote_refs.append(token["raw"])
+
+
+class ConversionResult(NamedTuple):
+    """The rst output of a conversion, and the metadata collected with it."""
+
+    output: str
+    metadata: DocumentMetadata
@@ -0,0 +1,59 @@
+"""
+Conversion metrics for Markdown documents
+"""
+
+import csv
+import json
+from dataclasses import asdict, dataclass, fields
+from typing import Any, Dict, Iterable, List
+
+
+@dataclass
+class ConversionMetrics:
+    """Measurements of converting one Markdown source, in a Sphinx document."""
+
+    docname: str
+    source: str
+    kind: str  # "document" or "mdinclude"
+    input_bytes: int = 0
+    output_bytes: int = 0
+    tokens: int = 0
+    conversion_time: float = 0.0
+    parse_time: float = 0.0
+    shadow: str = ""  # "match" or "diverged", if checked
+    shadow_time: float = 0.0
+
+    @property
+    def total_time(self) -> float:
+        return self.conversion_time + self.parse_time
+
+
+def count_tokens(tokens: Iterable[Dict[str, Any]]) -> int:
+    """Count block and inline tokens, including nested ones."""
+    count = 0
+    stack = list(tokens)
+    while stack:
+        token = stack.pop()
+        count += 1
+        children = token.get("children")
+        if isinstance(children, list):
+            stack.extend(children)
+    return count
+
+
+def slowest(records: Iterable[ConversionMetrics], n: int) -> List[ConversionMetrics]:
+    return sorted(records, key=lambda r: r.total_time, reverse=True)[:n]
+
+
+def write_report(path: str, records: Iterable[ConversionMetrics]) -> None:
+    """Write records as CSV if ``path`` ends with ``.csv``, or as JSON otherwise."""
+    records = sorted(records, key=lambda r: (r.docname, r.source))
+    if path.endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(field.name for field in fields(ConversionMetrics))
+            for record in records:
+                writer.writerow(asdict(record).values())
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([asdict(record) for record in records], f, indent=2)
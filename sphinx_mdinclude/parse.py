@@ -1,4 +1,27 @@
-from typing import Any, Dict, Match, Tuple
+import copy
+import os
+import re
+import signal
+import threading
+import time
+from collections import ChainMap
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Match,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
 
 from mistune import BlockParser, InlineParser
 from mistune.core import BlockState, InlineState
@@ -10,6 +33,152 @@ Token = Dict[str, Any]
 Element = Tuple[str, ...]
 
 
+class ConversionLimitExceeded(Exception):
+    """Raised when a conversion exceeds one of its :class:`ConversionLimits`."""
+
+    def __init__(self, reason: str, lineno: Optional[int] = None, block: str = ""):
+        self.reason = reason
+        self.lineno = lineno
+        self.block = block
+        super().__init__(reason)
+
+    def __str__(self) -> str:
+        message = self.reason
+        if self.lineno is not None:
+            message += " at line {}".format(self.lineno)
+        if self.block:
+            message += ": {!r}".format(self.block)
+        return message
+
+
+@dataclass(frozen=True)
+class ConversionLimits:
+    """Per-document limits on input size, nesting depth, and wall time.
+
+    Limits set to ``None`` are not enforced. The timeout is checked cooperatively
+    by the block and inline parsers; on the main thread of platforms with
+    :func:`signal.setitimer`, it also interrupts a single long-running regex.
+    """
+
+    max_size: Optional[int] = None
+    max_depth: Optional[int] = None
+    timeout: Optional[float] = None
+
+    def start(self, text: str) -> "Budget":
+        """Check the input size and begin tracking a single conversion."""
+        if self.max_size is not None and len(text) > self.max_size:
+            raise ConversionLimitExceeded(
+                "input size {} exceeds limit of {}".format(len(text), self.max_size)
+            )
+        return Budget(self)
+
+
+class Budget:
+    """Mutable tracking state for one conversion under :class:`ConversionLimits`."""
+
+    def __init__(self, limits: ConversionLimits) -> None:
+        self.limits = limits
+        self.deadline = (
+            None if limits.timeout is None else time.monotonic() + limits.timeout
+        )
+        self.inline_depth = 0
+        self.src = ""
+        self.pos = 0
+        self.block = ""
+        self.cancelled = False
+        # sections that an interrupt must not leave half done, and whether an
+        # interrupt was deferred until the end of them
+        self.protected = 0
+        self.interrupted = False
+
+    def cancel(self) -> None:
+        """Stop the conversion at the next check, from any thread."""
+        self.cancelled = True
+
+    def exceeded(self, reason: str) -> ConversionLimitExceeded:
+        if self.block:
+            return ConversionLimitExceeded(reason, block=self.block)
+        lineno = self.src.count("\n", 0, self.pos) + 1
+        block = self.src[self.pos :].split("\n", 1)[0]
+        return ConversionLimitExceeded(reason, lineno, block[:80])
+
+    def check_time(self) -> None:
+        if self.cancelled:
+            raise self.exceeded("conversion cancelled")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise self.exceeded(
+                "conversion time exceeds limit of {}s".format(self.limits.timeout)
+            )
+
+    def check_depth(self, depth: int) -> None:
+        max_depth = self.limits.max_depth
+        if max_depth is not None and depth > max_depth:
+            raise self.exceeded("nesting depth exceeds limit of {}".format(max_depth))
+
+    @contextmanager
+    def interrupt(self) -> Iterator[None]:
+        """Raise from a signal handler if the deadline passes mid-regex."""
+        timeout = self.limits.timeout
+        if (
+            not timeout
+            or timeout < 0
+            or not hasattr(signal, "setitimer")
+            or threading.current_thread() is not threading.main_thread()
+            or signal.getitimer(signal.ITIMER_REAL)[0]
+        ):
+            yield
+            return
+
+        def handler(signum: int, frame: Any) -> None:
+            if self.protected:
+                self.interrupted = True
+                return
+            raise self.exceeded("conversion time exceeds limit of {}s".format(timeout))
+
+        global _INTERRUPTIBLE
+        previous = signal.signal(signal.SIGALRM, handler)
+        _INTERRUPTIBLE = self
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            _INTERRUPTIBLE = None
+            signal.signal(signal.SIGALRM, previous)
+
+    @contextmanager
+    def protect(self) -> Iterator[None]:
+        """Defer an interrupt until the end of this section."""
+        self.protected += 1
+        try:
+            yield
+        finally:
+            self.protected -= 1
+        if not self.protected and self.interrupted:
+            raise self.exceeded(
+                "conversion time exceeds limit of {}s".format(self.limits.timeout)
+            )
+
+
+# the budget that may be interrupted by a signal, on the main thread
+_INTERRUPTIBLE: Optional[Budget] = None
+
+
+@contextmanager
+def uninterrupted() -> Iterator[None]:
+    """Defer a conversion timeout during a cache insert or a file write.
+
+    A timeout raised from the signal handler of :meth:`Budget.interrupt` could
+    otherwise leave shared state half updated.
+    """
+    budget = _INTERRUPTIBLE
+    if budget is None or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    with budget.protect():
+        yield
+
+
 class RestBlockParser(BlockParser):
     SPECIFICATION = BlockParser.SPECIFICATION.copy()
     SPECIFICATION.update(
@@ -17,6 +186,7 @@ class RestBlockParser(BlockParser):
             "directive": r"(?ms:^(?P<directive_1> *\.\..*?)\n(?=\S))",
             "oneline_directive": r"(?ms:^(?P<directive_2> *\.\..*?)$)",
             "rest_code_block": r"(?m:^::\s*$)",
+            "include": r"(?m:^ {0,3}\{!(?P<include_path>[^!\n]+)!\}[ \t]*$)",
         }
     )
 
@@ -24,8 +194,63 @@ class RestBlockParser(BlockParser):
         "directive",
         "oneline_directive",
         "rest_code_block",
+        "include",
     )
 
+    def __init__(
+        self, *args: Any, literalinclude_threshold: Optional[int] = None, **kwargs: Any
+    ) -> None:
+        """
+        :param literalinclude_threshold: fenced code blocks of at least this many
+            characters are referenced by line range from the source file, named
+            by ``state.env["__file__"]``, instead of copied into the output.
+        """
+        super().__init__(*args, **kwargs)
+        self.literalinclude_threshold = literalinclude_threshold
+
+    def parse_method(self, m: Match[str], state: BlockState) -> Optional[int]:
+        budget = state.env.get("budget")
+        if budget is not None:
+            if state.parent is None:
+                budget.src = state.src
+                budget.pos = state.cursor
+                budget.block = ""
+            budget.check_time()
+            budget.check_depth(state.depth())
+        return super().parse_method(m, state)  # type: ignore[no-any-return]
+
+    def parse_fenced_code(self, m: Match[str], state: BlockState) -> Optional[int]:
+        end_pos = super().parse_fenced_code(m, state)
+        threshold = self.literalinclude_threshold
+        path = state.env.get("__file__")
+        if (
+            end_pos is None
+            or threshold is None
+            or path is None
+            or state.parent is not None
+            or m.group("fenced_1")
+        ):
+            return end_pos
+
+        token = state.tokens[-1]
+        code = token["raw"]
+        info = token.get("attrs", {}).get("info")
+        if not code or len(code) < threshold or info == "math":
+            return end_pos
+
+        # code starts on the line after the opening fence
+        code_start = m.end() + 1
+        last_pos, last_line = state.env.get("line_cursor", (0, 1))
+        first = last_line + state.src.count("\n", last_pos, code_start)
+        state.env["line_cursor"] = (code_start, first)
+        first += state.env.get("line_offset", 0)
+        last = first + code.count("\n") - 1
+        state.tokens[-1] = {
+            "type": "literal_include",
+            "attrs": {"path": path, "lines": "{}-{}".format(first, last), "info": info},
+        }
+        return end_pos
+
     def parse_directive(self, m: Match[str], state: BlockState) -> int:
         state.append_token({"type": "directive", "raw": m.group("directive_1")})
         return m.end()
@@ -41,6 +266,184 @@ class RestBlockParser(BlockParser):
         # $ does not count '\n'
         return m.end() + 1
 
+    def parse_include(self, m: Match[str], state: BlockState) -> Optional[int]:
+        """Insert the blocks of a ``{!path!}`` Markdown fragment.
+
+        Only enabled by a :class:`FragmentCache` in ``state.env["fragments"]``.
+        Paths are relative to ``state.env["include_base"]``, or the cache root.
+        Problems are appended to ``state.env["include_errors"]``.
+        """
+        fragments: Optional[FragmentCache] = state.env.get("fragments")
+        if fragments is None:
+            return None
+
+        base = state.env.get("include_base") or fragments.root
+        path = os.path.normpath(os.path.join(base, m.group("include_path").strip()))
+        stack = state.env.get("include_stack", ())
+        state.env.setdefault("includes", set()).add(path)
+        errors = state.env.setdefault("include_errors", [])
+        stamps = state.env.setdefault("include_stamps", {})
+        try:
+            if path in stack:
+                cycle = stack[stack.index(path) :] + (path,)
+                raise IncludeError(
+                    "include cycle: " + " -> ".join(fragments.relpath(p) for p in cycle)
+                )
+            fragment = fragments.load(path, stack, self)
+        except IncludeError as error:
+            errors.append(str(error))
+            # a missing fragment may appear later
+            stamps.setdefault(path, _stamp(path))
+            # $ does not count '\n'
+            return m.end() + 1
+
+        errors.extend(fragment.errors)
+        stamps.update(fragment.stamps)
+        # merged after parsing, so the document's own definitions come first
+        included = state.env.setdefault("include_ref_links", {})
+        for key, data in fragment.ref_links.items():
+            included.setdefault(key, data)
+        # rendering parses inline text in place, so never share cached tokens
+        state.tokens.extend(copy.deepcopy(fragment.tokens))
+        return m.end() + 1
+
+
+def merge_included_links(state: BlockState) -> None:
+    """Add link definitions from included fragments that the document lacks."""
+    included = state.env.pop("include_ref_links", None)
+    if included:
+        ref_links = state.env["ref_links"]
+        for key, data in included.items():
+            if key not in ref_links:
+                ref_links[key] = data
+
+
+def shift_headings(state: BlockState) -> None:
+    """Move headings down by ``state.env["heading_offset"]`` levels, up to 6."""
+    offset = state.env.get("heading_offset")
+    if not offset:
+        return
+    stack = list(state.tokens)
+    while stack:
+        token = stack.pop()
+        if token["type"] == "heading":
+            token["attrs"]["level"] = min(6, token["attrs"]["level"] + offset)
+        children = token.get("children")
+        if isinstance(children, list):
+            stack.extend(children)
+
+
+class IncludeError(Exception):
+    """Raised when a Markdown fragment cannot be included."""
+
+
+class Fragment(NamedTuple):
+    #: the fragment and every file it includes, in turn -> (mtime, size), or
+    #: ``None`` if missing
+    stamps: Dict[str, Optional[Tuple[int, int]]]
+    tokens: List[Token]
+    ref_links: Dict[str, Any]
+    includes: FrozenSet[str]
+    errors: Tuple[str, ...]
+
+
+def _stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class FragmentCache:
+    """Parsed Markdown fragments for ``{!path!}`` includes, shared by documents.
+
+    Each fragment is parsed once, and again only if it or any file it includes,
+    in turn, changes on disk. Fragments whose includes lead back to the
+    document or fragment including them are parsed again for each includer,
+    since the cycle stops there. The cache also records which fragments include
+    which, so the transitive dependencies of a document can be found without
+    parsing again.
+    """
+
+    def __init__(self, root: Optional[str] = None, encoding: str = "utf-8") -> None:
+        self.root = os.path.abspath(root or os.curdir)
+        self.encoding = encoding
+        #: fragment path -> paths it includes directly
+        self.graph: Dict[str, FrozenSet[str]] = {}
+        self._fragments: Dict[str, Fragment] = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # only the settings survive pickling, along with the Sphinx environment
+        return {"root": self.root, "encoding": self.encoding}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__init__(state["root"], state.get("encoding", "utf-8"))  # type: ignore[misc]
+
+    def relpath(self, path: str) -> str:
+        return os.path.relpath(path, self.root)
+
+    def load(self, path: str, stack: Tuple[str, ...], parser: BlockParser) -> Fragment:
+        fragment = self._fragments.get(path)
+        if fragment is not None and fragment.stamps.keys().isdisjoint(stack):
+            if all(_stamp(p) == stamp for p, stamp in fragment.stamps.items()):
+                return fragment
+
+        fragment = self._parse(path, stack, parser)
+        with uninterrupted(), self._lock:
+            self.graph[path] = fragment.includes
+            # includes that lead back to the stack stop there, so only a parse
+            # that never reached it is the same for every includer
+            if fragment.stamps.keys().isdisjoint(stack):
+                self._fragments[path] = fragment
+        return fragment
+
+    def _parse(
+        self, path: str, stack: Tuple[str, ...], parser: BlockParser
+    ) -> Fragment:
+        stamp = _stamp(path)
+        try:
+            with open(path, encoding=self.encoding) as f:
+                text = f.read()
+        except OSError as error:
+            raise IncludeError(
+                "cannot include {}: {}".format(self.relpath(path), error.strerror)
+            )
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        if not text.endswith("\n"):
+            text += "\n"
+
+        state = parser.state_cls()
+        state.env.update(
+            fragments=self,
+            include_base=os.path.dirname(path),
+            include_stack=stack + (path,),
+        )
+        state.process(text)
+        parser.parse(state)
+        merge_included_links(state)
+        stamps = state.env.get("include_stamps", {})
+        stamps[path] = stamp
+        return Fragment(
+            stamps,
+            state.tokens,
+            state.env["ref_links"],
+            frozenset(state.env.get("includes", ())),
+            tuple(state.env.get("include_errors", ())),
+        )
+
+    def dependencies(self, paths: Iterable[str]) -> Set[str]:
+        """Return the given fragments and every fragment they include, in turn."""
+        seen: Set[str] = set()
+        pending = list(paths)
+        while pending:
+            path = pending.pop()
+            if path not in seen:
+                seen.add(path)
+                pending.extend(self.graph.get(path, ()))
+        return seen
+
 
 class RestInlineParser(InlineParser):
     # make inline_html span open/contents/close instead of just a single tag
@@ -74,6 +477,26 @@ class RestInlineParser(InlineParser):
         "eol_literal_marker",
     ) + InlineParser.DEFAULT_RULES  # type: ignore[has-type]
 
+    def parse(self, state: InlineState) -> List[Token]:
+        budget = state.env.get("budget")
+        if budget is None:
+            return super().parse(state)
+
+        budget.inline_depth += 1
+        if budget.inline_depth == 1:
+            budget.block = state.src.split("\n", 1)[0][:80]
+        try:
+            budget.check_depth(budget.inline_depth)
+            return super().parse(state)
+        finally:
+            budget.inline_depth -= 1
+
+    def parse_method(self, m: Match[str], state: InlineState) -> Optional[int]:
+        budget = state.env.get("budget")
+        if budget is not None:
+            budget.check_time()
+        return super().parse_method(m, state)  # type: ignore[no-any-return]
+
     def parse_rest_role(self, m: Match[str], state: InlineState) -> int:
         """Pass through rest role."""
         state.append_token({"type": "rest_role", "raw": m.group(0)})
@@ -95,3 +518,172 @@ class RestInlineParser(InlineParser):
         state.append_token({"type": "eol_literal_marker", "raw": marker})
         # $ does not count '\n'
         return m.end() + 1
+
+
+class ReferenceLinks(ChainMap):  # type: ignore[type-arg]
+    """A document's link reference definitions, in front of shared ones.
+
+    Mistune only stores a definition if its key is not in the map yet, so
+    membership only considers the document's own definitions, which therefore
+    take precedence over shared ones.
+    """
+
+    def __init__(self, local: Dict[str, Any], shared: Mapping[str, Any]) -> None:
+        # the shared map is only ever read
+        super().__init__(local, shared)  # type: ignore[arg-type]
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.maps[0]
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        return default
+
+
+def parse_reference_links(text: str) -> Mapping[str, Mapping[str, str]]:
+    """Parse the link reference definitions in text into an immutable map."""
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    if not text.endswith("\n"):
+        text += "\n"
+    state = BlockState()
+    state.process(text)
+    RestBlockParser().parse(state)
+    return MappingProxyType(
+        {key: MappingProxyType(data) for key, data in state.env["ref_links"].items()}
+    )
+
+
+# heading candidates and code fences, see scan_headings()
+_SCAN_RE = re.compile(
+    r"^ {0,3}(?:#{1,6}(?:[ \t]|$)|`{3,}|~{3,}|=+[ \t]*$|-+[ \t]*$)", re.M
+)
+_ATX_RE = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))??(?:[ \t]+#+)?[ \t]*$")
+_NOT_PARAGRAPH_RE = re.compile(
+    r" {4}| {0,3}(?:[#>|<=]|[*+-](?:[ \t]|$)|\d+[.)](?:[ \t]|$)|\.\.|`{3}|~{3})"
+)
+_SLUG_MARKUP_RE = re.compile(r"!?\[([^\]]*)\]\([^)]*\)|`([^`<]*?)\s*<[^>]*>`_{1,2}")
+_SLUG_STRIP_RE = re.compile(r"[^\w\- ]")
+
+
+class Heading(NamedTuple):
+    level: int
+    title: str
+    slug: str
+    start: int
+
+
+def slugify(title: str) -> str:
+    """Generate a GitHub-style anchor for a heading title."""
+    text = _SLUG_MARKUP_RE.sub(lambda m: m.group(1) or m.group(2) or "", title)
+    text = _SLUG_STRIP_RE.sub("", text.strip().lower())
+    return text.replace(" ", "-")
+
+
+def _setext_title(text: str, underline: int) -> Optional[Tuple[int, str]]:
+    lines: List[str] = []
+    start = underline
+    end = underline - 1
+    while end > 0:
+        begin = text.rfind("\n", 0, end) + 1
+        line = text[begin:end]
+        if not line.strip() or _NOT_PARAGRAPH_RE.match(line):
+            break
+        lines.append(line.strip())
+        start = begin
+        end = begin - 1
+    if not lines:
+        return None
+    return start, " ".join(reversed(lines))
+
+
+def scan_headings(text: str) -> List[Heading]:
+    """Find ATX and setext headings without parsing the rest of the document.
+
+    Headings inside fenced code blocks are skipped. Slugs are made unique in
+    document order, by appending ``-1``, ``-2``, etc, like GitHub anchors.
+    """
+    headings: List[Heading] = []
+    seen: Dict[str, int] = {}
+    fence = ""
+    for m in _SCAN_RE.finditer(text):
+        start = m.start()
+        end = text.find("\n", start)
+        line = text[start:] if end == -1 else text[start:end]
+        stripped = line.strip()
+        marker = stripped[:1]
+
+        if fence:
+            if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                fence = ""
+            continue
+
+        if marker in ("`", "~"):
+            fence = stripped[: len(stripped) - len(stripped.lstrip(marker))]
+            if marker == "`" and "`" in stripped[len(fence) :]:
+                # not a fence: info strings for backtick fences cannot contain '`'
+                fence = ""
+            continue
+
+        if marker == "#":
+            atx = _ATX_RE.match(line)
+            if not atx:
+                continue
+            level = len(atx.group(1))
+            title = atx.group(2) or ""
+        else:
+            setext = _setext_title(text, start)
+            if setext is None:
+                continue
+            level = 1 if marker == "=" else 2
+            start, title = setext
+
+        slug = slugify(title)
+        if slug in seen:
+            seen[slug] += 1
+            slug = "{}-{}".format(slug, seen[slug])
+        else:
+            seen[slug] = 0
+        headings.append(Heading(level, title, slug, start))
+
+    return headings
+
+
+def split_sections(
+    text: str, level: int, headings: Optional[List[Heading]] = None
+) -> Tuple[str, List[Tuple[Heading, str]]]:
+    """Split a document before every heading of ``level`` or higher.
+
+    Returns the text before the first such heading, and each heading paired
+    with the text of its section.
+    """
+    if headings is None:
+        headings = scan_headings(text)
+    starts = [h for h in headings if h.level <= level]
+    if not starts:
+        return text, []
+
+    sections = []
+    for heading, following in zip(starts, starts[1:] + [None]):
+        end = following.start if following else len(text)
+        sections.append((heading, text[heading.start : end]))
+    return text[: starts[0].start], sections
+
+
+def find_section(
+    headings: List[Heading], name: str, length: int
+) -> Optional[Tuple[int, int]]:
+    """Find the span of the section with the given title or slug.
+
+    The section runs from its heading to the next heading of the same or higher
+    level, or to ``length`` if there is none.
+    """
+    key = name.strip().lower()
+    for index, heading in enumerate(headings):
+        if key in (heading.title.strip().lower(), heading.slug):
+            for following in headings[index + 1 :]:
+                if following.level <= heading.level:
+                    return heading.start, following.start
+            return heading.start, length
+    return None
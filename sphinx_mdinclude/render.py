@@ -1,17 +1,40 @@
+import base64
+import hashlib
+import marshal
+import mimetypes
+import os
 import re
+import tempfile
 import textwrap
+import threading
+from collections import ChainMap, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
 from functools import partial
 from importlib import import_module
-from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from types import MappingProxyType
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+from urllib.parse import unquote_to_bytes
 
 from docutils.utils import column_width
 from mistune import Markdown
 from mistune.core import BaseRenderer, BlockState
 from mistune.plugins import _plugins
 
-from .parse import RestBlockParser, RestInlineParser
+from .blocks import block_key, BlockCache, CachedBlock, document_state
+from .metadata import ConversionResult, DocumentMetadata, METADATA_TOKENS
+from .parse import (
+    ConversionLimits,
+    FragmentCache,
+    merge_included_links,
+    ReferenceLinks,
+    RestBlockParser,
+    RestInlineParser,
+    shift_headings,
+    Token,
+    uninterrupted,
+)
 
-CACHED_MODULES: Dict[str, Any] = {}
 DEFAULT_PLUGINS = ["strikethrough", "footnotes", "table"]
 
 PROLOG = """\
@@ -20,9 +43,61 @@ PROLOG = """\
 
 """
 
+# version of the token tree format produced by dump_tokens()
+TOKEN_FORMAT = 1
+
+LinkResolver = Callable[[str], Optional[Tuple[str, str]]]
+
+
+def _import_plugin(plugin_str: Any) -> Any:
+    if isinstance(plugin_str, str):
+        module_path, func_name = plugin_str.rsplit(".", 1)
+        module = import_module(module_path)
+        return getattr(module, func_name)
+    # Presumably a function has been passed
+    return plugin_str
+
+
+# Never mutated: new plugins replace the whole mapping while holding the lock
+CACHED_MODULES: Mapping[Any, Any] = MappingProxyType(
+    {_plugins[p]: _import_plugin(_plugins[p]) for p in DEFAULT_PLUGINS}
+)
+_PLUGIN_LOCK = threading.Lock()
+
+
+def _resolve_plugin(plugin_str: Any) -> Any:
+    global CACHED_MODULES
+
+    plugin = CACHED_MODULES.get(plugin_str)
+    if plugin is None:
+        plugin = _import_plugin(plugin_str)
+        with _PLUGIN_LOCK:
+            CACHED_MODULES = MappingProxyType({**CACHED_MODULES, plugin_str: plugin})
+    return plugin
+
+
+class RenderContext:
+    """Mutable state of a single conversion.
+
+    Renderers and parsers are shared between threads, so anything that varies
+    from one document to the next lives here instead, in a context variable set
+    by :meth:`RestMarkdown.parse`.
+    """
+
+    def __init__(
+        self, tokens_only: bool = False, metadata: Optional[DocumentMetadata] = None
+    ) -> None:
+        self.include_raw_html = False
+        self.tokens_only = tokens_only
+        self.metadata = metadata
+
+
+_CONTEXT: ContextVar[Optional[RenderContext]] = ContextVar(
+    "sphinx_mdinclude_context", default=None
+)
+
 
 class RestRenderer(BaseRenderer):
-    _include_raw_html = False
     indent = " " * 3
     list_marker = "{#__rest_list_mark__#}"
     hmarks = {
@@ -34,12 +109,35 @@ class RestRenderer(BaseRenderer):
         6: "#",
     }
 
-    def __init__(self, *args: Any, **kwargs: Any) -> None:
+    def __init__(
+        self,
+        *args: Any,
+        anchors: Optional[Mapping[str, str]] = None,
+        data_uri_dir: Optional[str] = None,
+        data_uri_url: Optional[str] = None,
+        link_resolver: Optional[LinkResolver] = None,
+        **kwargs: Any,
+    ) -> None:
+        """
+        :param anchors: maps ``#anchor`` link targets to the labels they resolve to.
+        :param data_uri_dir: directory to extract ``data:`` URI images into.
+        :param data_uri_url: path of ``data_uri_dir`` as referenced from the output.
+        :param link_resolver: maps link URLs to a ``(role, target)`` pair, like
+            ``("doc", "/usage")``, or ``None`` to leave them as hyperlinks.
+        """
         self._indent_block = partial(textwrap.indent, prefix=self.indent)
+        self.anchors = anchors or {}
+        self.link_resolver = link_resolver
+        self.data_uri_dir = data_uri_dir
+        self.data_uri_url = data_uri_dir if data_uri_url is None else data_uri_url
         super().__init__(*args, **kwargs)
 
     def render_token(self, token: Dict[str, Any], state: BlockState) -> str:
         # based on mistune 3.0.2, mistune/renderers/html.py
+        if token["type"] in METADATA_TOKENS:
+            metadata = self.context.metadata
+            if metadata is not None:
+                metadata.collect(token)
         func: Callable[..., str] = self._get_method(token["type"])
         attrs = token.get("attrs")
         style = token.get("style")
@@ -71,10 +169,47 @@ class RestRenderer(BaseRenderer):
     def finalize(self, data: Iterable[str]) -> str:
         return "".join(data)
 
+    @property
+    def context(self) -> RenderContext:
+        """State of the conversion in progress."""
+        context = _CONTEXT.get()
+        if context is None:
+            # rendering outside of RestMarkdown.parse
+            context = RenderContext()
+            _CONTEXT.set(context)
+        return context
+
     def _raw_html(self, html: str) -> str:
-        self._include_raw_html = True
+        self.context.include_raw_html = True
         return r":raw-html-md:`{}`".format(html)
 
+    def _extract_data_uri(self, url: str) -> str:
+        """Write a ``data:`` URI to a content-addressed file, and return its path."""
+        if not self.data_uri_dir or not url.startswith("data:") or "," not in url:
+            return url
+
+        header, data = url[5:].split(",", 1)
+        mediatype, *params = header.split(";")
+        try:
+            if "base64" in params:
+                content = base64.b64decode(data)
+            else:
+                content = unquote_to_bytes(data)
+        except ValueError:
+            return url
+
+        extension = mimetypes.guess_extension(mediatype.strip() or "text/plain") or ""
+        name = hashlib.sha256(content).hexdigest()[:32] + extension
+        path = os.path.join(self.data_uri_dir, name)
+        if not os.path.exists(path):
+            with uninterrupted():
+                os.makedirs(self.data_uri_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.data_uri_dir)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, path)
+        return "{}/{}".format(self.data_uri_url, name)
+
     def block_code(self, code: str, style: str, info: Optional[str] = None) -> str:
         if info == "math":
             first_line = "\n.. math::\n\n"
@@ -86,6 +221,18 @@ class RestRenderer(BaseRenderer):
         newline = "\n" if style == "indent" else ""
         return first_line + self._indent_block(code + newline)
 
+    def literal_include(self, path: str, lines: str, info: Optional[str] = None) -> str:
+        """Rendering a large fenced code block by reference to its source lines.
+
+        :param path: source file containing the code block.
+        :param lines: range of lines of the code block within the source file.
+        :param info: language of the code block.
+        """
+        directive = "\n.. literalinclude:: {}\n   :lines: {}\n".format(path, lines)
+        if info:
+            directive += "   :language: {}\n".format(info)
+        return directive + "\n"
+
     def block_quote(self, text: str) -> str:
         # text includes some empty line
         return "\n..\n\n{}\n\n".format(self._indent_block(text.strip("\n")))
@@ -238,6 +385,7 @@ class RestRenderer(BaseRenderer):
         :param title: title content for `title` attribute.
         """
         if text.startswith("\n.. image::"):
+            url = self._extract_data_uri(url)
             text = re.sub(r":target: (.*)\n", f":target: {url}\n", text)
             return text
 
@@ -252,6 +400,14 @@ class RestRenderer(BaseRenderer):
                 '<a href="{url}">{text}</a>'.format(url=url, text=html)
             )
 
+        if self.link_resolver is not None:
+            resolved = self.link_resolver(url)
+            if resolved is not None:
+                role, target = resolved
+                return r":{role}:`{text} <{target}>`".format(
+                    role=role, text=text, target=target
+                )
+
         underscore = "_"
         if title:
             return self._raw_html(
@@ -260,7 +416,7 @@ class RestRenderer(BaseRenderer):
                 )
             )
         if url.startswith("#"):
-            target = url[1:]
+            target = self.anchors.get(url[1:], url[1:])
             return r":ref:`{text} <{target}>`".format(target=target, text=text)
 
         return r"`{text} <{target}>`{underscore}".format(
@@ -276,6 +432,7 @@ class RestRenderer(BaseRenderer):
         """
         # rst does not support title option
         # and I couldn't find title attribute in HTML standard
+        url = self._extract_data_uri(url)
         return "\n".join(
             [
                 "",
@@ -287,6 +444,8 @@ class RestRenderer(BaseRenderer):
         )
 
     def image_link(self, url: str, target: str, alt: str) -> str:
+        url = self._extract_data_uri(url)
+        target = self._extract_data_uri(target)
         return "\n".join(
             [
                 "",
@@ -367,45 +526,320 @@ class RestMarkdown(Markdown):
         block: Optional[RestBlockParser] = None,
         inline: Optional[RestInlineParser] = None,
         plugins: Optional[List[Any]] = None,
+        limits: Optional[ConversionLimits] = None,
+        anchors: Optional[Mapping[str, str]] = None,
+        literalinclude_threshold: Optional[int] = None,
+        data_uri_dir: Optional[str] = None,
+        data_uri_url: Optional[str] = None,
+        link_resolver: Optional[LinkResolver] = None,
+        reference_links: Optional[Mapping[str, Any]] = None,
+        fragments: Optional[FragmentCache] = None,
+        block_cache: Optional[BlockCache] = None,
         **kwargs: Any,
     ) -> None:
-        renderer = renderer or RestRenderer()
-        block = block or RestBlockParser()
+        """
+        :param reference_links: shared link reference definitions, from
+            :func:`parse_reference_links`, that each document may override.
+        :param fragments: enables ``{!path!}`` includes of Markdown fragments,
+            parsed once and shared by every document converted with it.
+        :param block_cache: reuses the rendered rst of identical top-level blocks,
+            from any document converted with the same options.
+        """
+        self.limits = limits
+        self.reference_links = reference_links
+        self.fragments = fragments
+        self.block_cache = block_cache
+        self._options = dict(
+            kwargs,
+            limits=limits,
+            anchors=anchors,
+            literalinclude_threshold=literalinclude_threshold,
+            data_uri_dir=data_uri_dir,
+            data_uri_url=data_uri_url,
+            link_resolver=link_resolver,
+            reference_links=reference_links,
+        )
+        renderer = renderer or RestRenderer(
+            anchors=anchors,
+            data_uri_dir=data_uri_dir,
+            data_uri_url=data_uri_url,
+            link_resolver=link_resolver,
+        )
+        block = block or RestBlockParser(
+            literalinclude_threshold=literalinclude_threshold
+        )
         inline = inline or RestInlineParser()
         plugins_str = plugins or [_plugins[p] for p in DEFAULT_PLUGINS]
-        plugins = []
-        for plugin_str in plugins_str:
-            if plugin_str in CACHED_MODULES:
-                plugins.append(CACHED_MODULES[plugin_str])
-            else:
-                if isinstance(plugin_str, str):
-                    module_path, func_name = plugin_str.rsplit(".", 1)
-                    module = import_module(module_path)
-                    plugin = getattr(module, func_name)
-                else:
-                    # Presumably a function has been passed
-                    plugin = plugin_str
-                CACHED_MODULES[plugin_str] = plugin
-                plugins.append(plugin)
+        plugins = [_resolve_plugin(plugin_str) for plugin_str in plugins_str]
 
         super().__init__(renderer, block=block, inline=inline, plugins=plugins)
+        self.before_render_hooks.append(lambda md, state: merge_included_links(state))
+        self.before_render_hooks.append(lambda md, state: shift_headings(state))
+
+        if block_cache is not None:
+            # limits and shared definitions never change how a cacheable block renders
+            options = {
+                k: v
+                for k, v in self._options.items()
+                if k not in ("limits", "link_resolver", "reference_links")
+            }
+            namespace = repr(
+                (
+                    _freeze(options),
+                    [type(part).__qualname__ for part in (renderer, block, inline)],
+                    plugins_str,
+                )
+            )
+            self._block_namespace = hashlib.blake2b(
+                namespace.encode("utf-8", "surrogatepass"), digest_size=16
+            ).digest()
+            self._block_state = document_state(
+                links=link_resolver is not None, data_uris=data_uri_dir is not None
+            )
+
+    def reference(self) -> "RestMarkdown":
+        """Return a new converter with the same options, but the default parsers
+        and renderer, and its own fragment cache, to check conversions against.
+        """
+        fragments = None
+        if self.fragments is not None:
+            fragments = FragmentCache(self.fragments.root, self.fragments.encoding)
+        return RestMarkdown(fragments=fragments, **self._options)
 
     def parse(
         self,
         text: str,
         state: Optional[BlockState] = None,
+        metadata: Optional[DocumentMetadata] = None,
     ) -> Tuple[str, Optional[BlockState]]:
-        output, state = super().parse(text)
-        output = self.post_process(output)
+        """Convert text to rst, collecting its ``metadata`` too, if given."""
+        return self._parse(text, state, RenderContext(metadata=metadata))
+
+    def convert_with_metadata(
+        self, text: str, state: Optional[BlockState] = None
+    ) -> ConversionResult:
+        """Convert text to rst, and collect its metadata in the same pass."""
+        metadata = DocumentMetadata()
+        output, _ = self.parse(text, state, metadata)
+        return ConversionResult(output, metadata)
+
+    def parse_tokens(
+        self, text: str, state: Optional[BlockState] = None
+    ) -> List[Token]:
+        """Parse text into a token tree, which :meth:`render_tokens` can render."""
+        tokens, _ = self._parse(text, state, RenderContext(tokens_only=True))
+        return tokens  # type: ignore[no-any-return]
+
+    def render_tokens(
+        self, tokens: List[Token], state: Optional[BlockState] = None
+    ) -> str:
+        """Render a token tree from :meth:`parse_tokens`, without modifying it."""
+        token = _CONTEXT.set(RenderContext())
+        try:
+            output = self.renderer(tokens, state or self.block.state_cls())
+            return self.post_process(output, state)
+        finally:
+            _CONTEXT.reset(token)
+
+    def render_state(self, state: BlockState) -> Any:
+        context = _CONTEXT.get()
+        if context is not None and context.tokens_only:
+            # also used by after-render hooks, like footnotes
+            return list(self._iter_render(state.tokens, state))
+        if self.block_cache is not None and context is not None:
+            return self._render_blocks(state, self.block_cache, context)
+        return super().render_state(state)
+
+    def _render_blocks(
+        self, state: BlockState, cache: BlockCache, context: RenderContext
+    ) -> str:
+        """Render each top-level block, reusing the output of identical blocks.
+
+        Counts of reused, rendered, and uncacheable blocks are added to
+        ``state.env["block_cache"]``.
+        """
+        stats = state.env.setdefault(
+            "block_cache", {"hits": 0, "misses": 0, "skipped": 0}
+        )
+        outputs = []
+        for token in state.tokens:
+            if "text" not in token and "children" not in token:
+                # blank lines, code, directives: cheaper to render than to look up
+                outputs.append(self.renderer.render_token(token, state))
+                continue
+            key = block_key(token, self._block_namespace, self._block_state)
+            if key is None:
+                cache.skip()
+                stats["skipped"] += 1
+                outputs.append(self.renderer(self._iter_render([token], state), state))
+                continue
+
+            block = cache.get(key)
+            if block is None:
+                stats["misses"] += 1
+                block = self._render_block(token, state, context)
+                with uninterrupted():
+                    cache.put(key, block)
+            else:
+                stats["hits"] += 1
+            if block.raw_html:
+                context.include_raw_html = True
+            if context.metadata is not None:
+                context.metadata.extend(block.metadata)
+            outputs.append(block.output)
+        return self.renderer.finalize(outputs)  # type: ignore[no-any-return]
+
+    def _render_block(
+        self, token: Token, state: BlockState, context: RenderContext
+    ) -> CachedBlock:
+        """Render one block, with the raw HTML and metadata it needs on reuse."""
+        include_raw_html, metadata = context.include_raw_html, context.metadata
+        context.include_raw_html = False
+        context.metadata = DocumentMetadata()
+        try:
+            output = self.renderer(self._iter_render([token], state), state)
+            return CachedBlock(output, context.include_raw_html, context.metadata)
+        finally:
+            context.include_raw_html = include_raw_html
+            context.metadata = metadata
+
+    def _parse(
+        self, text: str, state: Optional[BlockState], context: RenderContext
+    ) -> Tuple[Any, Optional[BlockState]]:
+        token = _CONTEXT.set(context)
+        try:
+            state = state or self.block.state_cls()
+            if self.fragments is not None:
+                state.env.setdefault("fragments", self.fragments)
+            reference_links = self.reference_links
+            # definitions from earlier conversions in the same document
+            document_links = state.env.get("document_ref_links")
+            if document_links:
+                reference_links = ChainMap(
+                    document_links, reference_links or {}  # type: ignore[arg-type]
+                )
+            if reference_links:
+                state.env["ref_links"] = ReferenceLinks(
+                    state.env["ref_links"], reference_links
+                )
+            budget = state.env.get("budget")
+            if budget is None and self.limits is not None:
+                budget = state.env["budget"] = self.limits.start(text)
+            if budget is None:
+                output, state = super().parse(text, state)
+            else:
+                with budget.interrupt():
+                    output, state = super().parse(text, state)
+            if not context.tokens_only:
+                output = self.post_process(output, state)
+        finally:
+            _CONTEXT.reset(token)
 
         return output, state
 
-    def post_process(self, text: str) -> str:
-        if self.renderer._include_raw_html:
-            return PROLOG + text
-        else:
+    def post_process(self, text: str, state: Optional[BlockState] = None) -> str:
+        """Define the raw HTML role if the text uses it.
+
+        If ``state.env["raw_html_role"]`` is set, the role is already defined
+        elsewhere in the document, and ``state.env["include_raw_html"]`` only
+        records whether it is used.
+        """
+        context = _CONTEXT.get()
+        if context is None or not context.include_raw_html:
             return text
+        if state is not None:
+            state.env["include_raw_html"] = True
+            if state.env.get("raw_html_role"):
+                return text
+        return PROLOG + text
+
+
+# options can come from clients of the server, so only keep the most recent
+MAX_CONVERTERS = 64
+_CONVERTERS: "OrderedDict[Any, RestMarkdown]" = OrderedDict()
+_CONVERTERS_LOCK = threading.Lock()
+
+
+def _freeze(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def get_converter(**kwargs: Any) -> RestMarkdown:
+    """Return a shared, warm converter for the given options.
+
+    Converters are safe to use from many threads at once, so each distinct set of
+    options only needs one. Only the :data:`MAX_CONVERTERS` most recently used
+    are kept. Options that cannot be hashed get a new converter.
+    """
+    try:
+        key = _freeze(kwargs)
+        hash(key)
+    except TypeError:
+        return RestMarkdown(**kwargs)
+
+    with _CONVERTERS_LOCK:
+        converter = _CONVERTERS.get(key)
+        if converter is not None:
+            _CONVERTERS.move_to_end(key)
+            return converter
+    converter = RestMarkdown(**kwargs)
+    with _CONVERTERS_LOCK:
+        # another thread may have made one meanwhile, keep a single converter
+        converter = _CONVERTERS.setdefault(key, converter)
+        _CONVERTERS.move_to_end(key)
+        while len(_CONVERTERS) > MAX_CONVERTERS:
+            _CONVERTERS.popitem(last=False)
+    return converter
 
 
 def convert(text: str, **kwargs: Any) -> str:
     return str(RestMarkdown(**kwargs)(text))
+
+
+def convert_with_metadata(text: str, **kwargs: Any) -> ConversionResult:
+    """Convert Markdown to rst, with the headings, links, images, and footnote
+    references of the document.
+    """
+    return get_converter(**kwargs).convert_with_metadata(text)
+
+
+def parse_tokens(text: str, **kwargs: Any) -> List[Token]:
+    """Parse Markdown into a token tree of plain dicts, lists, and strings."""
+    return get_converter(**kwargs).parse_tokens(text)
+
+
+def render_tokens(tokens: List[Token], **kwargs: Any) -> str:
+    """Render a token tree from :func:`parse_tokens` with the given options."""
+    return get_converter(**kwargs).render_tokens(tokens)
+
+
+def dump_tokens(tokens: List[Token]) -> bytes:
+    """Serialize a token tree to compact bytes, to cache on disk."""
+    return marshal.dumps((TOKEN_FORMAT, tokens))
+
+
+def load_tokens(data: bytes) -> List[Token]:
+    """Load a token tree from :func:`dump_tokens`.
+
+    Raises :class:`ValueError` if the data was written by an incompatible version.
+    """
+    try:
+        version, tokens = marshal.loads(data)
+    except (EOFError, TypeError, ValueError):
+        raise ValueError("invalid token data")
+    if version != TOKEN_FORMAT:
+        raise ValueError("unsupported token format {!r}".format(version))
+    return tokens  # type: ignore[no-any-return]
+
+
+def convert_many(
+    texts: Iterable[str], max_workers: Optional[int] = None, **kwargs: Any
+) -> List[str]:
+    """Convert many documents on a pool of threads sharing one converter."""
+    converter = get_converter(**kwargs)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [str(output) for output in pool.map(converter, texts)]
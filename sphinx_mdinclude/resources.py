@@ -0,0 +1,125 @@
+"""
+Markdown sources inside zip archives and installed packages
+"""
+
+import hashlib
+import os
+import pkgutil
+import threading
+import zipfile
+from typing import Dict, NamedTuple, Optional, Tuple
+
+ARCHIVE_SEPARATOR = "!"
+# archives named by these suffixes are recognized even before they exist
+ARCHIVE_SUFFIXES = (".zip", ".whl")
+ARCHIVE = "archive"
+PACKAGE = "package"
+
+
+class Resource(NamedTuple):
+    """A file inside a zip archive, or inside an installed package."""
+
+    kind: str
+    location: str  # absolute path of the archive, or the package name
+    name: str  # path of the member, separated by "/"
+
+    def __str__(self) -> str:
+        if self.kind == ARCHIVE:
+            return "{}{}{}".format(self.location, ARCHIVE_SEPARATOR, self.name)
+        return "{}:{}".format(self.location, self.name)
+
+
+class _Archive(NamedTuple):
+    pid: int
+    stamp: Tuple[int, int]
+    zip: zipfile.ZipFile
+    members: Dict[str, zipfile.ZipInfo]
+    lock: threading.Lock
+
+
+class ArchiveCache:
+    """Open zip archives, shared by every read during a build.
+
+    Each archive is opened once, and its central directory indexed, until it
+    changes on disk. Processes forked for parallel reads open their own handles,
+    as a shared file offset is not safe to seek.
+    """
+
+    def __init__(self) -> None:
+        self._archives: Dict[str, _Archive] = {}
+        self._lock = threading.Lock()
+
+    def _open(self, path: str) -> _Archive:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            archive = self._archives.get(path)
+            if archive is not None and (archive.pid, archive.stamp) == (
+                os.getpid(),
+                stamp,
+            ):
+                return archive
+            if archive is not None and archive.pid == os.getpid():
+                archive.zip.close()
+            handle = zipfile.ZipFile(path)
+            index = {info.filename: info for info in handle.infolist()}
+            archive = _Archive(os.getpid(), stamp, handle, index, threading.Lock())
+            self._archives[path] = archive
+            return archive
+
+    def read(self, path: str, name: str) -> bytes:
+        archive = self._open(path)
+        info = archive.members.get(name)
+        if info is None:
+            raise FileNotFoundError("no item named {!r} in {}".format(name, path))
+        with archive.lock:
+            return archive.zip.read(info)
+
+    def close(self) -> None:
+        with self._lock:
+            for archive in self._archives.values():
+                if archive.pid == os.getpid():
+                    archive.zip.close()
+            self._archives.clear()
+
+    def __len__(self) -> int:
+        return len(self._archives)
+
+
+ARCHIVES = ArchiveCache()
+
+
+def parse_resource(
+    spec: str, base: str, package: Optional[str] = None
+) -> Optional[Resource]:
+    """Return the resource named by an ``mdinclude`` argument, if it is one.
+
+    ``archive.zip!docs/file.md`` names a member of an archive, relative to the
+    ``base`` directory, and any path is a resource of ``package``, if given.
+    The part before a ``!`` only names an archive if it is an existing file, or
+    has the suffix of an archive, so other paths can contain ``!`` too.
+    """
+    if package:
+        return Resource(PACKAGE, package, spec.lstrip("/"))
+    index = spec.find(ARCHIVE_SEPARATOR)
+    while index != -1:
+        archive, name = spec[:index], spec[index + 1 :]
+        path = os.path.normpath(os.path.join(base, archive))
+        if archive.lower().endswith(ARCHIVE_SUFFIXES) or os.path.isfile(path):
+            return Resource(ARCHIVE, path, name.lstrip("/"))
+        index = spec.find(ARCHIVE_SEPARATOR, index + 1)
+    return None
+
+
+def read_resource(resource: Resource) -> bytes:
+    if resource.kind == ARCHIVE:
+        return ARCHIVES.read(resource.location, resource.name)
+    # uses the package's loader, so also works for zipped packages
+    data = pkgutil.get_data(resource.location, resource.name)
+    if data is None:
+        raise FileNotFoundError("cannot load resources from {}".format(resource))
+    return data
+
+
+def digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
@@ -0,0 +1,417 @@
+"""
+Local conversion server and client
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from .parse import ConversionLimitExceeded, ConversionLimits
+from .render import get_converter
+
+DEFAULT_CACHE_SIZE = 1024
+MARKDOWN_TYPE = "text/markdown"
+RST_TYPE = "text/x-rst; charset=utf-8"
+JSON_TYPE = "application/json"
+
+
+def _options(raw: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Validate conversion options received from a client.
+
+    Only options that cannot make the server touch the filesystem are accepted.
+    """
+    options: Dict[str, Any] = {}
+    for key, value in (raw or {}).items():
+        if key == "limits":
+            options["limits"] = ConversionLimits(**value)
+        elif key == "anchors":
+            options["anchors"] = {str(k): str(v) for k, v in value.items()}
+        else:
+            raise ValueError("unsupported option {!r}".format(key))
+    return options
+
+
+class ResultCache:
+    """Thread-safe LRU cache of converted documents."""
+
+    def __init__(self, size: int = DEFAULT_CACHE_SIZE) -> None:
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(text: str, options: Dict[str, Any]) -> str:
+        digest = hashlib.sha256(json.dumps(options, sort_keys=True).encode())
+        digest.update(text.encode("utf-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class ConversionService:
+    """Converts documents on a pool of warm converters, with a result cache."""
+
+    def __init__(
+        self, workers: Optional[int] = None, cache_size: int = DEFAULT_CACHE_SIZE
+    ) -> None:
+        self.pool = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="sphinx-mdinclude-serve"
+        )
+        self.cache = ResultCache(cache_size)
+        self.started = time.monotonic()
+        self.requests = 0
+        self.conversions = 0
+        self.errors = 0
+        self.conversion_time = 0.0
+        self._lock = threading.Lock()
+        # warm up the default converter before the first request
+        get_converter()
+
+    def _convert(self, text: str, raw_options: Optional[Dict[str, Any]]) -> str:
+        key = ResultCache.key(text, raw_options or {})
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        converter = get_converter(**_options(raw_options))
+        before = time.perf_counter()
+        try:
+            output = str(converter(text))
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        elapsed = time.perf_counter() - before
+        with self._lock:
+            self.conversions += 1
+            self.conversion_time += elapsed
+        self.cache.put(key, output)
+        return output
+
+    def convert(self, text: str, options: Optional[Dict[str, Any]] = None) -> str:
+        return self.pool.submit(self._convert, text, options).result()
+
+    def convert_batch(self, documents: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """Convert a batch of ``{"text": ..., "options": ...}`` documents at once."""
+        futures = [
+            self.pool.submit(self._convert, doc["text"], doc.get("options"))
+            for doc in documents
+        ]
+        results = []
+        for future in futures:
+            try:
+                results.append({"rst": future.result()})
+            except (ConversionLimitExceeded, TypeError, ValueError) as error:
+                results.append({"error": str(error)})
+        return results
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "uptime": time.monotonic() - self.started,
+            "requests": self.requests,
+            "conversions": self.conversions,
+            "errors": self.errors,
+            "conversion_time": self.conversion_time,
+            "cache_size": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+
+class ConversionHandler(BaseHTTPRequestHandler):
+    """HTTP/1.1 handler, so clients can keep their connection open."""
+
+    protocol_version = "HTTP/1.1"
+    server: Any
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def parse_request(self) -> bool:
+        if not super().parse_request():
+            return False
+        if not self.server.begin_request():
+            self.close_connection = True
+            self.send_error(503, "server is shutting down")
+            return False
+        self.active = True
+        return True
+
+    def handle_one_request(self) -> None:
+        self.active = False
+        try:
+            super().handle_one_request()
+        finally:
+            if self.active:
+                self.server.end_request()
+        if self.server.stopping:
+            self.close_connection = True
+
+    def _send(self, status: int, body: Union[str, Dict[str, Any]]) -> None:
+        if isinstance(body, str):
+            content_type, data = RST_TYPE, body.encode("utf-8")
+        else:
+            content_type, data = JSON_TYPE, json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        service: ConversionService = self.server.service
+        if self.path == "/health":
+            self._send(200, {"status": "ok"})
+        elif self.path == "/metrics":
+            self._send(200, service.metrics())
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        service: ConversionService = self.server.service
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        with service._lock:
+            service.requests += 1
+
+        if self.path != "/convert":
+            self._send(404, {"error": "not found"})
+            return
+
+        try:
+            content_type = self.headers.get_content_type()
+            if content_type == MARKDOWN_TYPE:
+                self._send(200, service.convert(body.decode("utf-8")))
+                return
+
+            request = json.loads(body)
+            if "documents" in request:
+                self._send(
+                    200, {"results": service.convert_batch(request["documents"])}
+                )
+            else:
+                rst = service.convert(request["text"], request.get("options"))
+                self._send(200, {"rst": rst})
+        except (ConversionLimitExceeded, KeyError, TypeError, ValueError) as error:
+            self._send(400, {"error": str(error)})
+
+
+class _Server:
+    """Closing the server waits for requests in progress before the pool stops.
+
+    Handler threads are daemons, as idle keep-alive connections would otherwise
+    keep the server from closing, so requests are counted instead.
+    """
+
+    service: ConversionService
+    daemon_threads = True
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.idle = threading.Condition()
+        self.active = 0
+        self.stopping = False
+
+    def begin_request(self) -> bool:
+        with self.idle:
+            if self.stopping:
+                return False
+            self.active += 1
+            return True
+
+    def end_request(self) -> None:
+        with self.idle:
+            self.active -= 1
+            self.idle.notify_all()
+
+    def server_close(self) -> None:
+        super().server_close()  # type: ignore[misc]
+        with self.idle:
+            self.stopping = True
+            self.idle.wait_for(lambda: self.active == 0)
+        self.service.close()
+
+
+class TCPConversionServer(_Server, ThreadingHTTPServer):
+    pass
+
+
+class UnixConversionServer(_Server, socketserver.ThreadingUnixStreamServer):
+    def get_request(self) -> Tuple[socket.socket, Any]:
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+def make_server(
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    workers: Optional[int] = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+) -> Union[TCPConversionServer, UnixConversionServer]:
+    """Create a conversion server on a Unix socket, or on a local TCP port."""
+    server: Union[TCPConversionServer, UnixConversionServer]
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixConversionServer(socket_path, ConversionHandler)
+    else:
+        server = TCPConversionServer((host, port), ConversionHandler)
+    server.service = ConversionService(workers, cache_size)
+    return server
+
+
+def serve(
+    socket_path: Optional[str] = None,
+    host: str = "127.0.0.1",
+    port: int = 8787,
+    workers: Optional[int] = None,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+) -> None:
+    """Serve conversions until interrupted, then finish in-flight requests."""
+    server = make_server(socket_path, host, port, workers, cache_size)
+
+    def stop(signum: int, frame: Any) -> None:
+        threading.Thread(target=server.shutdown).start()
+
+    handlers = {
+        signum: signal.signal(signum, stop)
+        for signum in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path: str, timeout: Optional[float] = None) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class Client:
+    """Thin client for a conversion server, reusing one persistent connection."""
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        host: str = "127.0.0.1",
+        port: int = 8787,
+        timeout: Optional[float] = None,
+    ) -> None:
+        self.connection: http.client.HTTPConnection
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout)
+
+    def _request(
+        self,
+        method: str,
+        path: str,
+        body: Optional[bytes] = None,
+        content_type: str = "",
+    ) -> Tuple[int, bytes]:
+        headers = {"Content-Type": content_type} if content_type else {}
+        for attempt in (1, 2):
+            try:
+                self.connection.request(method, path, body, headers)
+                response = self.connection.getresponse()
+                return response.status, response.read()
+            except (ConnectionError, http.client.HTTPException):
+                # the server may have closed an idle connection; retry once
+                self.connection.close()
+                if attempt == 2:
+                    raise
+        raise AssertionError("unreachable")
+
+    def _json(self, method: str, path: str, body: Any = None) -> Any:
+        data = None if body is None else json.dumps(body).encode("utf-8")
+        status, response = self._request(method, path, data, JSON_TYPE)
+        result = json.loads(response)
+        if status != 200:
+            raise ValueError(result.get("error", "HTTP {}".format(status)))
+        return result
+
+    @staticmethod
+    def _options(options: Dict[str, Any]) -> Dict[str, Any]:
+        if isinstance(options.get("limits"), ConversionLimits):
+            options["limits"] = asdict(options["limits"])
+        return options
+
+    def convert(self, text: str, **options: Any) -> str:
+        if options:
+            request = {"text": text, "options": self._options(options)}
+            return str(self._json("POST", "/convert", request)["rst"])
+        status, response = self._request(
+            "POST", "/convert", text.encode("utf-8"), MARKDOWN_TYPE
+        )
+        if status != 200:
+            raise ValueError(json.loads(response).get("error"))
+        return response.decode("utf-8")
+
+    def convert_many(self, texts: List[str], **options: Any) -> List[str]:
+        options = self._options(options)
+        documents = [{"text": text, "options": options} for text in texts]
+        results = self._json("POST", "/convert", {"documents": documents})["results"]
+        for result in results:
+            if "error" in result:
+                raise ValueError(result["error"])
+        return [result["rst"] for result in results]
+
+    def health(self) -> Dict[str, Any]:
+        return dict(self._json("GET", "/health"))
+
+    def metrics(self) -> Dict[str, Any]:
+        return dict(self._json("GET", "/metrics"))
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,231 @@
+"""
+Shadow verification of conversions against a reference pipeline
+"""
+
+import difflib
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+MATCH = "match"
+DIVERGED = "diverged"
+ERROR = "error"
+
+# conversions of parts of the input while looking for a minimal reproducer
+MAX_MINIMIZE_STEPS = 64
+MAX_DIFF_LINES = 40
+
+
+class ShadowResult(NamedTuple):
+    """The outcome of checking one conversion against the reference pipeline."""
+
+    source: str
+    status: str
+    optimised_time: float
+    reference_time: float
+    check_time: float
+    diff: str = ""
+    reproducer: str = ""
+
+
+def minimize(
+    text: str, diverges: Callable[[str], bool], max_steps: int = MAX_MINIMIZE_STEPS
+) -> str:
+    """Remove blocks, then lines, of ``text`` for as long as it still diverges."""
+    steps = 0
+    for separator in ("\n\n", "\n"):
+        parts = text.split(separator)
+        i = 0
+        while i < len(parts) and len(parts) > 1 and steps < max_steps:
+            candidate = separator.join(parts[:i] + parts[i + 1 :])
+            steps += 1
+            if diverges(candidate):
+                parts.pop(i)
+            else:
+                i += 1
+        text = separator.join(parts)
+    return text
+
+
+class ShadowVerifier:
+    """Check a random sample of conversions against a reference pipeline.
+
+    Checks run on one background thread. At most ``max_pending`` checks are
+    queued at once, and further samples are skipped, so checking never costs
+    more than one core, nor holds on to more than a few documents.
+    """
+
+    def __init__(
+        self, rate: float, max_pending: int = 4, seed: Optional[int] = None
+    ) -> None:
+        self.rate = rate
+        self.max_pending = max_pending
+        self.random = random.Random(seed)
+        self.pool = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="sphinx-mdinclude-shadow"
+        )
+        self.pending = 0
+        self.sampled = 0
+        self.skipped = 0
+        self.checked = 0
+        self.diverged = 0
+        self.check_time = 0.0
+        self._lock = threading.Lock()
+
+    def sample(self) -> bool:
+        """Whether to check the next conversion."""
+        with self._lock:
+            if self.rate <= 0 or self.random.random() >= self.rate:
+                return False
+            self.sampled += 1
+            if self.pending >= self.max_pending:
+                self.skipped += 1
+                return False
+            self.pending += 1
+            return True
+
+    def submit(
+        self,
+        text: str,
+        output: str,
+        optimised_time: float,
+        optimised: Callable[[str], str],
+        reference: Callable[[str], str],
+        source: str = "<string>",
+    ) -> "Future[ShadowResult]":
+        """Check a sampled conversion of ``text`` to ``output`` in the background.
+
+        ``optimised`` converts again like the conversion that produced ``output``,
+        to find a minimal reproducer if the outputs differ.
+        """
+        return self.pool.submit(
+            self._check, text, output, optimised_time, optimised, reference, source
+        )
+
+    def _check(
+        self,
+        text: str,
+        output: str,
+        optimised_time: float,
+        optimised: Callable[[str], str],
+        reference: Callable[[str], str],
+        source: str,
+    ) -> ShadowResult:
+        started = time.perf_counter()
+        status = ""
+        reference_time = 0.0
+        try:
+            expected = reference(text)
+            reference_time = time.perf_counter() - started
+            if expected == output:
+                status, diff, reproducer = MATCH, "", ""
+            else:
+                status = DIVERGED
+                diff = "\n".join(
+                    list(
+                        difflib.unified_diff(
+                            expected.splitlines(),
+                            output.splitlines(),
+                            "reference",
+                            "optimised",
+                            lineterm="",
+                        )
+                    )[:MAX_DIFF_LINES]
+                )
+                reproducer = minimize(
+                    text, lambda part: optimised(part) != reference(part)
+                )
+        except Exception as error:
+            # a check that fails must not fail the conversion it checks
+            status = ERROR
+            diff = "{}: {}".format(type(error).__name__, error)
+            reproducer = ""
+        finally:
+            check_time = time.perf_counter() - started
+            with self._lock:
+                self.pending -= 1
+                self.checked += 1
+                self.check_time += check_time
+                if status == DIVERGED:
+                    self.diverged += 1
+
+        return ShadowResult(
+            source,
+            status,
+            optimised_time,
+            reference_time,
+            check_time,
+            diff,
+            reproducer,
+        )
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "sampled": self.sampled,
+                "skipped": self.skipped,
+                "checked": self.checked,
+                "diverged": self.diverged,
+                "check_time": self.check_time,
+            }
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
+
+
+Check = Tuple[str, Any, Union["Future[ShadowResult]", ShadowResult]]
+
+
+class PendingChecks:
+    """Checks of documents, as ``(docname, record, future or result)``.
+
+    Finished checks are collected without waiting for the others. Pickling waits
+    for all checks, so a parallel reader sends its results back with the
+    environment.
+    """
+
+    def __init__(self) -> None:
+        self.checks: List[Check] = []
+
+    def add(self, docname: str, record: Any, future: "Future[ShadowResult]") -> None:
+        self.checks.append((docname, record, future))
+
+    def drain(self, wait: bool = False) -> List[Tuple[str, Any, ShadowResult]]:
+        """Remove and return finished checks, or all of them with ``wait``."""
+        done = []
+        pending: List[Check] = []
+        for docname, record, result in self.checks:
+            if isinstance(result, Future):
+                if not (wait or result.done()):
+                    pending.append((docname, record, result))
+                    continue
+                result = result.result()
+            done.append((docname, record, result))
+        self.checks = pending
+        return done
+
+    def __getstate__(self) -> Dict[str, Any]:
+        return {
+            "checks": [
+                (d, r, f.result() if isinstance(f, Future) else f)
+                for d, r, f in self.checks
+            ]
+        }
+
+    def __len__(self) -> int:
+        return len(self.checks)
+
+
+def summarize(results: List[ShadowResult]) -> Dict[str, Any]:
+    """Totals of many results, including the time spent checking."""
+    return {
+        "checked": len(results),
+        "diverged": sum(1 for r in results if r.status == DIVERGED),
+        "errors": sum(1 for r in results if r.status == ERROR),
+        "optimised_time": sum(r.optimised_time for r in results),
+        "reference_time": sum(r.reference_time for r in results),
+        "check_time": sum(r.check_time for r in results),
+    }
@@ -2,19 +2,724 @@
 Sphinx extension
 """
 
+import codecs
+import glob
 import os
 import os.path
-from typing import Any, Dict, List, Union
+import re
+import secrets
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from types import MappingProxyType
+from typing import (
+    Any,
+    Callable,
+    Counter,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import unquote
 
-from docutils import io, statemachine, utils
+from docutils import io, nodes, statemachine, utils
 from docutils.io import error_string as ErrorString
 from docutils.nodes import document as Document
 from docutils.parsers import rst
 from docutils.parsers.rst import directives as rst_directives
+from mistune.core import BlockState
 from sphinx.application import Sphinx
+from sphinx.project import Project
+from sphinx.util import logging
+from sphinx.util.docutils import switch_source_input
+from sphinx.util.nodes import nested_parse_with_titles
 
 from . import RestMarkdown
 from .__version__ import __version__
+from .blocks import BlockCache
+from .diagnostics import capture
+from .doctrees import adopt, cacheable, has_titles, node_key, NodeCache
+from .metadata import DocumentMetadata
+from .metrics import ConversionMetrics, count_tokens, slowest, write_report
+from .parse import (
+    ConversionLimitExceeded,
+    ConversionLimits,
+    find_section,
+    FragmentCache,
+    Heading,
+    parse_reference_links,
+    ReferenceLinks,
+    scan_headings,
+    slugify,
+    split_sections,
+)
+from .render import PROLOG
+from .resources import ARCHIVES, digest, parse_resource, read_resource, Resource
+from .shadow import DIVERGED, ERROR, PendingChecks, ShadowVerifier, summarize
+
+PARTS_SUFFIX = ".parts"
+# marks a parts directory as generated, and safe to remove
+PARTS_MARKER = ".mdinclude-parts"
+METADATA_EVENT = "mdinclude-metadata"
+
+SHADOW_VERIFIERS: Dict[int, ShadowVerifier] = {}
+SHADOW_VERIFIERS_LOCK = threading.Lock()
+
+_DIGITS_RE = re.compile(r"(\d+)")
+
+logger = logging.getLogger(__name__)
+
+# (path, mtime, size) -> headings, shared by every mdinclude of a file
+HEADING_INDEX: Dict[Tuple[str, int, int], List[Heading]] = {}
+HEADING_INDEX_SIZE = 256
+HEADING_INDEX_LOCK = threading.Lock()
+
+
+def _heading_index(path: str, text: str) -> List[Heading]:
+    """Return the headings of an included file, reusing an earlier scan."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    headings = HEADING_INDEX.get(key)
+    if headings is None:
+        headings = scan_headings(text)
+        with HEADING_INDEX_LOCK:
+            if len(HEADING_INDEX) >= HEADING_INDEX_SIZE:
+                HEADING_INDEX.pop(next(iter(HEADING_INDEX)))
+            HEADING_INDEX[key] = headings
+    return headings
+
+
+# ((path, mtime, size), ...) -> link reference definitions of those files
+REFERENCE_LINKS: Dict[Tuple[Tuple[str, int, int], ...], Mapping[str, Any]] = {}
+REFERENCE_LINKS_LOCK = threading.Lock()
+
+# size -> rendered blocks, shared by every document of every build in a process
+BLOCK_CACHES: Dict[int, BlockCache] = {}
+BLOCK_CACHES_LOCK = threading.Lock()
+
+# size -> parsed subtrees of mdinclude targets, shared like the block caches
+NODE_CACHES: Dict[int, NodeCache] = {}
+NODE_CACHES_LOCK = threading.Lock()
+
+
+def _reference_links(env: Any) -> Optional[Mapping[str, Any]]:
+    """Return the shared link reference definitions, parsing files only on change.
+
+    Definitions in earlier files take precedence over later ones.
+    """
+    paths = [os.path.join(env.srcdir, p) for p in env.config.md_reference_links]
+    if not paths:
+        return None
+
+    key = []
+    found = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # missing files are reported once, when the definitions are parsed
+            key.append((os.path.abspath(path), -1, -1))
+        else:
+            key.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+            found.append(path)
+    links = REFERENCE_LINKS.get(tuple(key))
+    if links is None:
+        merged: Dict[str, Any] = {}
+        for path in reversed(paths):
+            try:
+                with open(path, encoding=env.config.source_encoding) as f:
+                    merged.update(parse_reference_links(f.read()))
+            except OSError as error:
+                logger.warning(
+                    "md_reference_links: cannot read %s: %s",
+                    os.path.relpath(path, env.srcdir),
+                    error.strerror,
+                )
+        links = MappingProxyType(merged)
+        with REFERENCE_LINKS_LOCK:
+            # stale entries for older versions of the files are never used again
+            REFERENCE_LINKS.clear()
+            REFERENCE_LINKS[tuple(key)] = links
+
+    for path in found:
+        env.note_dependency(path)
+    return links
+
+
+def _limits(config: Any) -> Optional[ConversionLimits]:
+    limits = ConversionLimits(
+        max_size=config.md_max_input_size,
+        max_depth=config.md_max_nesting_depth,
+        timeout=config.md_conversion_timeout,
+    )
+    if limits == ConversionLimits():
+        return None
+    return limits
+
+
+def _data_uri_options(env: Any) -> Dict[str, str]:
+    if not env.config.md_extract_data_uris:
+        return {}
+    # shared by every document, so identical images are only stored once
+    data_uri_dir = os.path.join(env.doctreedir, "mdinclude-images")
+    relpath = os.path.relpath(data_uri_dir, env.srcdir).replace(os.path.sep, "/")
+    return {"data_uri_dir": data_uri_dir, "data_uri_url": "/" + relpath}
+
+
+class LinkIndex:
+    """Project documents and heading anchors, to resolve relative links.
+
+    Built once per build, before reading documents, and shared with parallel
+    read workers.
+    """
+
+    def __init__(
+        self,
+        srcdir: str,
+        docs: Dict[str, str],
+        anchors: Dict[str, Mapping[str, str]],
+    ) -> None:
+        self.srcdir = srcdir
+        #: source paths relative to srcdir, with and without suffix -> docname
+        self.docs = docs
+        #: docname -> heading slug -> label
+        self.anchors = anchors
+
+    def resolver(self, base: str) -> "LinkResolver":
+        """Return a resolver for links in a file in the directory ``base``."""
+        return LinkResolver(self, base)
+
+
+class LinkResolver:
+    def __init__(self, index: LinkIndex, base: str) -> None:
+        self.index = index
+        self.base = base
+
+    def __call__(self, url: str) -> Optional[Tuple[str, str]]:
+        if not url or url.startswith(("#", "/", "\\")) or ":" in url.split("/")[0]:
+            return None
+        path, _, fragment = url.partition("#")
+        target = os.path.normpath(os.path.join(self.base, unquote(path)))
+        relpath = os.path.relpath(target, self.index.srcdir).replace(os.path.sep, "/")
+        docname = self.index.docs.get(relpath)
+        if docname is None:
+            return None
+        label = self.index.anchors.get(docname, {}).get(fragment)
+        if label is not None:
+            return "ref", label
+        return "doc", "/" + docname
+
+
+def build_link_index(app: Sphinx, env: Any, docnames: List[str]) -> None:
+    """Index documents and Markdown headings for ``md_parse_relative_links``."""
+    if not app.config.md_parse_relative_links:
+        return
+
+    # docname -> (mtime, slugs), kept between builds to skip unchanged files
+    slugs: Dict[str, Tuple[int, FrozenSet[str]]] = getattr(
+        env, "mdinclude_heading_slugs", {}
+    )
+    split_anchors = getattr(env, "mdinclude_split_anchors", {})
+    suffixes = app.config.source_suffix
+    docs: Dict[str, str] = {}
+    anchors: Dict[str, Mapping[str, str]] = {}
+    for docname in env.found_docs:
+        path = str(env.doc2path(docname))
+        relpath = os.path.relpath(path, env.srcdir).replace(os.path.sep, "/")
+        docs[relpath] = docs[docname] = docname
+        if docname in split_anchors:
+            anchors[docname] = split_anchors[docname]
+            continue
+        if suffixes.get(os.path.splitext(path)[1]) != "markdown":
+            continue
+
+        mtime = os.stat(path).st_mtime_ns
+        cached = slugs.get(docname)
+        if cached is None or cached[0] != mtime:
+            with open(path, encoding=app.config.source_encoding) as f:
+                cached = slugs[docname] = (
+                    mtime,
+                    frozenset(h.slug for h in scan_headings(f.read())),
+                )
+        anchors[docname] = {slug: "{}#{}".format(docname, slug) for slug in cached[1]}
+
+    for docname in set(slugs) - env.found_docs:
+        del slugs[docname]
+    env.mdinclude_heading_slugs = slugs
+    env.mdinclude_link_index = LinkIndex(env.srcdir, docs, anchors)
+
+
+def _link_resolver(env: Any, path: str) -> Optional[LinkResolver]:
+    index: Optional[LinkIndex] = getattr(env, "mdinclude_link_index", None)
+    if index is None or not env.config.md_parse_relative_links:
+        return None
+    return index.resolver(os.path.dirname(os.path.abspath(path)))
+
+
+def _label_sections(
+    document: Document, headings: Sequence[Heading], docname: str
+) -> None:
+    """Give each section of a converted document its ``docname#slug`` label.
+
+    Headings are matched to sections in order by title, skipping sections that
+    come from elsewhere, like included files. Headings without a section, like
+    those in directive content, label the first section, so that links to them
+    still lead to the document.
+    """
+    sections = list(document.findall(nodes.section))
+    if not sections:
+        return
+    position = 0
+    for heading in headings:
+        target = 0
+        slug = slugify(heading.title)
+        for i in range(position, len(sections)):
+            if slugify(sections[i][0].astext()) == slug:
+                target = i
+                position = i + 1
+                break
+        name = nodes.fully_normalize_name("{}#{}".format(docname, heading.slug))
+        if name not in document.nameids and sections[target]["ids"]:
+            # only the new name is explicit; noting the section as an explicit
+            # target would make its title a label of the whole project too
+            document.nameids[name] = sections[target]["ids"][0]
+            document.nametypes[name] = True
+
+
+def _block_cache(env: Any) -> Optional[BlockCache]:
+    size = env.config.md_block_cache_size
+    if not size:
+        return None
+    cache = BLOCK_CACHES.get(size)
+    if cache is None:
+        with BLOCK_CACHES_LOCK:
+            cache = BLOCK_CACHES.get(size)
+            if cache is None:
+                BLOCK_CACHES.clear()
+                cache = BLOCK_CACHES[size] = BlockCache(size)
+    return cache
+
+
+def _node_cache(env: Any) -> Optional[NodeCache]:
+    size = env.config.md_node_cache_size
+    if not size:
+        return None
+    cache = NODE_CACHES.get(size)
+    if cache is None:
+        with NODE_CACHES_LOCK:
+            cache = NODE_CACHES.get(size)
+            if cache is None:
+                NODE_CACHES.clear()
+                cache = NODE_CACHES[size] = NodeCache(size)
+    return cache
+
+
+def _parse_context(document: Document) -> Tuple[Any, ...]:
+    """What parsing rst depends on in the document, besides the rst itself."""
+    env = document.settings.env
+    return (
+        env.temp_data.get("highlight_language"),
+        env.temp_data.get("default_role"),
+        getattr(env.temp_data.get("default_domain"), "name", None),
+        sorted(env.ref_context.items()),
+        document.settings.language_code,
+    )
+
+
+def _count_blocks(env: Any, state: BlockState) -> None:
+    """Add the block cache hits and misses of a conversion to its document."""
+    counts = state.env.get("block_cache")
+    if counts:
+        totals = env.mdinclude_block_stats.setdefault(env.docname, Counter())
+        totals.update(counts)
+
+
+def _count_nodes(env: Any, outcome: str) -> None:
+    totals = env.mdinclude_block_stats.setdefault(env.docname, Counter())
+    totals["nodes_" + outcome] += 1
+
+
+def _profile_dir(env: Any) -> str:
+    return os.path.join(env.doctreedir, "mdinclude-profiles")
+
+
+def _converter(env: Any, **kwargs: Any) -> RestMarkdown:
+    config = env.config
+    kwargs.update(_data_uri_options(env))
+    return RestMarkdown(
+        no_underscore_emphasis=config.no_underscore_emphasis,
+        parse_relative_links=config.md_parse_relative_links,
+        anonymous_references=config.md_anonymous_references,
+        disable_inline_math=config.md_disable_inline_math,
+        limits=_limits(config),
+        literalinclude_threshold=config.md_literalinclude_threshold,
+        reference_links=_reference_links(env),
+        fragments=getattr(env, "mdinclude_fragments", None),
+        block_cache=_block_cache(env),
+        **kwargs,
+    )
+
+
+def _metrics(
+    env: Any, kind: str, path: str, relative: bool = True
+) -> Optional[ConversionMetrics]:
+    """Start recording metrics for the current document, if enabled."""
+    if not env.config.md_metrics_report:
+        return None
+    source = _source_name(env, path) if relative else path
+    record = ConversionMetrics(env.docname, source, kind)
+    env.mdinclude_metrics.setdefault(env.docname, []).append(record)
+    return record
+
+
+def _metadata(env: Any) -> Optional[DocumentMetadata]:
+    """Collect metadata while converting, if any extension listens for it."""
+    events = getattr(env, "events", None)
+    if events is None or not events.listeners.get(METADATA_EVENT):
+        return None
+    return DocumentMetadata()
+
+
+def _emit_metadata(
+    env: Any, path: str, metadata: Optional[DocumentMetadata], relative: bool = True
+) -> None:
+    if metadata is not None:
+        source = _source_name(env, path) if relative else path
+        env.events.emit(METADATA_EVENT, env.docname, source, metadata)
+
+
+def _shadow(env: Any) -> Optional[ShadowVerifier]:
+    """The shadow verifier of this process, if enabled."""
+    rate = env.config.md_shadow_rate
+    if not rate:
+        return None
+    # threads of a verifier do not survive forking for parallel reads
+    pid = os.getpid()
+    verifier = SHADOW_VERIFIERS.get(pid)
+    if verifier is None:
+        with SHADOW_VERIFIERS_LOCK:
+            verifier = SHADOW_VERIFIERS.get(pid)
+            if verifier is None:
+                verifier = SHADOW_VERIFIERS[pid] = ShadowVerifier(rate)
+    return verifier
+
+
+def _source_name(env: Any, path: Optional[str]) -> str:
+    if path is None:
+        return str(env.docname)
+    return os.path.relpath(os.path.abspath(path), env.srcdir).replace(os.path.sep, "/")
+
+
+def _new_state(
+    converter: RestMarkdown,
+    env: Any,
+    path: Optional[str],
+    line_offset: int,
+    source: Optional[str],
+    heading_offset: int,
+    document_links: Optional[Dict[str, Any]],
+) -> BlockState:
+    state = converter.block.state_cls()
+    state.env["heading_offset"] = heading_offset
+    if document_links is not None:
+        # DocumentContext.finish defines the role where it is first used
+        state.env["raw_html_role"] = True
+        state.env["document_ref_links"] = document_links
+    if path is not None and env.config.md_literalinclude_threshold is not None:
+        # literalinclude treats absolute paths as relative to the source dir
+        relpath = os.path.relpath(os.path.abspath(path), env.srcdir)
+        state.env["__file__"] = "/" + relpath.replace(os.path.sep, "/")
+        state.env["line_offset"] = line_offset
+    source = source or path
+    if converter.fragments is not None and source is not None:
+        abspath = os.path.abspath(source)
+        state.env["include_base"] = os.path.dirname(abspath)
+        state.env["include_stack"] = (abspath,)
+    return state
+
+
+def _convert(
+    converter: RestMarkdown,
+    text: str,
+    env: Any,
+    path: Optional[str] = None,
+    line_offset: int = 0,
+    metrics: Optional[ConversionMetrics] = None,
+    source: Optional[str] = None,
+    heading_offset: int = 0,
+    context: Optional["DocumentContext"] = None,
+    metadata: Optional[DocumentMetadata] = None,
+) -> Tuple[str, BlockState]:
+    """Convert text read from ``path``, which large code blocks may refer back to.
+
+    Fragment includes are relative to ``source``, if given, or ``path``. With a
+    document context, the output is completed by :meth:`DocumentContext.finish`.
+    """
+    document_links = None if context is None else context.ref_links
+    new_state = partial(
+        _new_state, converter, env, path, line_offset, source, heading_offset
+    )
+    state = new_state(document_links)
+    shadow = _shadow(env)
+    sampled = shadow is not None and shadow.sample()
+
+    started = time.perf_counter()
+    output, _ = converter.parse(text, state, metadata)
+    elapsed = time.perf_counter() - started
+    if metrics is not None:
+        metrics.input_bytes = len(text.encode("utf-8"))
+        metrics.conversion_time = elapsed
+        metrics.output_bytes = len(output.encode("utf-8"))
+        metrics.tokens = count_tokens(state.tokens)
+
+    if shadow is not None and sampled:
+        # later conversions in the document may add to the shared definitions
+        links = None if document_links is None else dict(document_links)
+        reference = converter.reference()
+        future = shadow.submit(
+            text,
+            output,
+            elapsed,
+            lambda part: str(converter.parse(part, new_state(links))[0]),
+            lambda part: str(reference.parse(part, new_state(links))[0]),
+            _source_name(env, path or source),
+        )
+        env.mdinclude_shadow_pending.add(env.docname, metrics, future)
+
+    threshold = env.config.md_slow_threshold
+    if threshold is not None and elapsed > threshold:
+        # profile the whole pipeline, as caches would skip the slow parts now
+        links = None if document_links is None else dict(document_links)
+        reference = converter.reference()
+        slow = capture(
+            _profile_dir(env),
+            _source_name(env, path or source),
+            text,
+            elapsed,
+            lambda part: reference.parse(part, new_state(links)),
+        )
+        if slow.profile is not None:
+            outcome = "profile saved to {}".format(slow.profile)
+        else:
+            outcome = "not profiled: {}".format(slow.error)
+        logger.warning(
+            "Markdown conversion of %s took %.1f ms, over md_slow_threshold "
+            "(input sha256 %s, %d bytes); %s",
+            slow.source,
+            slow.elapsed * 1000,
+            slow.sha256,
+            slow.size,
+            outcome,
+            location=env.docname,
+        )
+
+    if converter.fragments is not None:
+        # rebuild the document when any fragment it includes, in turn, changes
+        for dependency in converter.fragments.dependencies(
+            state.env.get("includes", ())
+        ):
+            env.note_dependency(dependency)
+        for error in state.env.get("include_errors", ()):
+            logger.warning(error, location=env.docname)
+    return output, state
+
+
+class DocumentContext:
+    """Conversion state shared by every Markdown conversion in one document.
+
+    Converters are reused by every ``mdinclude`` of the same directory, the raw
+    HTML role is only defined once, and link reference definitions of earlier
+    conversions apply to later ones, unless they define their own.
+    """
+
+    def __init__(self) -> None:
+        self.raw_html_role = False
+        self.ref_links: Dict[str, Any] = {}
+        self.converters: Dict[str, RestMarkdown] = {}
+
+    def converter(self, env: Any, path: str) -> RestMarkdown:
+        directory = os.path.dirname(os.path.abspath(path))
+        converter = self.converters.get(directory)
+        if converter is None:
+            converter = self.converters[directory] = _converter(
+                env, link_resolver=_link_resolver(env, path)
+            )
+        return converter
+
+    def finish(self, output: str, state: BlockState) -> str:
+        """Record what a conversion defined, in document order."""
+        ref_links = state.env["ref_links"]
+        if isinstance(ref_links, ReferenceLinks):
+            ref_links = ref_links.maps[0]
+        for key, value in ref_links.items():
+            self.ref_links.setdefault(key, value)
+
+        if state.env.get("include_raw_html") and not self.raw_html_role:
+            self.raw_html_role = True
+            return PROLOG + output
+        return output
+
+
+def _document_context(document: Document) -> DocumentContext:
+    context: Optional[DocumentContext] = getattr(document, "mdinclude_context", None)
+    if context is None:
+        context = DocumentContext()
+        document.mdinclude_context = context  # type: ignore[attr-defined]
+    return context
+
+
+def drop_document_context(app: Sphinx, doctree: Document) -> None:
+    """Don't pickle the document context with the doctree."""
+    doctree.__dict__.pop("mdinclude_context", None)
+
+
+def _with_labels(text: str, headings: Sequence[Heading], docname: str) -> str:
+    """Insert a ``docname#slug`` label before each of the given headings."""
+    chunks = []
+    offset = 0
+    for heading in headings:
+        chunks.append(text[offset : heading.start])
+        chunks.append(".. _{}#{}:\n\n".format(docname, heading.slug))
+        offset = heading.start
+    chunks.append(text[offset:])
+    return "".join(chunks)
+
+
+def _split_page(
+    text: str, level: int, headings: List[Heading]
+) -> Tuple[str, List[Tuple[Heading, str]]]:
+    """Split a page into parts, keeping the page title in the prelude.
+
+    The first heading is the title of the page if no other heading is at its
+    level or above, and only the sections after it are split.
+    """
+    if headings and all(h.level > headings[0].level for h in headings[1:]):
+        return split_sections(text, level, headings[1:])
+    return split_sections(text, level, headings)
+
+
+def _parts_encoding(encoding: str) -> str:
+    """Encoding of generated parts, without the byte order mark of ``utf-8-sig``."""
+    return "utf-8" if codecs.lookup(encoding).name == "utf-8-sig" else encoding
+
+
+def split_markdown_pages(app: Sphinx) -> None:
+    """Split large Markdown sources into generated sub-documents.
+
+    Sections starting at headings of ``md_split_level`` or higher are written to
+    a ``<name>.parts/`` directory next to the source, where Sphinx discovers them
+    as regular documents. The original document keeps only its title and the
+    text before the first section, followed by a toctree of its parts. Each
+    heading gets a ``docname#slug`` label, so ``#slug`` links resolve across
+    parts.
+
+    Parts of pages that are no longer split, or no longer exist, are removed.
+    """
+    env: Any = app.env
+    env.mdinclude_split_parts = {}
+    env.mdinclude_split_anchors = {}
+
+    threshold = app.config.md_split_threshold
+    level = app.config.md_split_level
+    suffixes = app.config.source_suffix
+    project = Project(app.srcdir, suffixes)
+    exclude_paths = list(app.config.exclude_patterns) + list(app.config.templates_path)
+    encoding = _parts_encoding(app.config.source_encoding)
+    docnames = sorted(project.discover(exclude_paths))
+    parts_dirs = set()
+    split = set()
+    for docname in docnames:
+        path = str(project.doc2path(docname, True))
+        suffix = os.path.splitext(path)[1]
+        if suffixes.get(suffix) != "markdown":
+            continue
+        if PARTS_SUFFIX + "/" in docname:
+            parts_dirs.add(os.path.dirname(path))
+            continue
+        if not threshold:
+            continue
+
+        with open(path, encoding=app.config.source_encoding) as f:
+            text = f.read()
+        if text.count("\n") < threshold:
+            continue
+
+        headings = scan_headings(text)
+        prelude, sections = _split_page(text, level, headings)
+        if not sections:
+            continue
+
+        parts_dir = os.path.splitext(path)[0] + PARTS_SUFFIX
+        os.makedirs(parts_dir, exist_ok=True)
+        marker = os.path.join(parts_dir, PARTS_MARKER)
+        if not os.path.exists(marker):
+            open(marker, "w").close()
+        split.add(parts_dir)
+        stale = {name for name in os.listdir(parts_dir) if name.endswith(suffix)}
+        anchors = {
+            h.slug: "{}#{}".format(docname, h.slug)
+            for h in headings
+            if h.start < len(prelude)
+        }
+        parts = []
+        for index, (heading, section) in enumerate(sections, 1):
+            name = "{:03d}-{}".format(index, heading.slug or "section")
+            part = "{}{}/{}".format(docname, PARTS_SUFFIX, name)
+            start, end = heading.start, heading.start + len(section)
+            owned = [
+                h._replace(start=h.start - start)
+                for h in headings
+                if start <= h.start < end
+            ]
+            anchors.update((h.slug, "{}#{}".format(part, h.slug)) for h in owned)
+            content = _with_labels(section, owned, part)
+
+            filename = os.path.join(parts_dir, name + suffix)
+            stale.discard(name + suffix)
+            try:
+                with open(filename, encoding=encoding) as f:
+                    unchanged = f.read() == content
+            except OSError:
+                unchanged = False
+            if not unchanged:
+                with open(filename, "w", encoding=encoding) as f:
+                    f.write(content)
+            parts.append(part)
+
+        for name in stale:
+            os.remove(os.path.join(parts_dir, name))
+
+        env.mdinclude_split_parts[docname] = parts
+        for name in [docname] + parts:
+            env.mdinclude_split_anchors[name] = anchors
+
+    markdown = tuple(k for k, v in suffixes.items() if v == "markdown")
+    for parts_dir in parts_dirs - split:
+        _remove_parts(parts_dir, markdown)
+
+
+def _remove_parts(parts_dir: str, suffixes: Tuple[str, ...]) -> None:
+    """Remove a parts directory, if it was generated, and only what was generated."""
+    marker = os.path.join(parts_dir, PARTS_MARKER)
+    if not os.path.exists(marker):
+        return
+    for name in os.listdir(parts_dir):
+        if name.endswith(suffixes):
+            os.remove(os.path.join(parts_dir, name))
+    os.remove(marker)
+    try:
+        os.rmdir(parts_dir)
+    except OSError:
+        # other files were added by hand
+        pass
 
 
 class MdIncludeParser(rst.Parser, object):
@@ -30,21 +735,81 @@ class MdIncludeParser(rst.Parser, object):
             inputstring = "\n".join(inputstrings)
         else:
             inputstring = inputstrings
-        config = document.settings.env.config
-        converter = RestMarkdown(
-            no_underscore_emphasis=config.no_underscore_emphasis,
-            parse_relative_links=config.md_parse_relative_links,
-            anonymous_references=config.md_anonymous_references,
-            disable_inline_math=config.md_disable_inline_math,
+        env = document.settings.env
+        parts = getattr(env, "mdinclude_split_parts", {}).get(env.docname)
+        anchors = getattr(env, "mdinclude_split_anchors", {}).get(env.docname)
+        source = str(env.doc2path(env.docname))
+        path: Optional[str] = source
+        if parts:
+            # labels shift the prelude's lines, so don't refer back to the source
+            path = None
+            headings = scan_headings(inputstring)
+            level = env.config.md_split_level
+            prelude, _ = _split_page(inputstring, level, headings)
+            owned = [h for h in headings if h.start < len(prelude)]
+            inputstring = _with_labels(prelude, owned, env.docname)
+
+        converter = _converter(
+            env, anchors=anchors, link_resolver=_link_resolver(env, source)
         )
-        super().parse(converter(inputstring), document)
+        metrics = _metrics(env, "document", source)
+        metadata = _metadata(env)
+        context = _document_context(document)
+        try:
+            rst_text, state = _convert(
+                converter,
+                inputstring,
+                env,
+                path,
+                metrics=metrics,
+                source=source,
+                context=context,
+                metadata=metadata,
+            )
+        except ConversionLimitExceeded as error:
+            document.reporter.warning(
+                "Markdown conversion of %s aborted, including as literal text: %s"
+                % (document["source"], error)
+            )
+            document += nodes.literal_block(inputstring, inputstring)
+            return
+        rst_text = context.finish(rst_text, state)
+        _count_blocks(env, state)
+        _emit_metadata(env, source, metadata)
+        if parts:
+            rst_text += "\n\n.. toctree::\n   :maxdepth: 1\n\n"
+            rst_text += "".join("   /{}\n".format(part) for part in parts)
+        started = time.perf_counter()
+        super().parse(rst_text, document)
+        if metrics is not None:
+            metrics.parse_time = time.perf_counter() - started
+        if env.config.md_parse_relative_links and not parts:
+            _label_sections(document, scan_headings(inputstring), env.docname)
+
+
+def _glob_matches(pattern: str) -> List[str]:
+    """Return the files, not directories, matching a glob pattern."""
+    return sorted(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+
+
+def _readlines(text: str) -> List[str]:
+    """Split text into lines like a file opened in text mode."""
+    lines = [line + "\n" for line in text.split("\n")]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+def _natural_key(path: str) -> List[Union[int, str]]:
+    """Sort ``item10`` after ``item9``."""
+    return [int(part) if part.isdigit() else part for part in _DIGITS_RE.split(path)]
 
 
 class MdInclude(rst.Directive):
     """Directive class to include markdown in sphinx.
 
-    Load a file and convert it to rst and insert as a node. Currently
-    directive-specific options are not implemented.
+    Load a file and convert it to rst and insert as a node. With ``:glob:``,
+    the argument is a pattern, and every matching file is converted at once on
+    a pool of threads, then inserted in order.
     """
 
     required_arguments = 1
@@ -52,6 +817,13 @@ class MdInclude(rst.Directive):
     option_spec = {
         "start-line": int,
         "end-line": int,
+        "section": rst_directives.unchanged_required,
+        "glob": rst_directives.flag,
+        "sort": lambda arg: rst_directives.choice(arg, ("name", "natural", "mtime")),
+        "reversed": rst_directives.flag,
+        "separator": rst_directives.unchanged_required,
+        "heading-offset": rst_directives.nonnegative_int,
+        "package": rst_directives.unchanged_required,
     }
 
     def run(self) -> List[Any]:
@@ -65,19 +837,208 @@ class MdInclude(rst.Directive):
             self.lineno - self.state_machine.input_offset - 1
         )
         source_dir = os.path.dirname(os.path.abspath(source))
-        path = rst_directives.path(self.arguments[0])
-        path = os.path.normpath(os.path.join(source_dir, path))
-        path = utils.relative_path(None, path)
-        path = str(path)
+        env = self.state.document.settings.env
+        messages: List[Any] = []
+        resource: Optional[Resource] = None
+
+        if "glob" in self.options:
+            if "package" in self.options:
+                raise self.error(
+                    'The "glob" option of "%s" cannot be combined with "package".'
+                    % self.name
+                )
+            paths = self._glob(source_dir, self.arguments[0], env)
+            if not paths:
+                messages.append(
+                    self.reporter.warning(
+                        'No files match "%s" in "%s" directive.'
+                        % (self.arguments[0], self.name),
+                        line=self.lineno,
+                    )
+                )
+        else:
+            resource = parse_resource(
+                self.arguments[0], source_dir, self.options.get("package")
+            )
+            if resource is None:
+                path = rst_directives.path(self.arguments[0])
+                path = os.path.normpath(os.path.join(source_dir, path))
+                paths = [str(utils.relative_path(None, path))]
+            else:
+                paths = [str(resource)]
+
+        tab_width = self.options.get(
+            "tab-width", self.state.document.settings.tab_width
+        )
+        # files inside archives and packages have no path to refer back to
+        files: List[Optional[str]] = list(paths)
+        if resource is None:
+            inputs = [self._read(path) for path in paths]
+        else:
+            inputs = [self._read_resource(resource)]
+            files = [None]
+
+        # one converter per directory, as relative links depend on it
+        context = _document_context(self.state.document)
+        converters = [context.converter(env, file or source) for file in files]
+        heading_offset = self.options.get("heading-offset", 0)
+        node_cache = _node_cache(env)
+        records = [_metrics(env, "mdinclude", path, resource is None) for path in paths]
+        collected = [_metadata(env) for _ in paths]
+
+        def convert(
+            index: int,
+        ) -> Union[Tuple[str, BlockState], ConversionLimitExceeded]:
+            rawtext, line_offset = inputs[index]
+            try:
+                return _convert(
+                    converters[index],
+                    rawtext,
+                    env,
+                    files[index],
+                    line_offset,
+                    records[index],
+                    heading_offset=heading_offset,
+                    context=context,
+                    metadata=collected[index],
+                )
+            except ConversionLimitExceeded as error:
+                return error
+
+        if len(paths) > 1:
+            with ThreadPoolExecutor(thread_name_prefix="sphinx-mdinclude") as pool:
+                results = list(pool.map(convert, range(len(paths))))
+        else:
+            results = [convert(index) for index in range(len(paths))]
+
+        separator = self.options.get("separator")
+        blocks = []
+        for index, (path, result) in enumerate(zip(paths, results)):
+            if isinstance(result, ConversionLimitExceeded):
+                rawtext = inputs[index][0]
+                warning = self.reporter.warning(
+                    'Markdown conversion of "%s" aborted, including as literal '
+                    "text: %s" % (path, result),
+                    line=self.lineno,
+                )
+                if len(paths) == 1:
+                    return [nodes.literal_block(rawtext, rawtext), warning]
+                # keep the order of matched files with a literal block in rst
+                messages.append(warning)
+                include_lines = ["::", ""]
+                include_lines += ["   " + line for line in rawtext.splitlines()]
+            else:
+                include_lines = statemachine.string2lines(
+                    context.finish(*result), tab_width, convert_whitespace=True
+                )
+                _count_blocks(env, result[1])
+                _emit_metadata(env, path, collected[index], resource is None)
+            if separator and index:
+                include_lines = ["", separator, ""] + include_lines
+            blocks.append((include_lines, path, records[index]))
+
+        # sections can only be placed by the parse of the including document,
+        # which depends on the title styles before them
+        if node_cache is not None and any(has_titles(b[0]) for b in blocks):
+            for _ in blocks:
+                node_cache.skip()
+                _count_nodes(env, "skipped")
+        elif node_cache is not None:
+            parsed: List[Any] = []
+            for include_lines, path, metrics in blocks:
+                started = time.perf_counter()
+                parsed += self._parse_nodes(node_cache, include_lines, path)
+                if metrics is not None:
+                    metrics.parse_time = time.perf_counter() - started
+            return messages + parsed
+
+        # each insertion goes directly after this directive, so insert in reverse
+        for include_lines, path, metrics in reversed(blocks):
+            if metrics is not None:
+                # docutils parses the inserted lines after this directive returns,
+                # so stop the clock from a marker directive at the end of them
+                pending = env.temp_data.setdefault("mdinclude_metrics", [])
+                pending.append((metrics, time.perf_counter()))
+                marker = ".. {}:: {}".format(MetricsMarker.name, len(pending) - 1)
+                include_lines = include_lines + ["", marker, ""]
+            self.state_machine.insert_input(include_lines, path)
+        return messages
+
+    def _parse_nodes(
+        self, cache: NodeCache, include_lines: List[str], path: str
+    ) -> List[Any]:
+        """Parse rst into nodes here, or copy the nodes of an identical parse."""
+        document = self.state.document
+        env = document.settings.env
+        content = statemachine.StringList(include_lines, path)
+        prolog = statemachine.string2lines(PROLOG)
+        if include_lines[: len(prolog)] == prolog:
+            # the role is defined for the rest of the document, not in the nodes
+            self._nested_parse(content[: len(prolog)])
+            content = content[len(prolog) :]
+
+        if not cacheable(content.data):
+            cache.skip()
+            _count_nodes(env, "skipped")
+            return self._nested_parse(content)[0]
+
+        key = node_key(content.data, path, _parse_context(document))
+        cached = cache.get(key)
+        if cached is not None:
+            _count_nodes(env, "hits")
+            return adopt(cached, document, env.docname)
+
+        _count_nodes(env, "misses")
+        result, reported = self._nested_parse(content)
+        # a copy would not report its warnings again
+        if not reported:
+            cache.put(key, result)
+        return result
 
-        # get options (currently not use directive-specific options)
+    def _nested_parse(self, content: statemachine.StringList) -> Tuple[List[Any], bool]:
+        """Parse rst into nodes, and whether docutils reported anything."""
+        reporter = self.state.document.reporter
+        reported: List[Any] = []
+        container = nodes.Element()
+        # so that docutils fills in the source and line of sections
+        container.document = self.state.document
+        reporter.attach_observer(reported.append)
+        try:
+            # warnings refer to lines of the Markdown file, as if inserted
+            with switch_source_input(self.state, content):
+                nested_parse_with_titles(self.state, content, container)
+        finally:
+            reporter.detach_observer(reported.append)
+        return container.children, bool(reported)
+
+    def _glob(self, source_dir: str, pattern: str, env: Any) -> List[str]:
+        """Find the files matching a glob pattern, relative to the source."""
+        pattern = os.path.join(source_dir, rst_directives.path(pattern))
+        paths = _glob_matches(pattern)
+
+        order = self.options.get("sort", "name")
+        if order == "mtime":
+            paths.sort(key=lambda p: (os.stat(p).st_mtime_ns, p))
+        elif order == "natural":
+            paths.sort(key=_natural_key)
+        else:
+            paths.sort()
+        if "reversed" in self.options:
+            paths.reverse()
+
+        # rebuild when files are added to or removed from the matches, which
+        # Sphinx can't tell from dependencies on the files alone
+        if not hasattr(env, "mdinclude_globs"):
+            env.mdinclude_globs = {}
+        env.mdinclude_globs.setdefault(env.docname, {})[pattern] = sorted(paths)
+        return [str(utils.relative_path(None, os.path.normpath(p))) for p in paths]
+
+    def _read(self, path: str) -> Tuple[str, int]:
+        """Read the lines of a file selected by the directive options."""
         encoding = self.options.get(
             "encoding", self.state.document.settings.input_encoding
         )
         e_handler = self.state.document.settings.input_encoding_error_handler
-        tab_width = self.options.get(
-            "tab-width", self.state.document.settings.tab_width
-        )
 
         # open the including file
         try:
@@ -98,42 +1059,379 @@ class MdInclude(rst.Directive):
             )
 
         # read from the file
-        startline = self.options.get("start-line", None)
-        endline = self.options.get("end-line", None)
         try:
-            if startline or (endline is not None):
-                lines = include_file.readlines()
-                rawtext = "".join(lines[startline:endline])
-            else:
-                rawtext = include_file.read()
+            rawtext = include_file.read()
         except UnicodeError as error:
             raise self.severe(
                 'Problem with "%s" directive:\n%s' % (self.name, ErrorString(error))
             )
+        return self._select(path, rawtext, _heading_index)
 
-        config = self.state.document.settings.env.config
-        converter = RestMarkdown(
-            no_underscore_emphasis=config.no_underscore_emphasis,
-            parse_relative_links=config.md_parse_relative_links,
-            anonymous_references=config.md_anonymous_references,
-            disable_inline_math=config.md_disable_inline_math,
-        )
-        include_lines = statemachine.string2lines(
-            converter(rawtext), tab_width, convert_whitespace=True
+    def _read_resource(self, resource: Resource) -> Tuple[str, int]:
+        """Read a file inside an archive or package, and record its hash."""
+        settings = self.state.document.settings
+        encoding = self.options.get("encoding", settings.input_encoding)
+        try:
+            data = read_resource(resource)
+            rawtext = data.decode(
+                encoding or "utf-8", settings.input_encoding_error_handler
+            )
+        except (ImportError, OSError, zipfile.BadZipFile) as error:
+            raise self.severe(
+                'Problems with "%s" directive path:\n%s.'
+                % (self.name, ErrorString(error))
+            )
+        except UnicodeError as error:
+            raise self.severe(
+                'Problem with "%s" directive:\n%s' % (self.name, ErrorString(error))
+            )
+
+        # rebuild when the content changes, not whenever the archive does
+        env = settings.env
+        if not hasattr(env, "mdinclude_resources"):
+            env.mdinclude_resources = {}
+        env.mdinclude_resources.setdefault(env.docname, {})[resource] = digest(data)
+        return self._select(
+            str(resource), rawtext, lambda path, text: scan_headings(text)
         )
-        self.state_machine.insert_input(include_lines, path)
+
+    def _select(
+        self,
+        path: str,
+        rawtext: str,
+        headings: Callable[[str, str], List[Heading]],
+    ) -> Tuple[str, int]:
+        """Select the lines or section of the text named by the directive options."""
+        startline = self.options.get("start-line", None)
+        endline = self.options.get("end-line", None)
+        line_offset = 0
+        if startline or (endline is not None):
+            lines = _readlines(rawtext)
+            rawtext = "".join(lines[startline:endline])
+            line_offset = len(lines[: startline or 0])
+
+        section = self.options.get("section")
+        if section is not None:
+            if startline or (endline is not None):
+                raise self.error(
+                    'The "section" option of "%s" cannot be combined with '
+                    '"start-line" or "end-line".' % self.name
+                )
+            span = find_section(headings(path, rawtext), section, len(rawtext))
+            if span is None:
+                raise self.error(
+                    'Problem with "%s" directive:\nsection "%s" not found in "%s".'
+                    % (self.name, section, path)
+                )
+            start, end = span
+            line_offset = rawtext.count("\n", 0, start)
+            rawtext = rawtext[start:end]
+
+        return rawtext, line_offset
+
+
+class MetricsMarker(rst.Directive):
+    """Records the docutils parse time of the mdinclude content before it.
+
+    Only ``MdInclude`` inserts the marker, under a name chosen per process, so
+    documents can't use it. Each marker stops the clock it refers to once.
+    """
+
+    name = "mdinclude-metrics-" + secrets.token_hex(8)
+    required_arguments = 1
+
+    def run(self) -> List[Any]:
+        env = self.state.document.settings.env
+        pending = env.temp_data.get("mdinclude_metrics", [])
+        index = self.arguments[0]
+        if not index.isdigit() or int(index) >= len(pending) or not pending[int(index)]:
+            raise self.error("invalid metrics marker: %s" % index)
+        metrics, started = pending[int(index)]
+        pending[int(index)] = None
+        metrics.parse_time = time.perf_counter() - started
         return []
 
 
+def init_fragments(app: Sphinx, env: Any, docnames: List[str]) -> None:
+    """Start a fragment cache and include graph for this build, if enabled."""
+    env.mdinclude_fragments = None
+    if app.config.md_fragments:
+        env.mdinclude_fragments = FragmentCache(env.srcdir, app.config.source_encoding)
+
+
+def init_metrics(app: Sphinx, env: Any, docnames: List[str]) -> None:
+    if not hasattr(env, "mdinclude_metrics"):
+        env.mdinclude_metrics = {}
+
+
+def outdated_resources(
+    app: Sphinx, env: Any, added: Set[str], changed: Set[str], removed: Set[str]
+) -> List[str]:
+    """Re-read documents whose included archive or package files changed."""
+    outdated = []
+    for docname, resources in getattr(env, "mdinclude_resources", {}).items():
+        if docname in changed or docname in removed:
+            continue
+        for resource, expected in resources.items():
+            try:
+                current: Optional[str] = digest(read_resource(resource))
+            except (ImportError, OSError, zipfile.BadZipFile):
+                current = None
+            if current != expected:
+                outdated.append(docname)
+                break
+    return outdated
+
+
+def outdated_globs(
+    app: Sphinx, env: Any, added: Set[str], changed: Set[str], removed: Set[str]
+) -> List[str]:
+    """Re-read documents where files were added to or removed from a glob."""
+    outdated = []
+    for docname, patterns in getattr(env, "mdinclude_globs", {}).items():
+        if docname in changed or docname in removed:
+            continue
+        for pattern, expected in patterns.items():
+            if _glob_matches(pattern) != expected:
+                outdated.append(docname)
+                break
+    return outdated
+
+
+def purge_globs(app: Sphinx, env: Any, docname: str) -> None:
+    getattr(env, "mdinclude_globs", {}).pop(docname, None)
+
+
+def merge_globs(app: Sphinx, env: Any, docnames: List[str], other: Any) -> None:
+    globs = getattr(other, "mdinclude_globs", {})
+    if not hasattr(env, "mdinclude_globs"):
+        env.mdinclude_globs = {}
+    env.mdinclude_globs.update((d, globs[d]) for d in docnames if d in globs)
+
+
+def purge_resources(app: Sphinx, env: Any, docname: str) -> None:
+    getattr(env, "mdinclude_resources", {}).pop(docname, None)
+
+
+def merge_resources(app: Sphinx, env: Any, docnames: List[str], other: Any) -> None:
+    resources = getattr(other, "mdinclude_resources", {})
+    if not hasattr(env, "mdinclude_resources"):
+        env.mdinclude_resources = {}
+    env.mdinclude_resources.update(
+        (d, resources[d]) for d in docnames if d in resources
+    )
+
+
+def close_archives(app: Sphinx, exception: Optional[Exception]) -> None:
+    ARCHIVES.close()
+
+
+def _record_shadow(env: Any, pending: PendingChecks, wait: bool = False) -> None:
+    for docname, metrics, result in pending.drain(wait):
+        env.mdinclude_shadow.setdefault(docname, []).append(result)
+        if metrics is not None:
+            metrics.shadow = result.status
+            metrics.shadow_time = result.check_time
+
+
+def collect_shadow(app: Sphinx, doctree: Document) -> None:
+    """Record the shadow checks that finished, without waiting for the others."""
+    env: Any = app.env
+    _record_shadow(env, env.mdinclude_shadow_pending)
+
+
+def finish_shadow(app: Sphinx, env: Any) -> List[str]:
+    """Wait for the remaining shadow checks, once all documents are read."""
+    _record_shadow(env, env.mdinclude_shadow_pending, wait=True)
+    return []
+
+
+def init_shadow(app: Sphinx, env: Any, docnames: List[str]) -> None:
+    if not hasattr(env, "mdinclude_shadow"):
+        env.mdinclude_shadow = {}
+    env.mdinclude_shadow_pending = PendingChecks()
+
+
+def purge_shadow(app: Sphinx, env: Any, docname: str) -> None:
+    getattr(env, "mdinclude_shadow", {}).pop(docname, None)
+
+
+def merge_shadow(app: Sphinx, env: Any, docnames: List[str], other: Any) -> None:
+    results = getattr(other, "mdinclude_shadow", {})
+    env.mdinclude_shadow.update((d, results[d]) for d in docnames if d in results)
+    # checks of the other process finished when its environment was pickled
+    if hasattr(other, "mdinclude_shadow_pending"):
+        _record_shadow(env, other.mdinclude_shadow_pending, wait=True)
+
+
+def report_shadow(app: Sphinx, exception: Optional[Exception]) -> None:
+    """Report conversions that differ from the reference pipeline."""
+    verifier = SHADOW_VERIFIERS.pop(os.getpid(), None)
+    if verifier is not None:
+        verifier.close()
+    if exception is not None or not app.config.md_shadow_rate:
+        return
+
+    env: Any = app.env
+    results = getattr(env, "mdinclude_shadow", {})
+    for docname, records in sorted(results.items()):
+        for result in records:
+            if result.status == DIVERGED:
+                logger.warning(
+                    "Markdown conversion of %s differs from the reference "
+                    "pipeline:\n%s\nminimal input:\n%s",
+                    result.source,
+                    result.diff,
+                    result.reproducer,
+                    location=docname,
+                )
+            elif result.status == ERROR:
+                logger.warning(
+                    "shadow check of %s failed: %s",
+                    result.source,
+                    result.diff,
+                    location=docname,
+                )
+    summary = summarize([r for records in results.values() for r in records])
+    logger.info(
+        "Shadow verification: %d conversions checked, %d differ, %d failed; "
+        "%.1f ms converting, %.1f ms checking",
+        summary["checked"],
+        summary["diverged"],
+        summary["errors"],
+        summary["optimised_time"] * 1000,
+        summary["check_time"] * 1000,
+    )
+
+
+def init_block_stats(app: Sphinx, env: Any, docnames: List[str]) -> None:
+    # only documents read in this build are reported
+    env.mdinclude_block_stats = {}
+
+
+def merge_block_stats(app: Sphinx, env: Any, docnames: List[str], other: Any) -> None:
+    stats = getattr(other, "mdinclude_block_stats", {})
+    env.mdinclude_block_stats.update((d, stats[d]) for d in docnames if d in stats)
+
+
+def report_block_stats(app: Sphinx, exception: Optional[Exception]) -> None:
+    """Log how many blocks and subtrees of the documents read were reused."""
+    env: Any = app.env
+    if exception is not None:
+        return
+    totals: Counter[str] = Counter()
+    for counts in getattr(env, "mdinclude_block_stats", {}).values():
+        totals.update(counts)
+    blocks = totals["hits"] + totals["misses"] + totals["skipped"]
+    cache = _block_cache(env)
+    if blocks and cache is not None:
+        logger.info(
+            "Markdown block cache: %d of %d blocks reused (%.0f%%), "
+            "%d not cacheable; %d blocks cached",
+            totals["hits"],
+            blocks,
+            100 * totals["hits"] / blocks,
+            totals["skipped"],
+            len(cache),
+        )
+    subtrees = totals["nodes_hits"] + totals["nodes_misses"] + totals["nodes_skipped"]
+    node_cache = _node_cache(env)
+    if subtrees and node_cache is not None:
+        logger.info(
+            "Markdown node cache: %d of %d subtrees reused (%.0f%%), "
+            "%d not cacheable; %d subtrees cached",
+            totals["nodes_hits"],
+            subtrees,
+            100 * totals["nodes_hits"] / subtrees,
+            totals["nodes_skipped"],
+            len(node_cache),
+        )
+
+
+def purge_metrics(app: Sphinx, env: Any, docname: str) -> None:
+    getattr(env, "mdinclude_metrics", {}).pop(docname, None)
+
+
+def merge_metrics(app: Sphinx, env: Any, docnames: List[str], other: Any) -> None:
+    metrics = getattr(other, "mdinclude_metrics", {})
+    env.mdinclude_metrics.update((d, metrics[d]) for d in docnames if d in metrics)
+
+
+def report_metrics(app: Sphinx, exception: Optional[Exception]) -> None:
+    """Write the metrics report, and log the slowest conversions."""
+    report = app.config.md_metrics_report
+    if exception is not None or not report:
+        return
+
+    env: Any = app.env
+    records = [r for rs in getattr(env, "mdinclude_metrics", {}).values() for r in rs]
+    path = os.path.join(app.outdir, report)
+    write_report(path, records)
+    logger.info("Markdown conversion metrics written to %s", path)
+
+    top = slowest(records, app.config.md_metrics_top)
+    if top:
+        logger.info("Slowest Markdown conversions (conversion + docutils parse):")
+    for record in top:
+        logger.info(
+            "  %8.1f ms  %s (%s: %s)",
+            record.total_time * 1000,
+            record.docname,
+            record.kind,
+            record.source,
+        )
+
+
 def setup(app: Sphinx) -> Dict[str, Union[str, bool]]:
     """When used for sphinx extension."""
     app.add_config_value("no_underscore_emphasis", False, "env")
     app.add_config_value("md_parse_relative_links", False, "env")
     app.add_config_value("md_anonymous_references", False, "env")
     app.add_config_value("md_disable_inline_math", False, "env")
+    app.add_config_value("md_max_input_size", None, "env", [int])
+    app.add_config_value("md_max_nesting_depth", None, "env", [int])
+    app.add_config_value("md_conversion_timeout", None, "env", [int, float])
+    app.add_config_value("md_literalinclude_threshold", None, "env", [int])
+    app.add_config_value("md_extract_data_uris", False, "env")
+    app.add_config_value("md_fragments", False, "env")
+    app.add_config_value("md_split_threshold", 0, "env", [int])
+    app.add_config_value("md_split_level", 2, "env", [int])
+    app.add_config_value("md_reference_links", [], "env", [list])
+    app.add_config_value("md_metrics_report", None, "", [str])
+    app.add_config_value("md_metrics_top", 10, "", [int])
+    app.add_config_value("md_shadow_rate", 0.0, "", [int, float])
+    app.add_config_value("md_block_cache_size", 0, "", [int])
+    app.add_config_value("md_slow_threshold", None, "", [int, float])
+    app.add_config_value("md_node_cache_size", 0, "env", [int])
+    app.add_event(METADATA_EVENT)
     app.add_source_suffix(".md", "markdown")
     app.add_source_parser(MdIncludeParser)
     app.add_directive("mdinclude", MdInclude)
+    app.add_directive(MetricsMarker.name, MetricsMarker)
+    app.connect("builder-inited", split_markdown_pages)
+    app.connect("env-before-read-docs", init_fragments)
+    app.connect("env-before-read-docs", init_metrics)
+    app.connect("env-before-read-docs", init_shadow)
+    app.connect("env-before-read-docs", init_block_stats)
+    app.connect("env-before-read-docs", build_link_index)
+    app.connect("env-get-outdated", outdated_resources)
+    app.connect("env-get-outdated", outdated_globs)
+    app.connect("env-purge-doc", purge_metrics)
+    app.connect("env-purge-doc", purge_resources)
+    app.connect("env-purge-doc", purge_globs)
+    app.connect("env-purge-doc", purge_shadow)
+    app.connect("env-merge-info", merge_metrics)
+    app.connect("env-merge-info", merge_resources)
+    app.connect("env-merge-info", merge_globs)
+    app.connect("env-merge-info", merge_shadow)
+    app.connect("env-merge-info", merge_block_stats)
+    app.connect("doctree-read", drop_document_context)
+    app.connect("doctree-read", collect_shadow)
+    app.connect("env-updated", finish_shadow)
+    app.connect("build-finished", report_metrics)
+    app.connect("build-finished", close_archives)
+    app.connect("build-finished", report_shadow)
+    app.connect("build-finished", report_block_stats)
     metadata: Dict[str, Union[str, bool]] = {
         "version": __version__,
         "parallel_read_safe": True,
@@ -1,15 +1,50 @@
+from .test_aio import AioTest
+from .test_bench import BenchTest
+from .test_check import CheckTest
+from .test_concurrency import ConcurrencyTest
+from .test_diagnostics import DiagnosticsTest
+from .test_doctrees import DoctreesTest
 from .test_renderer import (
     TestBasic,
+    TestBlockCache,
     TestBlockQuote,
     TestCodeBlock,
     TestComplexText,
+    TestDataUri,
     TestDirective,
     TestFootNote,
+    TestFragments,
     TestHeading,
+    TestHeadingScan,
     TestImage,
     TestInlineMarkdown,
+    TestLimits,
     TestList,
+    TestLiteralInclude,
+    TestMetadata,
     TestRestCode,
     TestTable,
+    TestTokens,
 )
+from .test_scaling import ScalingTest
+from .test_server import ServerTest
+from .test_shadow import ShadowVerifierTest
 from .test_smoke import SmokeTest
+from .test_sphinx import (
+    BlockCacheTest,
+    DataUriTest,
+    DocumentContextTest,
+    FragmentsTest,
+    GlobIncludeTest,
+    LiteralIncludeTest,
+    MetadataTest,
+    MetricsTest,
+    NodeCacheTest,
+    ReferenceLinksTest,
+    RelativeLinksTest,
+    ResourcesTest,
+    ShadowTest,
+    SlowConversionTest,
+    SplitPagesTest,
+)
+from .test_watch import WatchTest
@@ -0,0 +1,94 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import asyncio
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, List
+
+from ..aio import aconvert, aconvert_many
+from ..parse import ConversionLimitExceeded, ConversionLimits
+from ..render import _CONVERTERS, convert, get_converter, MAX_CONVERTERS
+
+SLOW = "para *a* `b`:role: <b>c</b> [d](e)\n\n" * 20000
+
+
+class AioTest(unittest.IsolatedAsyncioTestCase):
+    async def test_aconvert(self) -> None:
+        src = "# Title\n\nsome *text*"
+        self.assertEqual(convert(src), await aconvert(src))
+        self.assertEqual(convert(src), await aconvert(src.encode()))
+
+    async def test_aconvert_stream(self) -> None:
+        src = "# Tïtle\n\nsome *téxt*\n" * 100
+        data = src.encode()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            # split multi-byte characters across chunks
+            for i in range(0, len(data), 7):
+                yield data[i : i + 7]
+
+        self.assertEqual(convert(src), await aconvert(chunks()))
+
+    async def test_aconvert_options(self) -> None:
+        with self.assertRaises(ConversionLimitExceeded):
+            await aconvert("hello world", limits=ConversionLimits(max_size=5))
+
+    async def test_aconvert_timeout(self) -> None:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            with self.assertRaises(asyncio.TimeoutError):
+                await aconvert(SLOW, timeout=0.01, executor=executor)
+            # the timed out conversion stops early, freeing the worker
+            self.assertEqual("\na\n", await aconvert("a", executor=executor))
+
+    async def test_aconvert_cancel(self) -> None:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            task = asyncio.ensure_future(aconvert(SLOW, executor=executor))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertEqual("\na\n", await aconvert("a", executor=executor))
+
+    async def test_aconvert_many(self) -> None:
+        srcs = ["# Doc {}\n\n*text* <i>{}</i>".format(i, i) for i in range(30)]
+        expected = [convert(src) for src in srcs]
+        self.assertEqual(expected, await aconvert_many(srcs, limit=4))
+
+    async def test_aconvert_many_limit(self) -> None:
+        running: List[int] = []
+        peak = 0
+
+        async def source(i: int) -> AsyncIterator[bytes]:
+            nonlocal peak
+            running.append(i)
+            peak = max(peak, len(running))
+            await asyncio.sleep(0.001)
+            running.remove(i)
+            yield b"text"
+
+        await aconvert_many([source(i) for i in range(20)], limit=3)
+        self.assertEqual(3, peak)
+
+    async def test_aconvert_many_exceptions(self) -> None:
+        results = await aconvert_many(
+            ["short", "far too long"],
+            return_exceptions=True,
+            limits=ConversionLimits(max_size=5),
+        )
+        self.assertEqual("\nshort\n", results[0])
+        self.assertIsInstance(results[1], ConversionLimitExceeded)
+
+    def test_warm_converters(self) -> None:
+        self.assertIs(get_converter(), get_converter())
+        limits = ConversionLimits(timeout=5)
+        self.assertIs(get_converter(limits=limits), get_converter(limits=limits))
+        self.assertIsNot(get_converter(), get_converter(limits=limits))
+
+    def test_converters_bounded(self) -> None:
+        warm = get_converter()
+        for i in range(MAX_CONVERTERS):
+            get_converter(anchors={"intro": "page{}#intro".format(i)})
+        self.assertEqual(MAX_CONVERTERS, len(_CONVERTERS))
+        # the least recently used converter was dropped
+        self.assertIsNot(warm, get_converter())
@@ -0,0 +1,38 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from ..bench import bench, COLD, format_results, generate_project, INCREMENTAL, NOOP
+
+
+class BenchTest(unittest.TestCase):
+    def test_bench(self) -> None:
+        with TemporaryDirectory() as tmp:
+            project = generate_project(
+                Path(tmp), pages=3, includes=2, shared=2, fan_in=1, repeat=1
+            )
+            assert project.touch is not None
+            mtime = project.touch.stat().st_mtime_ns
+            results = bench([project])
+            # incremental builds change a copy of the project
+            self.assertEqual(mtime, project.touch.stat().st_mtime_ns)
+
+        self.assertEqual([COLD, NOOP, INCREMENTAL], [r.mode for r in results])
+        cold, noop, incremental = results
+        # three pages, two rst pages, and the index
+        self.assertEqual(6, cold.docs)
+        self.assertEqual(0, noop.docs)
+        # only the rst page that includes the changed file
+        self.assertEqual(1, incremental.docs)
+        for phase in ("init", "read", "pickle", "write"):
+            self.assertGreater(getattr(cold, phase), 0, phase)
+        self.assertGreaterEqual(
+            cold.total, cold.init + cold.read + cold.pickle + cold.write
+        )
+
+        report = format_results(results).splitlines()
+        self.assertEqual(4, len(report))
+        self.assertIn("incremental", report[3])
@@ -0,0 +1,94 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+
+from ..check import check, check_files, Diagnostic, ERROR, WARNING
+
+SOURCE = dedent(
+    """\
+    # Title
+
+    Some :role:`unterminated text.
+
+    .. note: a comment
+
+    > ## quoted heading
+
+    Stray `backtick.
+
+    .. code-block:: python
+       :bogus:
+
+    Fine `code`, :role:`x` and `a`_.
+    """
+)
+
+
+class CheckTest(unittest.TestCase):
+    def test_clean(self) -> None:
+        source = Path(__file__).parent / "test.md"
+        self.assertEqual([], check(source.read_text()))
+
+    def test_check(self) -> None:
+        self.assertEqual(
+            [
+                Diagnostic(
+                    "x.md",
+                    3,
+                    ERROR,
+                    "unterminated role: 'Some :role:`unterminated text.'",
+                ),
+                Diagnostic(
+                    "x.md", 5, WARNING, "'.. note:' is a comment, not a directive"
+                ),
+                Diagnostic(
+                    "x.md", 7, ERROR, "heading inside a nested block is not allowed"
+                ),
+                Diagnostic(
+                    "x.md", 9, WARNING, "unmatched backtick: 'Stray `backtick.'"
+                ),
+            ],
+            check(SOURCE, "x.md"),
+        )
+
+    def test_directive_body(self) -> None:
+        self.assertEqual(
+            [(3, WARNING, "'.. note:' is a comment, not a directive")],
+            [d[1:] for d in check("# T\n\n.. note:\n\n   body\n\ntext\n")],
+        )
+
+    def test_title_levels(self) -> None:
+        source = "# A\n\n### B\n\n## C\n\n# D\n\n## E\n"
+        self.assertEqual(
+            [Diagnostic("<string>", 9, ERROR, "title level inconsistent")],
+            check(source),
+        )
+
+    def test_docutils(self) -> None:
+        messages = [(d.line, d.level, d.message) for d in check(SOURCE, docutils=True)]
+        self.assertIn(
+            (11, ERROR, 'Error in "code-block" directive:\nunknown option: "bogus".'),
+            messages,
+        )
+        self.assertNotIn(13, [line for line, _, _ in messages])
+
+        # unknown directives may be provided by sphinx
+        self.assertEqual([], check(".. toctree::\n\n   page\n", docutils=True))
+
+    def test_check_files(self) -> None:
+        with TemporaryDirectory() as td:
+            paths = []
+            for i in range(4):
+                path = Path(td) / "{}.md".format(i)
+                path.write_text(SOURCE if i % 2 else "# Fine\n")
+                paths.append(str(path))
+
+            for workers in (1, 2):
+                results = check_files(paths, max_workers=workers)
+                self.assertEqual(paths, list(results))
+                self.assertEqual([0, 4, 0, 4], [len(results[p]) for p in paths])
+                self.assertEqual(paths[1], results[paths[1]][0].path)
@@ -0,0 +1,71 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from ..parse import ConversionLimits
+from ..render import convert, convert_many, PROLOG, RestMarkdown
+
+
+def documents(count: int) -> List[str]:
+    docs = []
+    for i in range(count):
+        parts = [
+            "# Document {}".format(i),
+            "",
+            "Paragraph with *emphasis* {}.".format(i),
+        ]
+        if i % 2:
+            parts += ["", "Raw <b>html</b> and a line  ", "break."]
+        if i % 3:
+            parts += ["", "A footnote[^n{0}] and [a ref][r{0}].".format(i)]
+            parts += [
+                "",
+                "[^n{0}]: note {0}".format(i),
+                "[r{0}]: http://r/{0}".format(i),
+            ]
+        if i % 5 == 0:
+            parts += ["", "* a", "  * b", "", "| x | y |", "| - | - |", "| 1 | 2 |"]
+        docs.append("\n".join(parts * (1 + i % 4)))
+    return docs
+
+
+class ConcurrencyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        interval = sys.getswitchinterval()
+        self.addCleanup(sys.setswitchinterval, interval)
+        # switch threads as often as possible to shake out shared state
+        sys.setswitchinterval(1e-6)
+
+    def test_reuse_converter(self) -> None:
+        converter = RestMarkdown()
+        self.assertTrue(converter("a <b>b</b>").startswith(PROLOG))
+        self.assertEqual("\nplain\n", converter("plain"))
+
+    def test_convert_many(self) -> None:
+        docs = documents(40)
+        expected = [convert(doc) for doc in docs]
+        self.assertEqual(expected, convert_many(docs, max_workers=8))
+
+    def test_shared_converter_stress(self) -> None:
+        docs = documents(40)
+        limits = ConversionLimits(max_depth=10, timeout=60)
+        expected = [convert(doc, limits=limits) for doc in docs]
+        converter = RestMarkdown(limits=limits)
+        barrier = threading.Barrier(8)
+
+        def work(offset: int) -> List[str]:
+            barrier.wait()
+            order = docs[offset:] + docs[:offset]
+            return [converter(doc) for doc in order * 5]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = list(pool.map(work, range(0, 40, 5)))
+
+        for offset, result in zip(range(0, 40, 5), results):
+            order = expected[offset:] + expected[:offset]
+            self.assertEqual(order * 5, result)
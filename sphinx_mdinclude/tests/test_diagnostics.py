@@ -0,0 +1,64 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import hashlib
+import json
+import pstats
+import unittest
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import List
+from unittest.mock import patch
+
+from ..diagnostics import capture
+from ..parse import ConversionLimitExceeded, ConversionLimits
+from ..render import RestMarkdown
+
+
+class DiagnosticsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name) / "profiles"
+
+    def test_capture(self) -> None:
+        text = "# Title\n\nSome *text*.\n"
+        slow = capture(str(self.dir), "doc.md", text, 1.5, RestMarkdown())
+
+        digest = hashlib.sha256(text.encode()).hexdigest()
+        self.assertEqual(("doc.md", 1.5, digest, len(text)), slow[:4])
+        self.assertEqual(str(self.dir / (digest[:16] + ".prof")), slow.profile)
+        self.assertEqual("", slow.error)
+
+        output = StringIO()
+        pstats.Stats(str(slow.profile), stream=output).print_stats("render.py")
+        self.assertIn("(parse)", output.getvalue())
+        info = json.loads((self.dir / (digest[:16] + ".json")).read_text())
+        self.assertEqual("doc.md", info["source"])
+        self.assertEqual(digest, info["sha256"])
+        self.assertEqual(len(text), info["size"])
+        self.assertEqual(1.5, info["elapsed"])
+
+    def test_profiled_once(self) -> None:
+        calls: List[str] = []
+        capture(str(self.dir), "a.md", "text\n", 1.0, calls.append)
+        slow = capture(str(self.dir), "b.md", "text\n", 2.0, calls.append)
+        self.assertEqual(["text\n"], calls)
+        self.assertEqual("b.md", slow.source)
+        self.assertIsNotNone(slow.profile)
+
+    def test_limit_exceeded(self) -> None:
+        converter = RestMarkdown(limits=ConversionLimits(max_size=4))
+        with self.assertRaises(ConversionLimitExceeded):
+            converter("too long\n")
+        slow = capture(str(self.dir), "a.md", "too long\n", 1.0, converter)
+        self.assertIsNotNone(slow.profile)
+        self.assertTrue(Path(str(slow.profile)).exists())
+
+    def test_profiler_active(self) -> None:
+        with patch("cProfile.Profile.enable", side_effect=ValueError("busy")):
+            slow = capture(str(self.dir), "a.md", "text\n", 1.0, str)
+        self.assertIsNone(slow.profile)
+        self.assertEqual("busy", slow.error)
+        self.assertFalse(self.dir.exists())
@@ -0,0 +1,130 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import unittest
+
+from docutils import frontend, nodes, utils
+from docutils.nodes import document as Document
+from docutils.parsers import rst
+
+from ..doctrees import adopt, cacheable, has_titles, node_key, NodeCache
+
+
+def parse(text: str) -> Document:
+    settings = frontend.get_default_settings(rst.Parser)
+    settings.report_level = 5
+    document = utils.new_document("<test>", settings)
+    rst.Parser().parse(text, document)
+    return document
+
+
+class DoctreesTest(unittest.TestCase):
+    def test_cacheable(self) -> None:
+        for text in (
+            "Some *text*, see `docs <https://example.com>`_.",
+            ".. code-block:: python\n\n   print(1)",
+            ".. note:: Careful.",
+            "..\n\n   Quoted.",
+            ".. a comment",
+            ".. raw:: html\n\n   <br>",
+            "Some :ref:`label`.",
+        ):
+            with self.subTest(text):
+                self.assertTrue(cacheable(text.splitlines()))
+
+        for text in (
+            ".. toctree::\n\n   page",
+            ".. py:function:: f()",
+            ".. _label:",
+            ".. [#note] A footnote.",
+            ".. |name| replace:: text",
+            "__ https://example.com",
+            ".. math:: x\n   :label: eq",
+            ".. raw:: html\n   :file: page.html",
+            "Some :index:`term`.",
+        ):
+            with self.subTest(text):
+                self.assertFalse(cacheable(text.splitlines()))
+
+    def test_has_titles(self) -> None:
+        for text in ("Title\n=====", "Intro.\n\nTitle\n-\n\nText.", "===\nTitle\n==="):
+            with self.subTest(text):
+                self.assertTrue(has_titles(text.splitlines()))
+
+        for text in (
+            "Some text.\n\n----\n\nMore.",
+            ".. code-block::\n\n   print(1)\n   ====",
+            "=====  =====\na      b\n=====  =====",
+            "",
+        ):
+            with self.subTest(text):
+                self.assertFalse(has_titles(text.splitlines()))
+
+    def test_node_key(self) -> None:
+        key = node_key(["Some text."], "a.md", ("python", None))
+        self.assertEqual(key, node_key(["Some text."], "a.md", ("python", None)))
+        self.assertNotEqual(key, node_key(["Some text"], "a.md", ("python", None)))
+        self.assertNotEqual(key, node_key(["Some text."], "b.md", ("python", None)))
+        self.assertNotEqual(key, node_key(["Some text."], "a.md", ("rst", None)))
+
+    def test_adopt(self) -> None:
+        parsed = parse(
+            "Usage\n=====\n\nSee `Usage`_, `docs <https://example.com>`_ "
+            "and [#note]_.\n"
+        )
+        cached = NodeCache(4)
+        cached.put(b"key", parsed.children)
+
+        document = parse("Usage\n-----\n\nFirst.\n")
+        entry = cached.get(b"key")
+        assert entry is not None
+        copies = adopt(entry, document, "page")
+        document.extend(copies)
+
+        section, cached_section = copies[0], entry[0]
+        assert isinstance(section, nodes.section)
+        assert isinstance(cached_section, nodes.section)
+        self.assertEqual(["usage-1"], section["ids"])
+        self.assertIs(section, document.ids["usage-1"])
+        self.assertIn("docs", document.nameids)
+        self.assertEqual(1, len(document.autofootnote_refs))
+        self.assertEqual(1, len(document.refnames["usage"]))
+        self.assertEqual(1, len(document.footnote_refs["note"]))
+        # the cached entry stays as it was parsed
+        self.assertEqual(["usage"], cached_section["ids"])
+        self.assertIsNot(cached_section, section)
+
+    def test_refdoc(self) -> None:
+        xref = nodes.inline(refdoc="index")
+        document = parse("")
+        (copy,) = adopt([nodes.paragraph("", "", xref)], document, "page")
+        (copied,) = copy.findall(nodes.inline)
+        self.assertEqual("page", copied["refdoc"])
+        self.assertEqual("index", xref["refdoc"])
+
+    def test_node_cache(self) -> None:
+        document = parse("One.\n\nTwo.\n")
+        cache = NodeCache(1)
+        self.assertIsNone(cache.get(b"a"))
+        cache.put(b"a", document.children[:1])
+        cache.put(b"b", document.children[1:])
+        self.assertIsNone(cache.get(b"a"))
+
+        entry = cache.get(b"b")
+        assert entry is not None
+        self.assertEqual("Two.", entry[0].astext())
+        self.assertIsNot(document.children[1], entry[0])
+        # cached nodes don't keep the document they were parsed in alive
+        self.assertIsNone(entry[0].document)
+
+        cache.skip()
+        metrics = cache.metrics()
+        self.assertEqual(
+            (1, 2, 1, 1),
+            tuple(metrics[k] for k in ("hits", "misses", "skipped", "entries")),
+        )
+        self.assertEqual(1, len(cache))
+
+        disabled = NodeCache(0)
+        disabled.put(b"a", document.children)
+        self.assertEqual(0, len(disabled))
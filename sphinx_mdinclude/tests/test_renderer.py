@@ -1,13 +1,38 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import marshal
+import signal
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from typing import Any, Tuple
-from unittest import skip, TestCase
+from unittest import skip, skipUnless, TestCase
 
 from docutils import io
 from docutils.core import Publisher
 
-from ..render import convert, PROLOG
+from ..blocks import BlockCache
+from ..metadata import DocumentMetadata, HeadingInfo, ImageInfo, LinkInfo
+from ..parse import (
+    ConversionLimitExceeded,
+    ConversionLimits,
+    find_section,
+    FragmentCache,
+    Heading,
+    scan_headings,
+    slugify,
+    uninterrupted,
+)
+from ..render import (
+    convert,
+    convert_with_metadata,
+    dump_tokens,
+    load_tokens,
+    parse_tokens,
+    PROLOG,
+    render_tokens,
+    RestMarkdown,
+)
 
 
 class RendererTestBase(TestCase):
@@ -309,6 +334,78 @@ class TestInlineMarkdown(RendererTestBase):
         self.assertEqual(out, "\n\n.. raw:: html\n\n   <h1>title</h1>\n\n")
 
 
+class TestLiteralInclude(RendererTestBase):
+    def conv_file(self, src: str, threshold: int, path: str = "/a.md") -> str:
+        md = RestMarkdown(literalinclude_threshold=threshold)
+        state = md.block.state_cls()
+        state.env["__file__"] = path
+        out, _ = md.parse(src, state)
+        return out
+
+    def test_below_threshold(self) -> None:
+        src = "```python\nprint(1)\n```\n"
+        self.assertEqual(self.conv(src), self.conv_file(src, threshold=100))
+
+    def test_without_file(self) -> None:
+        src = "```python\nprint(1)\n```\n"
+        out = convert(src, literalinclude_threshold=1)
+        self.assertEqual(self.conv(src), out)
+
+    def test_literalinclude(self) -> None:
+        src = "para\n\n```python\nprint(1)\nprint(2)\n```\n\n```\nx\n```\n"
+        out = self.conv_file(src, threshold=5)
+        self.assertEqual(
+            out,
+            "\n".join(
+                [
+                    "",
+                    "para",
+                    "",
+                    ".. literalinclude:: /a.md",
+                    "   :lines: 4-5",
+                    "   :language: python",
+                    "",
+                    "",
+                    ".. code-block::",
+                    "",
+                    "   x",
+                    "",
+                ]
+            ),
+        )
+
+    def test_literalinclude_nested(self) -> None:
+        src = "* item\n\n  ```\n  long enough\n  ```\n"
+        self.assertNotIn("literalinclude", self.conv_file(src, threshold=1))
+
+    def test_literalinclude_math(self) -> None:
+        src = "```math\nE = mc^2\n```\n"
+        self.assertNotIn("literalinclude", self.conv_file(src, threshold=1))
+
+
+class TestDataUri(RendererTestBase):
+    PNG = "data:image/png;base64,iVBORw0KGgo="
+
+    def test_disabled(self) -> None:
+        out = self.conv("![a]({})".format(self.PNG))
+        self.assertIn(".. image:: {}".format(self.PNG), out)
+
+    def test_extract(self) -> None:
+        with TemporaryDirectory() as td:
+            src = "![a]({0})\n\n[![b]({0})]({0})\n\n![c](data:,a%20b)".format(self.PNG)
+            out = self.conv(src, data_uri_dir=td, data_uri_url="/images")
+            self.assertNotIn("data:", out)
+
+            files = sorted(p.name for p in Path(td).iterdir())
+            self.assertEqual(2, len(files))
+            png, txt = files
+            self.assertTrue(png.endswith(".png"))
+            self.assertEqual(b"\x89PNG\r\n\x1a\n", (Path(td) / png).read_bytes())
+            self.assertEqual(b"a b", (Path(td) / txt).read_bytes())
+            self.assertEqual(3, out.count(".. image:: /images/"))
+            self.assertEqual(2, out.count(":target: /images/{}".format(png)))
+
+
 class TestBlockQuote(RendererTestBase):
     def test_block_quote(self) -> None:
         src = "> q1\n> q2"
@@ -822,3 +919,396 @@ class TestRestCode(RendererTestBase):
         src = "a ::\n\n    code\n"
         out = self.conv(src)
         self.assertEqual(out, "\na\n\n.. code-block::\n\n   code\n")
+
+
+class TestLimits(RendererTestBase):
+    def test_no_limits(self) -> None:
+        src = "a\n\n> b\n> > c\n"
+        out = self.conv(src, limits=ConversionLimits())
+        self.assertEqual(out, self.conv(src))
+
+    def test_max_size(self) -> None:
+        with self.assertRaisesRegex(ConversionLimitExceeded, "input size 11"):
+            convert("hello world", limits=ConversionLimits(max_size=10))
+
+    def test_max_depth_block(self) -> None:
+        src = "para\n\n* a\n  * b\n    * c\n"
+        self.conv(src, limits=ConversionLimits(max_depth=2))
+        with self.assertRaises(ConversionLimitExceeded) as cm:
+            convert(src, limits=ConversionLimits(max_depth=1))
+        self.assertEqual(cm.exception.lineno, 3)
+        self.assertEqual(cm.exception.block, "* a")
+
+    def test_max_depth_inline(self) -> None:
+        src = "**a _b [c](d) b_ a**"
+        self.conv(src, limits=ConversionLimits(max_depth=4))
+        with self.assertRaisesRegex(ConversionLimitExceeded, "nesting depth"):
+            convert(src, limits=ConversionLimits(max_depth=3))
+
+    def test_timeout(self) -> None:
+        src = "a `b`:role: c\n\n" * 100
+        with self.assertRaisesRegex(ConversionLimitExceeded, "conversion time"):
+            convert(src, limits=ConversionLimits(timeout=0))
+
+    @skipUnless(hasattr(signal, "setitimer"), "requires signal.setitimer")
+    def test_timeout_deferred(self) -> None:
+        budget = ConversionLimits(timeout=60).start("text")
+        written = []
+        with self.assertRaisesRegex(ConversionLimitExceeded, "conversion time"):
+            with budget.interrupt():
+                with uninterrupted():
+                    signal.raise_signal(signal.SIGALRM)
+                    written.append(True)
+                written.append(False)
+        # the protected section finished, and the timeout was raised after it
+        self.assertEqual([True], written)
+
+        with self.assertRaisesRegex(ConversionLimitExceeded, "conversion time"):
+            with budget.interrupt():
+                signal.raise_signal(signal.SIGALRM)
+                written.append(False)
+        self.assertEqual([True], written)
+
+
+class TestTokens(RendererTestBase):
+    SOURCE = (
+        "# Title\n\n"
+        "Text with <b>html</b>, `code`, :role:`x`, `link`_, `$x^2$`, and a note[^1].\n\n"
+        "* [anchor](#title)\n\n"
+        "| a | b |\n|---|---|\n| 1 | 2 |\n\n"
+        ".. note:: directive\n\n"
+        "[^1]: The note.\n"
+    )
+
+    def test_round_trip(self) -> None:
+        tokens = parse_tokens(self.SOURCE)
+        types = {t["type"] for t in tokens} | {
+            c["type"] for t in tokens for c in t.get("children", ())
+        }
+        for kind in ("directive", "rest_role", "rest_link", "inline_math", "footnotes"):
+            self.assertIn(kind, types)
+
+        expected = convert(self.SOURCE)
+        self.assertEqual(expected, render_tokens(tokens))
+        self.assertEqual(expected, render_tokens(load_tokens(dump_tokens(tokens))))
+        self.assertEqual(tokens, parse_tokens(self.SOURCE))
+
+    def test_render_options(self) -> None:
+        tokens = parse_tokens(self.SOURCE)
+        anchors = {"title": "page#title"}
+        self.assertEqual(
+            convert(self.SOURCE, anchors=anchors),
+            render_tokens(tokens, anchors=anchors),
+        )
+        self.assertEqual(convert(self.SOURCE), render_tokens(tokens))
+
+    def test_limits(self) -> None:
+        with self.assertRaises(ConversionLimitExceeded):
+            parse_tokens("hello world", limits=ConversionLimits(max_size=5))
+
+    def test_load_invalid(self) -> None:
+        with self.assertRaisesRegex(ValueError, "invalid token data"):
+            load_tokens(b"nope")
+        with self.assertRaisesRegex(ValueError, "unsupported token format"):
+            load_tokens(marshal.dumps((99, [])))
+
+
+class TestFragments(RendererTestBase):
+    def setUp(self) -> None:
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        self.write("note.md", "**Note:** see [docs].\n\n{!nested/links.md!}\n")
+        self.write("nested/links.md", "[docs]: https://docs\n\n* item\n")
+        self.fragments = FragmentCache(self.tmp.name)
+
+    def write(self, name: str, content: str) -> None:
+        path = self.root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    def test_disabled(self) -> None:
+        self.assertEqual("\n{!note.md!}\n", convert("{!note.md!}\n"))
+
+    def test_include(self) -> None:
+        src = "# Title\n\n{!note.md!}\n\nText.\n\n> {!note.md!}\n"
+        expected = convert(
+            "# Title\n\n**Note:** see [docs].\n\n* item\n\nText.\n\n"
+            "> **Note:** see [docs].\n>\n> * item\n\n[docs]: https://docs\n"
+        )
+        self.assertEqual(expected, convert(src, fragments=self.fragments))
+        self.assertEqual(expected, convert(src, fragments=self.fragments))
+
+        note = str(self.root / "note.md")
+        links = str(self.root / "nested" / "links.md")
+        self.assertEqual({note, links}, self.fragments.dependencies([note]))
+
+    def test_local_definitions(self) -> None:
+        out = convert(
+            "{!note.md!}\n\n[docs]: https://local\n", fragments=self.fragments
+        )
+        self.assertIn("https://local", out)
+        self.assertNotIn("https://docs", out)
+
+    def test_parsed_once(self) -> None:
+        md = RestMarkdown(fragments=self.fragments)
+        md("{!note.md!}\n")
+        fragment = self.fragments.load(str(self.root / "note.md"), (), md.block)
+        md("{!note.md!}\n")
+        self.assertIs(
+            fragment, self.fragments.load(str(self.root / "note.md"), (), md.block)
+        )
+
+        self.write("note.md", "changed\n")
+        self.assertEqual("\nchanged\n", md("{!note.md!}\n"))
+
+    def test_nested_change(self) -> None:
+        md = RestMarkdown(fragments=self.fragments)
+        self.assertIn("* item", md("{!note.md!}\n"))
+        self.write("nested/links.md", "[docs]: https://docs\n\n* changed item\n")
+        self.assertIn("* changed item", md("{!note.md!}\n"))
+
+        (self.root / "nested" / "links.md").unlink()
+        output, state = md.parse("{!note.md!}\n")
+        assert state is not None
+        self.assertNotIn("item", output)
+        self.assertEqual(
+            ["cannot include nested/links.md: No such file or directory"],
+            state.env["include_errors"],
+        )
+        self.write("nested/links.md", "* back\n")
+        self.assertIn("* back", md("{!note.md!}\n"))
+
+    def test_cycle_per_includer(self) -> None:
+        self.write("a.md", "a\n\n{!c.md!}\n")
+        self.write("c.md", "c\n\n{!a.md!}\n")
+        md = RestMarkdown(fragments=self.fragments)
+        self.assertEqual("\nc\n\na\n", md("{!c.md!}\n"))
+        # the cycle stops at whichever fragment was included first
+        self.assertEqual("\na\n\nc\n", md("{!a.md!}\n"))
+        self.assertEqual("\nc\n\na\n", md("{!c.md!}\n"))
+
+    def test_encoding(self) -> None:
+        (self.root / "latin.md").write_bytes("Caf\xe9.\n".encode("latin-1"))
+        fragments = FragmentCache(self.tmp.name, encoding="latin-1")
+        self.assertEqual("\nCaf\xe9.\n", convert("{!latin.md!}\n", fragments=fragments))
+
+    def test_errors(self) -> None:
+        self.write("a.md", "a\n\n{!b.md!}\n")
+        self.write("b.md", "b\n\n{!a.md!}\n\n{!missing.md!}\n")
+        md = RestMarkdown(fragments=self.fragments)
+        output, state = md.parse("{!a.md!}\n")
+        self.assertEqual("\na\n\nb\n", output)
+        assert state is not None
+        self.assertEqual(
+            [
+                "include cycle: a.md -> b.md -> a.md",
+                "cannot include missing.md: No such file or directory",
+            ],
+            state.env["include_errors"],
+        )
+
+
+class TestMetadata(RendererTestBase):
+    def test_metadata(self) -> None:
+        src = "\n".join(
+            [
+                "# Title with `code` and *emphasis*",
+                "",
+                "Text with [a link](https://example.com 'Example'), and",
+                "![an image](image.png), and a footnote[^note].",
+                "",
+                "## Section [linked](#title)",
+                "",
+                "[![badge](badge.svg)][ci]",
+                "",
+                "[ci]: https://ci.example.com",
+                "[^note]: Footnote [link](https://example.com/note).",
+            ]
+        )
+        result = convert_with_metadata(src)
+        self.assertEqual(convert(src), result.output)
+        metadata = result.metadata
+        self.assertEqual("Title with code and emphasis", metadata.title)
+        self.assertEqual(
+            [
+                HeadingInfo(
+                    1, "Title with code and emphasis", "title-with-code-and-emphasis"
+                ),
+                HeadingInfo(2, "Section linked", "section-linked"),
+            ],
+            metadata.headings,
+        )
+        self.assertEqual(
+            [
+                LinkInfo("https://example.com", "a link", "Example"),
+                LinkInfo("#title", "linked"),
+                LinkInfo("https://ci.example.com", "badge"),
+                LinkInfo("https://example.com/note", "link"),
+            ],
+            metadata.links,
+        )
+        self.assertEqual(
+            [ImageInfo("image.png", "an image"), ImageInfo("badge.svg", "badge")],
+            metadata.images,
+        )
+        self.assertEqual(["NOTE"], metadata.footnote_refs)
+
+    def test_empty(self) -> None:
+        metadata = RestMarkdown().convert_with_metadata("Just text.\n").metadata
+        self.assertIsNone(metadata.title)
+        self.assertEqual(DocumentMetadata(), metadata)
+
+    def test_not_collected(self) -> None:
+        metadata = DocumentMetadata()
+        converter = RestMarkdown()
+        converter.parse("# Title\n", metadata=metadata)
+        converter("# Other\n")
+        self.assertEqual(["Title"], [h.title for h in metadata.headings])
+
+
+class TestBlockCache(RendererTestBase):
+    FOOTER = "---\n\nLicensed under the *MIT* license, see `LICENSE`.\n"
+
+    def test_shared_blocks(self) -> None:
+        cache = BlockCache()
+        docs = [
+            "# Page {}\n\nText of page {}.\n\n{}".format(n, n, self.FOOTER)
+            for n in range(3)
+        ]
+        for doc in docs:
+            self.assertEqual(convert(doc), convert(doc, block_cache=cache))
+        metrics = cache.metrics()
+        # only blocks with inline text are cached, like the footer paragraph
+        self.assertEqual(2, metrics["hits"])
+        self.assertEqual(0, metrics["skipped"])
+        self.assertEqual(len(cache), metrics["misses"])
+
+        state = RestMarkdown(block_cache=cache).parse(docs[0])[1]
+        assert state is not None
+        self.assertEqual(
+            {"hits": 3, "misses": 0, "skipped": 0},
+            state.env["block_cache"],
+        )
+
+    def test_document_state(self) -> None:
+        cache = BlockCache()
+        converter = RestMarkdown(block_cache=cache)
+        first = "See [docs] and note[^1].\n\n[^1]: A note.\n"
+        second = "See [docs] and note[^1].\n\n[docs]: https://example.com\n"
+        self.assertEqual(convert(first), converter(first))
+        self.assertEqual(convert(second), converter(second))
+        self.assertIn("https://example.com", converter(second))
+        self.assertEqual(0, cache.metrics()["hits"])
+        self.assertEqual(3, cache.metrics()["skipped"])
+
+        # inline links never depend on the document
+        link = "A [link](https://example.com).\n"
+        converter(link)
+        self.assertEqual(convert(link), converter(link))
+        self.assertEqual(1, cache.metrics()["hits"])
+
+    def test_options(self) -> None:
+        cache = BlockCache()
+        text = "Jump to [usage](#usage).\n"
+        plain = convert(text, block_cache=cache)
+        anchored = convert(text, block_cache=cache, anchors={"usage": "api#usage"})
+        self.assertIn(":ref:`usage <usage>`", plain)
+        self.assertIn(":ref:`usage <api#usage>`", anchored)
+        self.assertEqual(0, cache.metrics()["hits"])
+
+        def resolver(url: str) -> Tuple[str, str]:
+            return ("doc", "/" + url)
+
+        # links are relative to the document with a link resolver
+        converter = RestMarkdown(block_cache=cache, link_resolver=resolver)
+        self.assertIn(":doc:`usage </#usage>`", converter(text))
+        self.assertEqual(1, cache.metrics()["skipped"])
+
+    def test_raw_html(self) -> None:
+        cache = BlockCache()
+        converter = RestMarkdown(block_cache=cache)
+        block = "Some <b>bold</b> text.\n"
+        self.assertEqual(
+            convert("# Title\n\n" + block), converter("# Title\n\n" + block)
+        )
+        self.assertEqual(
+            PROLOG + "\nSome :raw-html-md:`<b>bold</b>` text.\n", converter(block)
+        )
+        self.assertEqual(1, cache.metrics()["hits"])
+
+    def test_metadata(self) -> None:
+        cache = BlockCache()
+        converter = RestMarkdown(block_cache=cache)
+        text = "# Title\n\n![logo](logo.png) [home](https://example.com)\n"
+        first = converter.convert_with_metadata(text).metadata
+        second = converter.convert_with_metadata(text).metadata
+        self.assertEqual(convert_with_metadata(text).metadata, first)
+        self.assertEqual(first, second)
+        self.assertEqual(2, cache.metrics()["hits"])
+
+    def test_size(self) -> None:
+        cache = BlockCache(size=100)
+        for n in range(10):
+            convert("Paragraph {} {}.\n".format(n, "x" * 30), block_cache=cache)
+        metrics = cache.metrics()
+        self.assertLessEqual(metrics["chars"], 100)
+        self.assertEqual(2, metrics["entries"])
+        self.assertEqual(8, metrics["evictions"])
+
+        convert("y" * 200, block_cache=cache)
+        self.assertEqual(2, len(cache))
+
+
+class TestHeadingScan(TestCase):
+    SRC = "\n".join(
+        [
+            "intro",
+            "",
+            "# Title",
+            "",
+            "text",
+            "Sub Title",
+            "---------",
+            "",
+            "```",
+            "# not a heading",
+            "```",
+            "",
+            "* item",
+            "---",
+            "",
+            "## Foo [link](x) ##",
+            "### Foo [link](x)",
+            "",
+            "# Last",
+        ]
+    )
+
+    def test_slugify(self) -> None:
+        self.assertEqual("hello-world", slugify("Hello, World!"))
+        self.assertEqual("use-link-here", slugify("Use [link](url) here"))
+        self.assertEqual("snake_case-api", slugify("snake_case API"))
+
+    def test_scan_headings(self) -> None:
+        headings = scan_headings(self.SRC)
+        self.assertEqual(
+            [
+                Heading(1, "Title", "title", 7),
+                Heading(2, "text Sub Title", "text-sub-title", 16),
+                Heading(2, "Foo [link](x)", "foo-link", 79),
+                Heading(3, "Foo [link](x)", "foo-link-1", 99),
+                Heading(1, "Last", "last", 118),
+            ],
+            headings,
+        )
+        self.assertTrue(self.SRC[headings[2].start :].startswith("## Foo"))
+        self.assertTrue(self.SRC[headings[1].start :].startswith("text\n"))
+
+    def test_find_section(self) -> None:
+        headings = scan_headings(self.SRC)
+        self.assertEqual((79, 118), find_section(headings, "foo-link", len(self.SRC)))
+        self.assertEqual((99, 118), find_section(headings, "foo-link-1", 200))
+        self.assertEqual((118, 200), find_section(headings, " last ", 200))
+        self.assertEqual((16, 79), find_section(headings, "TEXT SUB TITLE", 200))
+        self.assertIsNone(find_section(headings, "missing", 200))
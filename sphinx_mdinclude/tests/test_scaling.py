@@ -0,0 +1,143 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import gc
+import math
+import time
+import tracemalloc
+import unittest
+from typing import Callable, List, Sequence, Tuple
+
+from ..parse import RestBlockParser
+from ..render import RestMarkdown
+
+# growth exponent of runtime or peak memory against input size; linear is 1.0,
+# and a quadratic regression shows up as 1.7 or more even on small inputs
+MAX_SLOPE = 1.4
+# peak memory allocated during conversion, in bytes per byte of input
+MAX_PEAK_PER_BYTE = 512
+REPEAT = 3
+# above the deepest nesting generated below, which mistune stops at 6 by default;
+# much deeper lists exceed the default recursion limit
+MAX_NESTED_LEVEL = 200
+
+
+def paragraphs(n: int) -> str:
+    return "\n\n".join(
+        "Paragraph {0} with *emphasis*, `code` and a [link](http://x/{0}).".format(i)
+        for i in range(n)
+    )
+
+
+def list_items(n: int) -> str:
+    return "\n".join("* item {}\n  continued".format(i) for i in range(n))
+
+
+def list_depth(n: int) -> str:
+    return "\n".join("{}* item {}".format("  " * i, i) for i in range(n))
+
+
+def quote_depth(n: int) -> str:
+    return "\n".join("{}quote {}".format("> " * i, i) for i in range(1, n))
+
+
+def table_rows(n: int) -> str:
+    rows = ["| {0} | *{0}* |".format(i) for i in range(n)]
+    return "\n".join(["| a | b |", "| - | - |"] + rows)
+
+
+def directive_lines(n: int) -> str:
+    lines = ["   line {} of the note".format(i) for i in range(n)]
+    return "\n".join([".. note::", ""] + lines)
+
+
+def role_density(n: int) -> str:
+    return " ".join(":ref:`target {0}` and :code:`x{0}`".format(i) for i in range(n))
+
+
+def slope(points: Sequence[Tuple[float, float]]) -> float:
+    """Least-squares slope of ``log(y)`` against ``log(x)``."""
+    xs = [math.log(x) for x, _ in points]
+    ys = [math.log(y) for _, y in points]
+    mx, my = sum(xs) / len(xs), sum(ys) / len(ys)
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sum(
+        (x - mx) ** 2 for x in xs
+    )
+
+
+class ScalingTest(unittest.TestCase):
+    """Conversion time and peak memory must grow linearly with input size."""
+
+    converter: RestMarkdown
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.converter = RestMarkdown(
+            block=RestBlockParser(max_nested_level=MAX_NESTED_LEVEL)
+        )
+        cls.converter(paragraphs(10))
+
+    def measure(self, text: str) -> Tuple[float, int]:
+        timings = []
+        for _ in range(REPEAT):
+            before = time.perf_counter()
+            self.converter(text)
+            timings.append(time.perf_counter() - before)
+
+        gc.collect()
+        tracemalloc.start()
+        try:
+            baseline = tracemalloc.get_traced_memory()[0]
+            self.converter(text)
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+        finally:
+            tracemalloc.stop()
+        return min(timings), peak
+
+    def assertLinear(self, generate: Callable[[int], str], sizes: List[int]) -> None:
+        times, peaks = [], []
+        for n in sizes:
+            text = generate(n)
+            elapsed, peak = self.measure(text)
+            times.append((len(text), elapsed))
+            peaks.append((len(text), peak))
+            self.assertLessEqual(
+                peak / len(text),
+                MAX_PEAK_PER_BYTE,
+                "{} bytes peak for {} bytes of input".format(peak, len(text)),
+            )
+
+        self.assertLess(slope(times), MAX_SLOPE, "runtime {}".format(times))
+        self.assertLess(slope(peaks), MAX_SLOPE, "peak memory {}".format(peaks))
+
+    def test_slope(self) -> None:
+        self.assertAlmostEqual(1.0, slope([(1, 3), (2, 6), (4, 12)]))
+        self.assertAlmostEqual(2.0, slope([(1, 3), (2, 12), (4, 48)]))
+
+    def test_paragraphs(self) -> None:
+        self.assertLinear(paragraphs, [100, 200, 400, 800])
+
+    def test_list_items(self) -> None:
+        self.assertLinear(list_items, [100, 200, 400, 800])
+
+    def test_list_depth(self) -> None:
+        # the innermost item is nested in all the others
+        self.assertIn(
+            "\n{}* item 79\n".format("  " * 79), self.converter(list_depth(80))
+        )
+        self.assertLinear(list_depth, [10, 20, 40, 80])
+
+    def test_quote_depth(self) -> None:
+        self.assertIn(
+            "\n{}quote 159\n".format("   " * 159), self.converter(quote_depth(160))
+        )
+        self.assertLinear(quote_depth, [20, 40, 80, 160])
+
+    def test_table_rows(self) -> None:
+        self.assertLinear(table_rows, [200, 400, 800, 1600])
+
+    def test_directive_lines(self) -> None:
+        self.assertLinear(directive_lines, [400, 800, 1600, 3200])
+
+    def test_role_density(self) -> None:
+        self.assertLinear(role_density, [200, 400, 800, 1600])
@@ -0,0 +1,138 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import os
+import signal
+import socket
+import threading
+import time
+import unittest
+from tempfile import TemporaryDirectory
+from typing import Any, List
+from unittest.mock import patch
+
+from ..parse import ConversionLimits
+from ..render import convert
+from ..server import Client, ConversionHandler, ConversionService, make_server, serve
+
+SOURCE = "# Title\n\nsome *text* with `code`\n"
+
+
+class ServerTest(unittest.TestCase):
+    def start(self, **kwargs: Any) -> Any:
+        server = make_server(**kwargs)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop() -> None:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return server
+
+    def tcp_client(self, **kwargs: Any) -> Client:
+        server = self.start(**kwargs)
+        client = Client(port=server.server_address[1], timeout=10)
+        self.addCleanup(client.close)
+        return client
+
+    def test_convert(self) -> None:
+        client = self.tcp_client()
+        self.assertEqual({"status": "ok"}, client.health())
+        self.assertEqual(convert(SOURCE), client.convert(SOURCE))
+        self.assertEqual(convert(SOURCE), client.convert(SOURCE))
+
+        metrics = client.metrics()
+        self.assertEqual(1, metrics["conversions"])
+        self.assertEqual(1, metrics["cache_hits"])
+        self.assertEqual(1, metrics["cache_size"])
+
+    def test_convert_many(self) -> None:
+        client = self.tcp_client()
+        texts = ["# Doc {}\n\n*para*\n".format(i) for i in range(10)]
+        self.assertEqual([convert(t) for t in texts], client.convert_many(texts))
+
+    def test_options(self) -> None:
+        client = self.tcp_client()
+        anchors = {"intro": "guide#intro"}
+        output = client.convert("[a](#intro)", anchors=anchors)
+        self.assertEqual(convert("[a](#intro)", anchors=anchors), output)
+        self.assertIn("<guide#intro>", output)
+        with self.assertRaisesRegex(ValueError, "input size"):
+            client.convert(SOURCE, limits=ConversionLimits(max_size=5))
+        with self.assertRaisesRegex(ValueError, "unsupported option"):
+            client.convert(SOURCE, data_uri_dir="/tmp")
+        self.assertEqual(1, client.metrics()["errors"])
+
+    def test_cache_eviction(self) -> None:
+        client = self.tcp_client(cache_size=2)
+        for i in range(5):
+            client.convert("text {}".format(i))
+        self.assertEqual(2, client.metrics()["cache_size"])
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires unix sockets")
+    def test_unix_socket(self) -> None:
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "mdinclude.sock")
+            self.start(socket_path=path)
+            client = Client(path, timeout=10)
+            try:
+                self.assertEqual(convert(SOURCE), client.convert(SOURCE))
+                self.assertEqual([convert("a")], client.convert_many(["a"]))
+            finally:
+                client.close()
+
+    @unittest.skipUnless(hasattr(socket, "AF_UNIX"), "requires unix sockets")
+    def test_sigterm(self) -> None:
+        started = threading.Event()
+        output = "converted\n" * 100000
+
+        def slow(service: ConversionService, text: str, options: Any) -> str:
+            started.set()
+            time.sleep(0.5)
+            return output
+
+        send = ConversionHandler._send
+        sent: List[int] = []
+
+        def slow_send(handler: ConversionHandler, status: int, body: Any) -> None:
+            time.sleep(0.2)
+            send(handler, status, body)
+            sent.append(status)
+
+        responses: List[str] = []
+
+        def request(path: str) -> None:
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            client = Client(path, timeout=10)
+            try:
+                responses.append(client.convert(SOURCE))
+            finally:
+                client.close()
+
+        def terminate() -> None:
+            started.wait(10)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        with TemporaryDirectory() as td:
+            path = os.path.join(td, "mdinclude.sock")
+            threads = [
+                threading.Thread(target=request, args=(path,)),
+                threading.Thread(target=terminate),
+            ]
+            with patch.object(ConversionService, "_convert", slow), patch.object(
+                ConversionHandler, "_send", slow_send
+            ):
+                for thread in threads:
+                    thread.start()
+                serve(socket_path=path)
+                # the response was sent before serve() returned
+                self.assertEqual([200], sent)
+            for thread in threads:
+                thread.join()
+
+        # the request in progress finishes before the server stops
+        self.assertEqual([output], responses)
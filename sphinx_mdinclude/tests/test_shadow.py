@@ -0,0 +1,157 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import pickle
+import threading
+import unittest
+from concurrent.futures import Future
+
+from ..render import RestMarkdown, RestRenderer
+from ..shadow import (
+    DIVERGED,
+    ERROR,
+    MATCH,
+    minimize,
+    PendingChecks,
+    ShadowResult,
+    ShadowVerifier,
+    summarize,
+)
+
+
+class SpacedStrong(RestRenderer):
+    def strong(self, text: str) -> str:
+        return "**{}** ".format(text)
+
+
+class ShadowVerifierTest(unittest.TestCase):
+    def test_minimize(self) -> None:
+        text = "one\n\ntwo\nbad line\nthree\n\nfour"
+        self.assertEqual("bad line", minimize(text, lambda part: "bad" in part))
+        self.assertEqual(text, minimize(text, lambda part: False))
+
+    def test_minimize_steps(self) -> None:
+        text = "\n\n".join("block {}".format(i) for i in range(100))
+        calls = []
+
+        def diverges(part: str) -> bool:
+            calls.append(part)
+            return "block 99" in part
+
+        minimize(text, diverges, max_steps=10)
+        self.assertEqual(10, len(calls))
+
+    def test_match(self) -> None:
+        converter = RestMarkdown()
+        text = "# Title\n\nSome *text*.\n"
+        verifier = ShadowVerifier(1.0)
+        try:
+            self.assertTrue(verifier.sample())
+            result = verifier.submit(
+                text, converter(text), 0.1, converter, converter.reference(), "a.md"
+            ).result()
+        finally:
+            verifier.close()
+
+        self.assertEqual(("a.md", MATCH, 0.1), result[:3])
+        self.assertEqual("", result.diff)
+        self.assertEqual("", result.reproducer)
+        self.assertEqual(1, verifier.metrics()["checked"])
+        self.assertEqual(0, verifier.metrics()["diverged"])
+
+    def test_diverged(self) -> None:
+        converter = RestMarkdown(renderer=SpacedStrong())
+        text = "# Title\n\nPlain.\n\nSome **bold**.\n\n* a list\n"
+        verifier = ShadowVerifier(1.0)
+        try:
+            verifier.sample()
+            result = verifier.submit(
+                text, converter(text), 0.1, converter, RestMarkdown()
+            ).result()
+        finally:
+            verifier.close()
+
+        self.assertEqual(DIVERGED, result.status)
+        self.assertIn("-Some **bold**.\n+Some **bold** .", result.diff)
+        self.assertEqual("Some **bold**.", result.reproducer.strip())
+        self.assertEqual(1, verifier.metrics()["diverged"])
+        self.assertEqual(
+            {"checked": 1, "diverged": 1},
+            {
+                k: v
+                for k, v in summarize([result]).items()
+                if k in ("checked", "diverged")
+            },
+        )
+
+    def test_sample_rate(self) -> None:
+        verifier = ShadowVerifier(0.0)
+        self.assertFalse(any(verifier.sample() for _ in range(100)))
+        self.assertEqual(0, verifier.metrics()["sampled"])
+        verifier.close()
+
+        verifier = ShadowVerifier(0.5, max_pending=1000, seed=1)
+        sampled = sum(verifier.sample() for _ in range(1000))
+        self.assertTrue(400 < sampled < 600, sampled)
+        verifier.close()
+
+    def test_max_pending(self) -> None:
+        release = threading.Event()
+
+        def reference(text: str) -> str:
+            release.wait()
+            return text
+
+        verifier = ShadowVerifier(1.0, max_pending=1)
+        try:
+            self.assertTrue(verifier.sample())
+            future = verifier.submit("a", "a", 0.0, str, reference)
+            self.assertFalse(verifier.sample())
+            self.assertFalse(verifier.sample())
+            release.set()
+            self.assertEqual(MATCH, future.result().status)
+            self.assertTrue(verifier.sample())
+        finally:
+            verifier.close()
+
+        metrics = verifier.metrics()
+        self.assertEqual(4, metrics["sampled"])
+        self.assertEqual(2, metrics["skipped"])
+
+    def test_error(self) -> None:
+        def reference(text: str) -> str:
+            raise ValueError("broken")
+
+        verifier = ShadowVerifier(1.0)
+        try:
+            verifier.sample()
+            result = verifier.submit(
+                "text", "text", 0.1, RestMarkdown(), reference, "a.md"
+            ).result()
+        finally:
+            verifier.close()
+
+        self.assertEqual(("a.md", ERROR), result[:2])
+        self.assertEqual("ValueError: broken", result.diff)
+        self.assertEqual(1, verifier.metrics()["checked"])
+        self.assertEqual(1, summarize([result])["errors"])
+
+    def test_pending(self) -> None:
+        first: "Future[ShadowResult]" = Future()
+        second: "Future[ShadowResult]" = Future()
+        pending = PendingChecks()
+        pending.add("a", None, first)
+        pending.add("b", "record", second)
+
+        result = ShadowResult("b.md", MATCH, 0.1, 0.1, 0.1)
+        second.set_result(result)
+        # finished checks are collected without waiting for the others
+        self.assertEqual([("b", "record", result)], pending.drain())
+        self.assertEqual(1, len(pending))
+
+        first.set_result(result._replace(source="a.md"))
+        copy = pickle.loads(pickle.dumps(pending))
+        self.assertEqual(
+            [("a", None, result._replace(source="a.md"))], copy.drain(wait=True)
+        )
+        self.assertEqual(0, len(copy))
@@ -6,13 +6,16 @@ import unittest
 from dataclasses import dataclass, field
 from pathlib import Path
 from textwrap import dedent
+from typing import Any, List, Optional
 
+from docutils import nodes
 from docutils.frontend import get_default_settings
 from docutils.parsers.rst import directives, Parser
 from docutils.utils import new_document
+from sphinx.util.docutils import docutils_namespace
 
-from ..render import convert
-from ..sphinx import MdInclude
+from ..render import convert, PROLOG, RestMarkdown
+from ..sphinx import _convert, DocumentContext, MdInclude
 
 TEST_MD = Path(__file__).parent / "test.md"
 TEST_RST = Path(__file__).parent / "test.rst"
@@ -24,6 +27,17 @@ class FakeConfig:
     md_parse_relative_links: bool = False
     md_anonymous_references: bool = False
     md_disable_inline_math: bool = False
+    md_max_input_size: Optional[int] = None
+    md_max_nesting_depth: Optional[int] = None
+    md_conversion_timeout: Optional[float] = None
+    md_literalinclude_threshold: Optional[int] = None
+    md_extract_data_uris: bool = False
+    md_reference_links: List[str] = field(default_factory=list)
+    md_metrics_report: Optional[str] = None
+    md_shadow_rate: float = 0.0
+    md_block_cache_size: int = 0
+    md_slow_threshold: Optional[float] = None
+    md_node_cache_size: int = 0
 
 
 @dataclass
@@ -67,12 +81,81 @@ class SmokeTest(unittest.TestCase):
             """
         )
 
-        directives.register_directive("mdinclude", MdInclude)
-        parser = Parser()
-        settings = get_default_settings(Parser)
-        settings.env = FakeEnv()
-        document = new_document("smoke.rst", settings.copy())
-        parser.parse(content, document)
+        document = self.parse_rst(content)
 
         result = document.pformat()
         self.assertEqual(expected, result[: len(expected)])
+
+    def test_mdinclude_section(self) -> None:
+        content = dedent(
+            f"""
+            .. mdinclude:: {TEST_MD}
+               :section: subtitle
+
+            """
+        )
+        expected = dedent(
+            """\
+            <document source="smoke.rst">
+                <section ids="subtitle" names="subtitle">
+                    <title>
+                        SubTitle
+                    <paragraph>
+                        <strong>
+                            content
+            """
+        )
+        document = self.parse_rst(content)
+        self.assertEqual(expected, document.pformat())
+
+    def test_mdinclude_section_missing(self) -> None:
+        content = dedent(
+            f"""
+            .. mdinclude:: {TEST_MD}
+               :section: Missing
+
+            """
+        )
+        document = self.parse_rst(content)
+        messages = list(document.findall(nodes.system_message))
+        self.assertEqual(1, len(messages))
+        self.assertIn('section "Missing" not found', messages[0].astext())
+
+    def test_mdinclude_limit_fallback(self) -> None:
+        content = dedent(
+            f"""
+            .. mdinclude:: {TEST_MD}
+
+            """
+        )
+        document = self.parse_rst(content, FakeConfig(md_max_input_size=10))
+
+        blocks = list(document.findall(nodes.literal_block))
+        self.assertEqual(1, len(blocks))
+        self.assertEqual(TEST_MD.read_text(), blocks[0].astext())
+        messages = list(document.findall(nodes.system_message))
+        self.assertEqual(1, len(messages))
+        self.assertIn("input size", messages[0].astext())
+        self.assertIn(TEST_MD.name, messages[0].astext())
+
+    def test_document_context(self) -> None:
+        converter = RestMarkdown()
+        context = DocumentContext()
+        outputs = []
+        for text in ("plain", "<b>a</b>", "<i>b</i>", "[x][ref]\n\n[ref]: /own"):
+            output, state = _convert(converter, text, FakeEnv(), context=context)
+            outputs.append(context.finish(output, state))
+        self.assertEqual(1, "".join(outputs).count(PROLOG))
+        self.assertTrue(outputs[1].startswith(PROLOG))
+        self.assertEqual(1, len(context.ref_links))
+
+    def parse_rst(self, content: str, config: Optional[FakeConfig] = None) -> Any:
+        parser = Parser()
+        settings = get_default_settings(Parser)
+        settings.env = FakeEnv(config or FakeConfig())
+        settings.report_level = 5
+        document = new_document("smoke.rst", settings.copy())
+        with docutils_namespace():
+            directives.register_directive("mdinclude", MdInclude)
+            parser.parse(content, document)
+        return document
@@ -0,0 +1,1120 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import csv
+import hashlib
+import json
+import unittest
+import zipfile
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from textwrap import dedent
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+from docutils import nodes
+from sphinx.application import Sphinx
+from sphinx.util.docutils import docutils_namespace
+
+from ..metadata import DocumentMetadata, HeadingInfo, LinkInfo
+from ..render import RestMarkdown, RestRenderer
+from ..resources import ARCHIVE, ArchiveCache, parse_resource, Resource
+from ..sphinx import BLOCK_CACHES, MetricsMarker, NODE_CACHES
+
+
+class SphinxTestBase(unittest.TestCase):
+    maxDiff = None
+
+    def setUp(self) -> None:
+        self.tmp = TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        self.srcdir = self.root / "src"
+        self.outdir = self.root / "out"
+        self.srcdir.mkdir()
+
+    def write(self, files: Dict[str, str]) -> None:
+        for name, content in files.items():
+            path = self.srcdir / name
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(dedent(content))
+
+    def build(
+        self,
+        builder: str = "html",
+        parallel: int = 0,
+        listeners: Optional[Dict[str, Callable[..., None]]] = None,
+        **config: Any,
+    ) -> Sphinx:
+        config.setdefault("extensions", ["sphinx_mdinclude"])
+        self.status = StringIO()
+        self.warnings = StringIO()
+        with docutils_namespace():
+            app = Sphinx(
+                str(self.srcdir),
+                None,
+                str(self.outdir),
+                str(self.outdir / ".doctrees"),
+                builder,
+                confoverrides=config,
+                status=self.status,
+                warning=self.warnings,
+                freshenv=False,
+                parallel=parallel,
+            )
+            for event, listener in (listeners or {}).items():
+                app.connect(event, listener)
+            app.build()
+        return app
+
+
+class LiteralIncludeTest(SphinxTestBase):
+    def test_literalinclude(self) -> None:
+        code = "\n".join("line {}".format(i) for i in range(20))
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. toctree::
+
+                       page
+
+                    .. mdinclude:: ../include.md
+                       :start-line: 2
+                    """,
+                "page.md": "# Page\n\n```python\n{}\n```\n".format(code),
+                "../include.md": "skipped\n\n```\n{}\n```\n".format(code),
+            }
+        )
+        app = self.build(md_literalinclude_threshold=50)
+        self.assertEqual("", self.warnings.getvalue())
+
+        for docname in ("index", "page"):
+            doctree = app.env.get_doctree(docname)
+            blocks = list(doctree.findall(nodes.literal_block))
+            self.assertEqual(1, len(blocks))
+            self.assertEqual(code, blocks[0].astext().rstrip("\n"))
+
+    def test_end_line(self) -> None:
+        code = "\n".join("line {}".format(i) for i in range(20))
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. mdinclude:: ../include.md
+                       :end-line: 24
+                    """,
+                "../include.md": "```\n{}\n```\n\nskipped\n".format(code),
+            }
+        )
+        app = self.build(md_literalinclude_threshold=50)
+        self.assertEqual("", self.warnings.getvalue())
+
+        (block,) = app.env.get_doctree("index").findall(nodes.literal_block)
+        self.assertEqual(code, block.astext().rstrip("\n"))
+
+
+class DataUriTest(SphinxTestBase):
+    PNG = (
+        "data:image/png;base64,"
+        "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR4nGNgYGD4DwABBAEA"
+        "fbLI3wAAAABJRU5ErkJggg=="
+    )
+
+    def test_extract_data_uris(self) -> None:
+        self.write(
+            {
+                "index.md": "# Index\n\n![one]({})\n".format(self.PNG),
+                "other.md": ":orphan:\n\n# Other\n\n![two]({})\n".format(self.PNG),
+            }
+        )
+        self.build(md_extract_data_uris=True)
+        self.assertNotIn("WARNING", self.warnings.getvalue())
+
+        extracted = list((self.outdir / ".doctrees" / "mdinclude-images").iterdir())
+        self.assertEqual(1, len(extracted))
+        images = list((self.outdir / "_images").iterdir())
+        self.assertEqual([extracted[0].name], [p.name for p in images])
+        for page in ("index.html", "other.html"):
+            html = (self.outdir / page).read_text()
+            self.assertNotIn("data:", html)
+            self.assertIn("_images/" + extracted[0].name, html)
+
+
+class SplitPagesTest(SphinxTestBase):
+    SOURCE = """\
+        Intro text, see [usage](#usage).
+
+        # Install
+
+        Install it.
+
+        ## Usage
+
+        Use it, after [installing](#install).
+
+        ```
+        # not a heading
+        ```
+
+        # Reference
+
+        Details.
+        """
+
+    def test_split_disabled(self) -> None:
+        self.write({"index.md": self.SOURCE})
+        app = self.build()
+        self.assertEqual({"index"}, set(app.env.found_docs))
+        self.assertFalse((self.srcdir / "index.parts").exists())
+
+    def test_split_pages(self) -> None:
+        self.write({"index.md": self.SOURCE})
+        app = self.build(md_split_threshold=5)
+
+        parts = ["001-install", "002-usage", "003-reference"]
+        self.assertEqual(
+            sorted(p + ".md" for p in parts),
+            sorted(p.name for p in (self.srcdir / "index.parts").glob("*.md")),
+        )
+        self.assertEqual(
+            {"index"} | {"index.parts/" + p for p in parts},
+            set(app.env.found_docs),
+        )
+        self.assertEqual("", self.warnings.getvalue())
+
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn("Intro text", index)
+        self.assertNotIn("Install it.", index)
+        self.assertIn(
+            'href="index.parts/002-usage.html#index-parts-002-usage-usage"', index
+        )
+        self.assertIn('href="index.parts/003-reference.html"', index)
+
+        usage = (self.outdir / "index.parts" / "002-usage.html").read_text()
+        self.assertIn("# not a heading", usage)
+        self.assertIn('href="001-install.html#index-parts-001-install-install"', usage)
+
+    def test_split_title(self) -> None:
+        self.write(
+            {
+                "index.md": """\
+                    # Guide
+
+                    Welcome.
+
+                    ## Install
+
+                    Install it.
+
+                    ## Usage
+
+                    Use it.
+                    """
+            }
+        )
+        app = self.build(md_split_threshold=5, source_encoding="utf-8-sig")
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertEqual(
+            {"index", "index.parts/001-install", "index.parts/002-usage"},
+            set(app.env.found_docs),
+        )
+        self.assertEqual("Guide", app.env.titles["index"].astext())
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn("<title>Guide", index)
+        self.assertIn("Welcome.", index)
+        self.assertNotIn("Install it.", index)
+
+        # parts are plain utf-8, without a byte order mark
+        part = self.srcdir / "index.parts" / "001-install.md"
+        self.assertTrue(part.read_bytes().startswith(b".. _index.parts/001-install#"))
+
+    def test_split_incremental(self) -> None:
+        self.write({"index.md": self.SOURCE})
+        self.build(md_split_threshold=5)
+        part = self.srcdir / "index.parts" / "001-install.md"
+        mtime = part.stat().st_mtime_ns
+
+        self.write({"index.md": self.SOURCE.replace("Details.", "More details.")})
+        self.build(md_split_threshold=5)
+        self.assertEqual(mtime, part.stat().st_mtime_ns)
+
+    def test_split_stale(self) -> None:
+        self.write({"index.md": self.SOURCE})
+        self.build(md_split_threshold=5)
+        self.assertTrue((self.srcdir / "index.parts").exists())
+
+        # shorter than the threshold now
+        app = self.build(md_split_threshold=50)
+        self.assertFalse((self.srcdir / "index.parts").exists())
+        self.assertEqual({"index"}, set(app.env.found_docs))
+        self.assertNotIn("toctree", self.warnings.getvalue())
+
+        self.build(md_split_threshold=5)
+        app = self.build()
+        self.assertFalse((self.srcdir / "index.parts").exists())
+        self.assertEqual({"index"}, set(app.env.found_docs))
+        self.assertNotIn("toctree", self.warnings.getvalue())
+
+    def test_split_keeps_other_files(self) -> None:
+        self.write({"index.md": self.SOURCE, "index.parts/notes.txt": "Mine.\n"})
+        self.build(md_split_threshold=5)
+        self.build()
+        self.assertEqual(
+            ["notes.txt"], [p.name for p in (self.srcdir / "index.parts").iterdir()]
+        )
+
+
+class MetricsTest(SphinxTestBase):
+    def write_docs(self, count: int) -> None:
+        pages = ["page{}".format(i) for i in range(count)]
+        self.write(
+            {page + ".md": "# {}\n\nSome *text*.\n".format(page) for page in pages}
+        )
+        toctree = "".join("   {}\n".format(page) for page in pages)
+        self.write(
+            {
+                "index.rst": "Index\n=====\n\n.. toctree::\n\n{}\n"
+                ".. mdinclude:: include.md\n".format(toctree),
+                "include.md": ":orphan:\n\n## Included\n\n- a\n- b\n",
+            }
+        )
+
+    def read_report(self, name: str) -> Any:
+        with open(self.outdir / name, newline="") as f:
+            if name.endswith(".csv"):
+                return list(csv.DictReader(f))
+            return json.load(f)
+
+    def test_disabled(self) -> None:
+        self.write_docs(1)
+        app = self.build()
+        self.assertEqual({}, app.env.mdinclude_metrics)  # type: ignore[attr-defined]
+
+    def test_report(self) -> None:
+        self.write_docs(2)
+        self.build(md_metrics_report="metrics.json", md_metrics_top=2)
+        self.assertEqual("", self.warnings.getvalue())
+
+        records = self.read_report("metrics.json")
+        self.assertEqual(
+            [
+                ("include", "include.md", "document"),
+                ("index", "include.md", "mdinclude"),
+                ("page0", "page0.md", "document"),
+                ("page1", "page1.md", "document"),
+            ],
+            [(r["docname"], r["source"], r["kind"]) for r in records],
+        )
+        for record in records:
+            self.assertGreater(record["input_bytes"], 0)
+            self.assertGreater(record["output_bytes"], 0)
+            self.assertGreater(record["tokens"], 0)
+            self.assertGreater(record["conversion_time"], 0)
+            self.assertGreater(record["parse_time"], 0)
+
+        log = self.status.getvalue()
+        self.assertIn("Slowest Markdown conversions", log)
+        self.assertEqual(2, log.count(" ms  "))
+
+        # unchanged documents keep their metrics from the previous build
+        self.write({"page0.md": "# Changed\n"})
+        self.build(md_metrics_report="metrics.csv")
+        records = self.read_report("metrics.csv")
+        self.assertEqual(4, len(records))
+        self.assertEqual("10", records[2]["input_bytes"])
+
+    def test_marker(self) -> None:
+        self.write(
+            {
+                "index.rst": "Index\n=====\n\n"
+                ".. mdinclude-metrics-marker:: 0\n\n"
+                ".. {}:: 0\n\n"
+                ".. mdinclude:: include.md\n".format(MetricsMarker.name),
+                "include.md": ":orphan:\n\nIncluded.\n",
+            }
+        )
+        self.build(md_metrics_report="metrics.json")
+        warnings = self.warnings.getvalue()
+        # documents can't stop the clock of an include
+        self.assertIn('Unknown directive type "mdinclude-metrics-marker"', warnings)
+        self.assertIn("invalid metrics marker: 0", warnings)
+        records = self.read_report("metrics.json")
+        self.assertGreater(records[1]["parse_time"], 0)
+
+    def test_parallel(self) -> None:
+        self.write_docs(8)
+        self.build(parallel=2, md_metrics_report="metrics.json")
+        self.assertNotIn("WARNING", self.warnings.getvalue())
+        records = self.read_report("metrics.json")
+        self.assertEqual(10, len(records))
+        self.assertTrue(all(r["conversion_time"] > 0 for r in records))
+
+
+class ShadowTest(MetricsTest):
+    def test_match(self) -> None:
+        self.write_docs(2)
+        self.build(md_shadow_rate=1.0, md_metrics_report="metrics.json")
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertIn("4 conversions checked, 0 differ", self.status.getvalue())
+        records = self.read_report("metrics.json")
+        self.assertEqual(["match"] * 4, [r["shadow"] for r in records])
+        self.assertTrue(all(r["shadow_time"] > 0 for r in records))
+
+    def test_diverged(self) -> None:
+        class Strong(RestRenderer):
+            def strong(self, text: str) -> str:
+                return "**{}** ".format(text)
+
+        self.write({"index.md": "# Title\n\nPlain.\n\nSome **bold**.\n"})
+        with patch.object(
+            RestMarkdown, "reference", lambda self: RestMarkdown(renderer=Strong())
+        ):
+            self.build(md_shadow_rate=1.0)
+        warnings = self.warnings.getvalue()
+        self.assertIn("index.md differs from the reference pipeline", warnings)
+        self.assertIn("-Some **bold** .", warnings)
+        self.assertIn("minimal input:\nSome **bold**.", warnings)
+        self.assertIn("1 conversions checked, 1 differ", self.status.getvalue())
+
+    def test_error(self) -> None:
+        class Broken(RestRenderer):
+            def strong(self, text: str) -> str:
+                raise ValueError("broken")
+
+        self.write({"index.md": "# Title\n\nSome **bold**.\n"})
+        with patch.object(
+            RestMarkdown, "reference", lambda self: RestMarkdown(renderer=Broken())
+        ):
+            self.build(md_shadow_rate=1.0)
+        warnings = self.warnings.getvalue()
+        self.assertIn("shadow check of index.md failed: ValueError: broken", warnings)
+        self.assertIn(
+            "1 conversions checked, 0 differ, 1 failed", self.status.getvalue()
+        )
+        self.assertTrue((self.outdir / "index.html").exists())
+
+    def test_parallel(self) -> None:
+        self.write_docs(8)
+        self.build(parallel=2, md_shadow_rate=1.0)
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertIn("10 conversions checked, 0 differ", self.status.getvalue())
+
+
+class RelativeLinksTest(SphinxTestBase):
+    FILES = {
+        "index.md": """\
+            # Index
+
+            .. toctree::
+
+               guide/usage
+               other
+
+            See [usage](guide/usage.md), [the options](guide/usage.md#options),
+            [unknown anchor](guide/usage.md#nope), [rst page](other.rst),
+            [by docname](other), [a file](data.txt), and [web](https://example.com).
+            """,
+        "guide/usage.md": """\
+            # Usage
+
+            ## Options
+
+            Back to [index](../index.md#index).
+
+            .. mdinclude:: ../../README.md
+            """,
+        "other.rst": "Other\n=====\n",
+        "../README.md": "Read [the usage](docs/guide/usage.md#usage).\n",
+    }
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.srcdir = self.root / "docs"
+        self.srcdir.mkdir()
+
+    def test_relative_links(self) -> None:
+        self.write(self.FILES)
+        app = self.build(md_parse_relative_links=True)
+        self.assertEqual("", self.warnings.getvalue())
+
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn('href="guide/usage.html"', index)
+        self.assertIn('href="guide/usage.html#options"', index)
+        for text in ("rst page", "by docname"):
+            self.assertIn(
+                'href="other.html"><span class="doc">{}</span>'.format(text), index
+            )
+        self.assertIn('href="data.txt"', index)
+        self.assertIn('href="https://example.com"', index)
+
+        usage = (self.outdir / "guide" / "usage.html").read_text()
+        self.assertIn('href="../index.html#index"', usage)
+        self.assertIn('href="#usage"', usage)
+
+        labels = app.env.get_domain("std").labels  # type: ignore[attr-defined]
+        self.assertEqual(
+            ("guide/usage", "options", "Options"), labels["guide/usage#options"]
+        )
+
+    def test_unmatched_sections(self) -> None:
+        self.write(
+            {
+                "index.md": """\
+                    # Index
+
+                    .. toctree::
+
+                       usage
+
+                    See [the options](usage.md#options) and [hidden](usage.md#hidden).
+                    """,
+                "usage.md": """\
+                    # Usage
+
+                    .. mdinclude:: ../intro.md
+
+                    .. note::
+
+                       ## Hidden
+
+                    ## Options
+
+                    Text.
+                    """,
+                "../intro.md": "## Intro\n\nIncluded.\n",
+            }
+        )
+        app = self.build(md_parse_relative_links=True)
+        self.assertEqual("", self.warnings.getvalue())
+
+        labels = app.env.get_domain("std").labels  # type: ignore[attr-defined]
+        self.assertEqual(("usage", "options", "Options"), labels["usage#options"])
+        # headings without a section lead to the document
+        self.assertEqual(("usage", "usage", "Usage"), labels["usage#hidden"])
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn('href="usage.html#options"', index)
+        self.assertIn('href="usage.html#usage"', index)
+
+    def test_shared_titles(self) -> None:
+        self.write(
+            {
+                "index.md": """\
+                    # Index
+
+                    .. toctree::
+
+                       a
+                       b
+
+                    ## Installation
+
+                    See [a](a.md#installation) and [b](b.md#installation).
+                    """,
+                "a.md": "# A\n\n## Installation\n\nFor a.\n",
+                "b.md": "# B\n\n## Installation\n\nFor b.\n",
+            }
+        )
+        app = self.build(md_parse_relative_links=True)
+        self.assertEqual("", self.warnings.getvalue())
+
+        labels = app.env.get_domain("std").labels  # type: ignore[attr-defined]
+        self.assertEqual(
+            ("b", "installation", "Installation"), labels["b#installation"]
+        )
+        # titles stay implicit, and are not labels of the project
+        self.assertNotIn("installation", labels)
+        self.assertNotIn("a", labels)
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn('href="a.html#installation"', index)
+        self.assertIn('href="b.html#installation"', index)
+
+    def test_disabled(self) -> None:
+        self.write(
+            {"index.md": "# Index\n\n[other](other.md)\n", "other.md": ":orphan:\n"}
+        )
+        self.build()
+        self.assertIn('href="other.md"', (self.outdir / "index.html").read_text())
+
+
+class ReferenceLinksTest(SphinxTestBase):
+    def test_reference_links(self) -> None:
+        self.write(
+            {
+                "index.md": """\
+                    # Index
+
+                    See [foo], [bar][], and [the docs][docs].
+
+                    [bar]: https://local.example.com/bar
+
+                    .. mdinclude:: include.md
+                    """,
+                "include.md": ":orphan:\n\nAlso [foo].\n",
+                "links/main.md": "[foo]: https://example.com/foo\n[docs]: https://docs\n",
+                "links/extra.md": "[docs]: https://ignored\n[bar]: https://bar\n",
+            }
+        )
+        config: Dict[str, Any] = {
+            "md_reference_links": ["links/main.md", "links/extra.md"],
+            "exclude_patterns": ["links"],
+        }
+        self.build(**config)
+        self.assertEqual("", self.warnings.getvalue())
+        index = (self.outdir / "index.html").read_text()
+        self.assertEqual(2, index.count('href="https://example.com/foo"'))
+        self.assertIn('href="https://local.example.com/bar"', index)
+        self.assertIn('href="https://docs"', index)
+        self.assertNotIn("ignored", index)
+
+        # documents are rebuilt when the shared definitions change
+        self.write({"links/main.md": "[foo]: https://example.com/new\n"})
+        self.build(**config)
+        index = (self.outdir / "index.html").read_text()
+        self.assertEqual(2, index.count('href="https://example.com/new"'))
+        self.assertIn('href="https://ignored"', index)
+
+    def test_missing_file(self) -> None:
+        self.write(
+            {
+                "index.md": "# Index\n\nSee [foo].\n",
+                "other.md": ":orphan:\n\nAlso [foo].\n",
+                "links.md": ":orphan:\n\n[foo]: https://example.com/foo\n",
+            }
+        )
+        self.build(md_reference_links=["missing.md", "links.md"])
+        warnings = self.warnings.getvalue()
+        self.assertEqual(1, warnings.count("WARNING"))
+        self.assertIn("md_reference_links: cannot read missing.md: No such", warnings)
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn('href="https://example.com/foo"', index)
+
+
+class FragmentsTest(SphinxTestBase):
+    def test_disabled(self) -> None:
+        self.write({"index.md": "# Index\n\n{!note.md!}\n", "note.md": ":orphan:\n"})
+        self.build()
+        self.assertIn("{!note.md!}", (self.outdir / "index.html").read_text())
+
+    def test_fragments(self) -> None:
+        self.write(
+            {
+                "index.md": "# Index\n\n{!_fragments/note.md!}\n\n.. mdinclude:: inc.md\n",
+                "inc.md": ":orphan:\n\nIncluded.\n\n{!_fragments/note.md!}\n",
+                "_fragments/note.md": "Note: {!nested.md!}\n\n{!nested.md!}\n",
+                "_fragments/nested.md": "Nested v1.\n",
+            }
+        )
+        config: Dict[str, Any] = {
+            "exclude_patterns": ["_fragments"],
+            "md_fragments": True,
+        }
+        self.build(**config)
+        self.assertEqual("", self.warnings.getvalue())
+        index = (self.outdir / "index.html").read_text()
+        self.assertEqual(2, index.count("Nested v1."))
+        self.assertEqual(2, index.count("Note: {!nested.md!}"))
+
+        # changing a nested fragment rebuilds only the documents that include it
+        self.write({"_fragments/nested.md": "Nested v2.\n", "other.md": ":orphan:\n"})
+        app = self.build(**config)
+        index = (self.outdir / "index.html").read_text()
+        self.assertEqual(2, index.count("Nested v2."))
+        self.assertIn("2 changed", self.status.getvalue())
+        self.assertIn(
+            str(self.srcdir / "_fragments" / "nested.md"),
+            app.env.dependencies["index"],
+        )
+
+    def test_errors(self) -> None:
+        self.write(
+            {
+                "index.md": "# Index\n\n{!_fragments/a.md!}\n\n{!missing.md!}\n",
+                "_fragments/a.md": "{!a.md!}\n",
+            }
+        )
+        self.build(exclude_patterns=["_fragments"], md_fragments=True)
+        warnings = self.warnings.getvalue()
+        self.assertIn(
+            "WARNING: include cycle: _fragments/a.md -> _fragments/a.md", warnings
+        )
+        self.assertIn("cannot include missing.md", warnings)
+
+
+class GlobIncludeTest(SphinxTestBase):
+    def write_endpoints(self, *numbers: int) -> None:
+        self.write(
+            {
+                "endpoints/e{}.md".format(n): "# Endpoint {0}\n\nText {0}.\n".format(n)
+                for n in numbers
+            }
+        )
+
+    def titles(self, app: Sphinx, docname: str) -> Any:
+        doctree = app.env.get_doctree(docname)
+        return [
+            (section.parent.tagname, section[0].astext())
+            for section in doctree.findall(nodes.section)
+        ]
+
+    def test_glob(self) -> None:
+        self.write_endpoints(1, 2, 10)
+        self.write(
+            {
+                "index.rst": """\
+                    API
+                    ===
+
+                    .. mdinclude:: endpoints/*.md
+                       :glob:
+                       :sort: natural
+                       :heading-offset: 1
+                       :separator: ----
+                    """,
+            }
+        )
+        config: Dict[str, Any] = {"exclude_patterns": ["endpoints"]}
+        app = self.build(**config)
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertEqual(
+            [
+                ("document", "API"),
+                ("section", "Endpoint 1"),
+                ("section", "Endpoint 2"),
+                ("section", "Endpoint 10"),
+            ],
+            self.titles(app, "index"),
+        )
+        doctree = app.env.get_doctree("index")
+        self.assertEqual(2, len(list(doctree.findall(nodes.transition))))
+        for n in (1, 2, 10):
+            self.assertIn(
+                str(Path("endpoints") / "e{}.md".format(n)),
+                app.env.dependencies["index"],
+            )
+
+        # nothing changed, nothing to read again
+        self.build(**config)
+        self.assertIn("0 changed", self.status.getvalue())
+
+        # a new file matching the pattern rebuilds the page
+        self.write_endpoints(3)
+        app = self.build(**config)
+        self.assertIn("1 changed", self.status.getvalue())
+        titles = [title for _, title in self.titles(app, "index")]
+        self.assertEqual(["API", "Endpoint 1", "Endpoint 2", "Endpoint 3"], titles[:4])
+
+        # and so does removing one
+        (self.srcdir / "endpoints" / "e2.md").unlink()
+        app = self.build(**config)
+        self.assertIn("1 changed", self.status.getvalue())
+        titles = [title for _, title in self.titles(app, "index")]
+        self.assertEqual(["API", "Endpoint 1", "Endpoint 3", "Endpoint 10"], titles)
+
+    def test_sort(self) -> None:
+        self.write_endpoints(1, 2, 10)
+        self.write(
+            {
+                "index.rst": """\
+                    .. mdinclude:: endpoints/*.md
+                       :glob:
+                       :reversed:
+
+                    .. mdinclude:: endpoints/missing-*.md
+                       :glob:
+                    """,
+            }
+        )
+        app = self.build(exclude_patterns=["endpoints"])
+        self.assertIn(
+            'No files match "endpoints/missing-*.md"', self.warnings.getvalue()
+        )
+        titles = [title for _, title in self.titles(app, "index")]
+        self.assertEqual(["Endpoint 2", "Endpoint 10", "Endpoint 1"], titles)
+
+
+class DocumentContextTest(SphinxTestBase):
+    def test_shared_context(self) -> None:
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. mdinclude:: a.md
+
+                    .. mdinclude:: b.md
+
+                    .. mdinclude:: b.md
+                    """,
+                "a.md": "A <b>bold</b> word.\n\n[ref]: https://example.com/a\n",
+                "b.md": "B <i>italic</i> [link][ref].\n",
+            }
+        )
+        app = self.build(exclude_patterns=["*.md"])
+        self.assertEqual("", self.warnings.getvalue())
+        doctree = app.env.get_doctree("index")
+        self.assertFalse(hasattr(doctree, "mdinclude_context"))
+        refs = [ref["refuri"] for ref in doctree.findall(nodes.reference)]
+        self.assertEqual(["https://example.com/a"] * 2, refs)
+        raw = [node.astext() for node in doctree.findall(nodes.raw)]
+        self.assertEqual(["<b>bold</b>", "<i>italic</i>", "<i>italic</i>"], raw)
+
+
+class MetadataTest(SphinxTestBase):
+    def test_event(self) -> None:
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. toctree::
+
+                       page
+
+                    .. mdinclude:: parts/*.md
+                       :glob:
+                       :heading-offset: 1
+                    """,
+                "page.md": "# Page\n\nSee [docs](https://example.com).\n",
+                "parts/a.md": "# Part A\n\n![logo](https://example.com/logo.png)\n",
+                "parts/b.md": "# Part B\n\nSee [part A](a.md).\n",
+            }
+        )
+        received: List[Tuple[str, str, DocumentMetadata]] = []
+
+        def listener(app: Any, docname: str, source: str, metadata: Any) -> None:
+            received.append((docname, source, metadata))
+
+        self.build(
+            exclude_patterns=["parts"], listeners={"mdinclude-metadata": listener}
+        )
+        self.assertEqual("", self.warnings.getvalue())
+        received.sort(key=lambda item: item[:2])
+        self.assertEqual(
+            [
+                ("index", "parts/a.md"),
+                ("index", "parts/b.md"),
+                ("page", "page.md"),
+            ],
+            [item[:2] for item in received],
+        )
+        a, b, page = (item[2] for item in received)
+        self.assertEqual([HeadingInfo(2, "Part A", "part-a")], a.headings)
+        self.assertEqual(
+            ["https://example.com/logo.png"], [image.url for image in a.images]
+        )
+        self.assertEqual([LinkInfo("a.md", "part A")], b.links)
+        self.assertEqual("Page", page.title)
+        self.assertEqual([LinkInfo("https://example.com", "docs")], page.links)
+
+
+class BlockCacheTest(SphinxTestBase):
+    FOOTER = "Licensed under the *MIT* license, see `LICENSE`.\n"
+
+    def setUp(self) -> None:
+        super().setUp()
+        # shared by every build in the process
+        caches = patch.dict(BLOCK_CACHES, clear=True)
+        caches.start()
+        self.addCleanup(caches.stop)
+
+    def write_pages(self) -> None:
+        files = {
+            "index.rst": """\
+                Index
+                =====
+
+                .. toctree::
+
+                   page0
+                   page1
+                   page2
+                """,
+        }
+        for n in range(3):
+            files["page{}.md".format(n)] = (
+                "# Page {}\n\nSee [page](page0.md).\n\n{}".format(n, self.FOOTER)
+            )
+        self.write(files)
+
+    def texts(self, app: Sphinx) -> Dict[str, str]:
+        return {
+            name: app.env.get_doctree(name).astext()
+            for name in ("page0", "page1", "page2")
+        }
+
+    def test_block_cache(self) -> None:
+        self.write_pages()
+        expected = self.texts(self.build(md_parse_relative_links=True))
+        self.assertNotIn("block cache", self.status.getvalue())
+
+        self.outdir = self.root / "cached"
+        app = self.build(md_parse_relative_links=True, md_block_cache_size=1 << 20)
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertEqual(expected, self.texts(app))
+        # headings differ, and relative links depend on the document
+        self.assertIn(
+            "Markdown block cache: 2 of 9 blocks reused (22%), 3 not cacheable",
+            self.status.getvalue(),
+        )
+
+    def test_parallel(self) -> None:
+        self.write_pages()
+        self.build(parallel=2, md_block_cache_size=1 << 20)
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertRegex(self.status.getvalue(), r"of 9 blocks reused")
+
+
+class NodeCacheTest(SphinxTestBase):
+    def setUp(self) -> None:
+        super().setUp()
+        # shared by every build in the process
+        caches = patch.dict(NODE_CACHES, clear=True)
+        caches.start()
+        self.addCleanup(caches.stop)
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. toctree::
+
+                       a
+                       b
+                    """,
+                "a.rst": """\
+                    A
+                    =
+
+                    .. mdinclude:: shared.md
+
+                    .. mdinclude:: warn.md
+
+                    .. mdinclude:: readme.md
+                    """,
+                "b.rst": """\
+                    B
+                    =
+
+                    .. mdinclude:: shared.md
+
+                    .. mdinclude:: warn.md
+
+                    .. mdinclude:: label.md
+
+                    .. mdinclude:: readme.md
+                    """,
+                "shared.md": """\
+                    Some *text*, see :ref:`label`, [docs](https://example.com)
+                    and `Readme`_.
+
+                    ```python
+                    print(1)
+                    ```
+
+                    .. note:: Careful.
+                    """,
+                "warn.md": "Before.\n\n.. note::\n\nAfter.\n",
+                "label.md": ".. _label:\n\nLabelled.\n",
+                "readme.md": "# Readme\n\nRead me.\n\n## Usage\n\nUse it.\n",
+            }
+        )
+
+    def attribution(self, app: Sphinx, docname: str) -> List[Tuple[Any, ...]]:
+        # without targets, whose line inserted rst counts from the start of the
+        # document, not from the start of the Markdown file
+        return [
+            (node.tagname, node.source, node.line)
+            for node in app.env.get_doctree(docname).findall(nodes.Element)
+            if not isinstance(node, nodes.target)
+        ]
+
+    def sections(self, app: Sphinx, docname: str) -> List[Tuple[str, List[str]]]:
+        doctree = app.env.get_doctree(docname)
+        return [(s.parent.tagname, s["ids"]) for s in doctree.findall(nodes.section)]
+
+    def test_node_cache(self) -> None:
+        exclude = ["*.md"]
+        app = self.build(exclude_patterns=exclude)
+        expected = {d: self.attribution(app, d) for d in ("a", "b")}
+        texts = {d: app.env.get_doctree(d).astext() for d in ("a", "b")}
+        sections = {d: self.sections(app, d) for d in ("a", "b")}
+        warnings = self.warnings.getvalue()
+        self.assertEqual(2, warnings.count("warn.md:4: ERROR: Content block"))
+        self.assertNotIn("node cache", self.status.getvalue())
+
+        self.outdir = self.root / "cached"
+        app = self.build(exclude_patterns=exclude, md_node_cache_size=16)
+        # warnings are reported for every parse, from the Markdown files
+        self.assertEqual(warnings, self.warnings.getvalue())
+        for docname in ("a", "b"):
+            self.assertEqual(expected[docname], self.attribution(app, docname))
+            self.assertEqual(texts[docname], app.env.get_doctree(docname).astext())
+            self.assertEqual(sections[docname], self.sections(app, docname))
+        # headings of an include are siblings of the including page's title
+        self.assertEqual(
+            [("document", ["b"]), ("document", ["readme"]), ("section", ["usage"])],
+            self.sections(app, "b"),
+        )
+        self.assertIn(
+            "Markdown node cache: 1 of 7 subtrees reused (14%), 3 not cacheable; "
+            "1 subtrees cached",
+            self.status.getvalue(),
+        )
+
+        doctree = app.env.get_doctree("b")
+        refids = [ref.get("refid") for ref in doctree.findall(nodes.reference)]
+        self.assertIn("readme", refids)
+        self.assertEqual("b", app.env.domaindata["std"]["anonlabels"]["label"][0])
+
+    def test_parallel(self) -> None:
+        self.build(parallel=2, exclude_patterns=["*.md"], md_node_cache_size=16)
+        self.assertEqual(2, self.warnings.getvalue().count("warn.md:4: ERROR"))
+        self.assertRegex(self.status.getvalue(), r"of 7 subtrees reused")
+
+
+class SlowConversionTest(SphinxTestBase):
+    def test_profile(self) -> None:
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. toctree::
+
+                       page
+
+                    .. mdinclude:: include.md
+                    """,
+                "page.md": "# Page\n\nSome *text*.\n",
+                "include.md": "Included **text**.\n",
+            }
+        )
+        self.build(exclude_patterns=["include.md"], md_slow_threshold=10.0)
+        self.assertEqual("", self.warnings.getvalue())
+
+        self.outdir = self.root / "slow"
+        self.build(exclude_patterns=["include.md"], md_slow_threshold=0)
+        warnings = self.warnings.getvalue()
+        self.assertEqual(2, warnings.count("WARNING"))
+        profiles = self.outdir / ".doctrees" / "mdinclude-profiles"
+        for source in ("page.md", "include.md"):
+            digest = hashlib.sha256((self.srcdir / source).read_bytes()).hexdigest()
+            self.assertRegex(
+                warnings, r"Markdown conversion of {} took \d+\.\d ms".format(source)
+            )
+            self.assertIn("(input sha256 {}, ".format(digest), warnings)
+            profile = profiles / (digest[:16] + ".prof")
+            self.assertIn("profile saved to {}".format(profile), warnings)
+            self.assertTrue(profile.exists())
+            self.assertTrue(profile.with_suffix(".json").exists())
+
+
+class ResourcesTest(SphinxTestBase):
+    def write_archive(self, text: str) -> None:
+        with zipfile.ZipFile(self.srcdir / "plugin.zip", "w") as archive:
+            archive.writestr("docs/readme.md", text)
+
+    def test_archive(self) -> None:
+        self.write_archive("# Plugin\n\nVersion 1.\n\n## Usage\n\nUse it.\n")
+        self.write(
+            {
+                "index.rst": """\
+                    Index
+                    =====
+
+                    .. mdinclude:: plugin.zip!docs/readme.md
+
+                    .. mdinclude:: plugin.zip!/docs/readme.md
+                       :section: Usage
+                    """,
+            }
+        )
+        self.build()
+        self.assertEqual("", self.warnings.getvalue())
+        index = (self.outdir / "index.html").read_text()
+        self.assertIn("Version 1.", index)
+        self.assertEqual(2, index.count("Use it."))
+
+        # a new archive with the same content rebuilds nothing
+        self.write_archive("# Plugin\n\nVersion 1.\n\n## Usage\n\nUse it.\n")
+        self.build()
+        self.assertNotIn("1 changed", self.status.getvalue())
+
+        self.write_archive("# Plugin\n\nVersion 2.\n\n## Usage\n\nUse it.\n")
+        self.build()
+        self.assertIn("1 changed", self.status.getvalue())
+        self.assertIn("Version 2.", (self.outdir / "index.html").read_text())
+
+    def test_package(self) -> None:
+        self.write(
+            {
+                "index.rst": """\
+                    .. mdinclude:: tests/test.md
+                       :package: sphinx_mdinclude
+                       :section: SubTitle
+
+                    .. mdinclude:: missing.zip!readme.md
+                    """,
+            }
+        )
+        self.build()
+        self.assertIn(
+            "<strong>content</strong>", (self.outdir / "index.html").read_text()
+        )
+        self.assertIn("missing.zip", self.warnings.getvalue())
+
+    def test_parse_resource(self) -> None:
+        base = str(self.srcdir)
+        (self.srcdir / "bundle").write_bytes(b"")
+        self.assertEqual(
+            Resource(ARCHIVE, str(self.srcdir / "plugin.zip"), "docs/readme.md"),
+            parse_resource("plugin.zip!/docs/readme.md", base),
+        )
+        self.assertEqual(
+            Resource(ARCHIVE, str(self.srcdir / "bundle"), "readme.md"),
+            parse_resource("bundle!readme.md", base),
+        )
+        self.assertEqual(
+            Resource(ARCHIVE, str(self.srcdir / "a!b.whl"), "readme.md"),
+            parse_resource("a!b.whl!readme.md", base),
+        )
+        self.assertIsNone(parse_resource("notes/hello!.md", base))
+
+    def test_exclamation_mark(self) -> None:
+        self.write(
+            {
+                "index.rst": ".. mdinclude:: news/hello!.md\n",
+                "news/hello!.md": ":orphan:\n\nHello **there**.\n",
+            }
+        )
+        self.build()
+        self.assertEqual("", self.warnings.getvalue())
+        self.assertIn(
+            "<strong>there</strong>", (self.outdir / "index.html").read_text()
+        )
+
+    def test_archive_cache(self) -> None:
+        self.write_archive("one")
+        cache = ArchiveCache()
+        path = str(self.srcdir / "plugin.zip")
+        self.assertEqual(b"one", cache.read(path, "docs/readme.md"))
+        handle = cache._open(path).zip
+        self.assertIs(handle, cache._open(path).zip)
+        with self.assertRaisesRegex(FileNotFoundError, "missing.md"):
+            cache.read(path, "missing.md")
+
+        self.write_archive("two, changed")
+        self.assertEqual(b"two, changed", cache.read(path, "docs/readme.md"))
+        self.assertIsNot(handle, cache._open(path).zip)
+        cache.close()
+        self.assertEqual(0, len(cache))
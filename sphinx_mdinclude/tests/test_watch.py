@@ -0,0 +1,150 @@
+# Copyright Amethyst Reese
+# Licensed under the MIT License
+
+import os
+import threading
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, List
+from unittest.mock import patch
+
+from ..parse import ConversionLimits
+from ..render import convert
+from ..watch import Change, CONVERTED, FAILED, REMOVED, Watcher
+
+
+class WatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name) / "src"
+        self.out = Path(tmp.name) / "out"
+        (self.root / "sub").mkdir(parents=True)
+        self.write("a.md", "# A\n")
+        self.write("sub/b.md", "# B\n")
+
+    def write(self, name: str, text: str) -> None:
+        path = self.root / name
+        mtime = path.stat().st_mtime_ns if path.exists() else 0
+        path.write_text(text)
+        # make sure the change is visible on filesystems with coarse mtimes
+        os.utime(path, ns=(mtime + 10**9, mtime + 10**9))
+
+    def actions(self, changes: List[Change]) -> List[List[str]]:
+        return [[change.action, change.path] for change in changes]
+
+    def test_scan(self) -> None:
+        watcher = Watcher(str(self.root), str(self.out))
+        self.assertEqual(
+            [[CONVERTED, "a.md"], [CONVERTED, os.path.join("sub", "b.md")]],
+            sorted(self.actions(watcher.scan())),
+        )
+        self.assertEqual(convert("# B\n"), (self.out / "sub" / "b.rst").read_text())
+        self.assertEqual([], watcher.scan())
+
+        self.write("a.md", "# A\n\nchanged\n")
+        self.assertEqual([[CONVERTED, "a.md"]], self.actions(watcher.scan()))
+        self.assertIn("changed", (self.out / "a.rst").read_text())
+
+        # saved again without changes
+        self.write("a.md", "# A\n\nchanged\n")
+        self.assertEqual([], watcher.scan())
+
+        (self.root / "sub" / "b.md").unlink()
+        self.assertEqual(
+            [[REMOVED, os.path.join("sub", "b.md")]], self.actions(watcher.scan())
+        )
+        self.assertFalse((self.out / "sub" / "b.rst").exists())
+
+    def test_failure(self) -> None:
+        watcher = Watcher(str(self.root), limits=ConversionLimits(max_size=6))
+        watcher.scan()
+        self.write("a.md", "# Too long\n")
+        (change,) = watcher.scan()
+        self.assertEqual(FAILED, change.action)
+        self.assertIn("input size", str(change))
+        # the previous output is left alone
+        self.assertEqual(convert("# A\n"), (self.root / "a.rst").read_text())
+
+    def test_errors(self) -> None:
+        watcher = Watcher(str(self.root), str(self.out))
+        watcher.scan()
+
+        (self.root / "a.md").write_bytes(b"# \xff\n")
+        (change,) = watcher.scan()
+        self.assertEqual(FAILED, change.action)
+        self.assertIn("UnicodeDecodeError", change.error)
+
+        # the output can't be written
+        (self.out / "sub" / "b.rst").unlink()
+        (self.out / "sub" / "b.rst").mkdir()
+        self.write("sub/b.md", "# B2\n")
+        self.assertEqual(
+            [[FAILED, os.path.join("sub", "b.md")]], self.actions(watcher.scan())
+        )
+
+        def broken(text: str) -> str:
+            raise RuntimeError("bug")
+
+        with patch.object(watcher, "converter", broken):
+            self.write("a.md", "# A2\n")
+            (change,) = watcher.scan()
+        self.assertEqual("RuntimeError: bug", change.error)
+
+        # failed files are converted again once they change
+        (self.out / "sub" / "b.rst").rmdir()
+        self.write("a.md", "# A3\n")
+        self.write("sub/b.md", "# B3\n")
+        self.assertEqual(
+            [[CONVERTED, "a.md"], [CONVERTED, os.path.join("sub", "b.md")]],
+            sorted(self.actions(watcher.scan())),
+        )
+
+    def test_vanished(self) -> None:
+        watcher = Watcher(str(self.root), str(self.out))
+        watcher.scan()
+        # listed, but gone by the time it is read
+        self.write("a.md", "# A2\n")
+        path = str(self.root / "a.md")
+
+        def fake_open(name: str, *args: Any, **kwargs: Any) -> Any:
+            if name == path:
+                raise FileNotFoundError(name)
+            return open(name, *args, **kwargs)
+
+        with patch("sphinx_mdinclude.watch.open", fake_open, create=True):
+            self.assertEqual([[REMOVED, "a.md"]], self.actions(watcher.scan()))
+        self.assertFalse((self.out / "a.rst").exists())
+
+        # readable again, and a dangling link that can't be stat'ed
+        (self.root / "sub" / "b.md").unlink()
+        (self.root / "sub" / "b.md").symlink_to(self.root / "missing.md")
+        self.assertEqual(
+            [[CONVERTED, "a.md"], [REMOVED, os.path.join("sub", "b.md")]],
+            self.actions(watcher.scan()),
+        )
+        self.assertIn("A2", (self.out / "a.rst").read_text())
+
+    def test_watch(self) -> None:
+        watcher = Watcher(str(self.root), str(self.out))
+        watcher.scan()
+        changes: List[Change] = []
+        done = threading.Event()
+
+        def callback(change: Change) -> None:
+            changes.append(change)
+            done.set()
+
+        thread = threading.Thread(
+            target=watcher.watch, args=(0.01, callback, done.is_set)
+        )
+        thread.start()
+        try:
+            self.write("a.md", "# A2\n")
+            self.assertTrue(done.wait(5))
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual([[CONVERTED, "a.md"]], self.actions(changes))
+        self.assertLess(changes[0].latency, 1.0)
@@ -0,0 +1,188 @@
+"""
+Watch a directory of Markdown files, and keep their rst conversions up to date
+"""
+
+import hashlib
+import os
+import time
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from .parse import ConversionLimitExceeded
+from .render import get_converter
+
+CONVERTED = "converted"
+REMOVED = "removed"
+FAILED = "failed"
+
+
+class Change(NamedTuple):
+    """A source that changed, what was done about it, and how long it took.
+
+    ``latency`` is measured from when a scan noticed the change, so it does not
+    include the time until the next poll, of up to one interval.
+    """
+
+    path: str
+    action: str
+    latency: float
+    error: str = ""
+
+    def __str__(self) -> str:
+        message = "{} {} in {:.1f} ms".format(
+            self.action, self.path, self.latency * 1000
+        )
+        if self.error:
+            message += ": {}".format(self.error)
+        return message
+
+
+class _Source(NamedTuple):
+    stamp: Tuple[int, int]
+    digest: bytes
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ConversionLimitExceeded):
+        return str(error)
+    return "{}: {}".format(type(error).__name__, error)
+
+
+class Watcher:
+    """Convert changed Markdown files under ``root`` to rst in ``outdir``.
+
+    The converter stays warm between changes, and each file is remembered by its
+    mtime, size, and content hash, so a scan only reads files that look changed,
+    and only converts and rewrites files whose content did change.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        outdir: Optional[str] = None,
+        suffix: str = ".md",
+        **options: Any,
+    ) -> None:
+        self.root = os.path.abspath(root)
+        self.outdir = os.path.abspath(outdir or root)
+        self.suffix = suffix
+        self.converter = get_converter(**options)
+        self.sources: Dict[str, _Source] = {}
+
+    def output_path(self, path: str) -> str:
+        relpath = os.path.relpath(path, self.root)
+        return os.path.join(self.outdir, os.path.splitext(relpath)[0] + ".rst")
+
+    def _walk(self) -> Iterator[Tuple[str, os.stat_result]]:
+        # files and directories that disappear or can't be read while walking
+        # are left out, and treated as removed
+        stack = [self.root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.abspath(entry.path) != self.outdir:
+                            stack.append(entry.path)
+                    elif entry.name.endswith(self.suffix):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        yield entry.path, stat
+
+    def scan(self) -> List[Change]:
+        """Convert files that changed since the last scan, and remove stale output."""
+        changes = []
+        seen = set()
+        for path, stat in self._walk():
+            stamp = (stat.st_mtime_ns, stat.st_size)
+            known = self.sources.get(path)
+            if known is not None and known.stamp == stamp:
+                seen.add(path)
+                continue
+
+            started = time.perf_counter()
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                # removed since it was listed
+                continue
+            seen.add(path)
+            digest = hashlib.sha256(data).digest()
+            output = self.output_path(path)
+            if known is not None and known.digest == digest and os.path.exists(output):
+                # saved again without changes
+                self.sources[path] = _Source(stamp, digest)
+                continue
+
+            try:
+                rst = self.converter(data.decode("utf-8"))
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+                with open(output, "w", encoding="utf-8") as f:
+                    f.write(rst)
+            except Exception as error:
+                # keep the old output, and try again when the file changes
+                self.sources[path] = _Source(stamp, b"")
+                changes.append(
+                    Change(
+                        os.path.relpath(path, self.root),
+                        FAILED,
+                        time.perf_counter() - started,
+                        _describe(error),
+                    )
+                )
+                continue
+
+            self.sources[path] = _Source(stamp, digest)
+            changes.append(
+                Change(
+                    os.path.relpath(path, self.root),
+                    CONVERTED,
+                    time.perf_counter() - started,
+                )
+            )
+
+        for path in sorted(set(self.sources) - seen):
+            started = time.perf_counter()
+            del self.sources[path]
+            output = self.output_path(path)
+            try:
+                if os.path.exists(output):
+                    os.unlink(output)
+            except OSError as error:
+                changes.append(
+                    Change(
+                        os.path.relpath(path, self.root),
+                        FAILED,
+                        time.perf_counter() - started,
+                        _describe(error),
+                    )
+                )
+                continue
+            changes.append(
+                Change(
+                    os.path.relpath(path, self.root),
+                    REMOVED,
+                    time.perf_counter() - started,
+                )
+            )
+
+        return changes
+
+    def watch(
+        self,
+        interval: float = 0.1,
+        callback: Callable[[Change], None] = print,
+        stop: Optional[Callable[[], bool]] = None,
+    ) -> None:
+        """Scan every ``interval`` seconds, until ``stop()`` returns true."""
+        while not (stop and stop()):
+            for change in self.scan():
+                callback(change)
+            time.sleep(interval)